@@ -1,89 +1,204 @@
+import copy
 import json
 import reframed
 import pandas as pd
-import json
+from functools import lru_cache
 
-# Import reaction dataframe
-EGC_rxns = pd.read_excel("../input/EGC.xlsx",
-                         sheet_name="Sheet2",
-                         usecols="C:E")
-
-# Make reframed reactions
-rxns={}
-for index, row in EGC_rxns.iterrows():
-    if not row["Exists"]:
-        reaction_id = row['rxn_ID ']
-        reversible = True
-        stoichiometry = json.loads(row['stoichiometry'])
-        rxn = reframed.CBReaction(reaction_id=reaction_id, reversible=reversible, stoichiometry=stoichiometry)
-        rxns[row['rxn_ID ']]=rxn
-        
-        
 
-def EGC_identifier(model,print_results=False):
-    EGCs = {}
-    model_copy= model.copy()
-    
-    # Set lower bound to 0 to avoid infeasible solution because of NGAM
-    model_copy.reactions["R_ATPM"].lb=0
-    
-    for index, row in EGC_rxns.iterrows():
+@lru_cache(maxsize=None)
+def load_EGC_reactions(path="../input/EGC.xlsx"):
+    """Energy dissipation test reactions from EGC.xlsx, read once per process: (EGC_rxns, rxns)."""
+    # Import reaction dataframe
+    EGC_rxns = pd.read_excel(path,
+                             sheet_name="Sheet2",
+                             usecols="C:E")
 
+    # Make reframed reactions
+    rxns={}
+    for index, row in EGC_rxns.iterrows():
         if not row["Exists"]:
-            
-            reaction_compounds = rxns[row["rxn_ID "]].get_substrates()+rxns[row["rxn_ID "]].get_products()
-            has_compound = []
-
-            for met in reaction_compounds:
-                has_compound.append(met in model_copy.metabolites)
-            
-            if len(reaction_compounds)==sum(has_compound):
-                model_copy.add_reaction(rxns[row["rxn_ID "]])
-            else:
-                continue
-                
-        for rxn in model_copy.reactions:
-            if model_copy.reactions[rxn].lb<0:
-                model_copy.reactions[rxn].lb=-1000
-            if model_copy.reactions[rxn].ub>0:
-                model_copy.reactions[rxn].ub=1000
-                
-        # Set boundary to avoid infeasible problem
-        model_copy.reactions[row["rxn_ID "]].lb=0
-        model_copy.reactions[row["rxn_ID "]].ub=1000
+            reaction_id = row['rxn_ID ']
+            reversible = True
+            stoichiometry = json.loads(row['stoichiometry'])
+            rxn = reframed.CBReaction(reaction_id=reaction_id, reversible=reversible, stoichiometry=stoichiometry)
+            rxns[row['rxn_ID ']]=rxn
+    
+    return EGC_rxns, rxns
+
+
+def __getattr__(name):
+    # EGC_rxns and rxns used to be read at import; they are now loaded on first access
+    if name == "EGC_rxns":
+        return load_EGC_reactions()[0]
+    if name == "rxns":
+        return load_EGC_reactions()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
         
 
-        # Set environment to empty
-        env_empty = reframed.Environment.empty(model_copy)
+class EGCScanner:
+    """
+    Energy-generating-cycle scan on a single LP.
+
+    The model is copied once: R_ATPM is opened to lb=0, every applicable test
+    reaction of the EGC sheet is added up front and all bounds are widened to
+    +-1000. One reframed solver is built for this model and re-used for every
+    scan; between scans only the objective and the temporary bounds (empty
+    environment, the test reaction at (0, 1000) and the test reactions that are
+    closed) change.
+
+    scan() reproduces EGC_identifier: test reactions are checked in sheet order,
+    a reaction that carries flux is closed for the rest of the scan, and test
+    reactions that are not reached yet are not part of the model.
+    scan_parallel() splits the test reactions across worker processes; each
+    reaction is then checked on its own, with all other added test reactions
+    closed.
+    """
+
+    def __init__(self, model, EGC_data=None, tol=1e-7):
+        EGC_rxns, rxns = EGC_data if EGC_data is not None else load_EGC_reactions()
+        self.tol = tol
+
+        self.model = model.copy()
+        # Set lower bound to 0 to avoid infeasible solution because of NGAM
+        self.model.reactions["R_ATPM"].lb=0
 
-        # Set objective as the reaction in question
-        objective= {rxn:0 for rxn in model_copy.reactions}
-        objective[row["rxn_ID "]]=1
+        # Test reactions in sheet order; those not in the model yet are added now
+        self.test_rxns = []
+        self.added = set()
+        for index, row in EGC_rxns.iterrows():
+            reaction_id = row["rxn_ID "]
+            if not row["Exists"]:
+                reaction_compounds = rxns[reaction_id].get_substrates()+rxns[reaction_id].get_products()
+                if not all(met in self.model.metabolites for met in reaction_compounds):
+                    continue
+                self.model.add_reaction(copy.deepcopy(rxns[reaction_id]))
+                self.added.add(reaction_id)
+            self.test_rxns.append(reaction_id)
+
+        for rxn in self.model.reactions.values():
+            if rxn.lb<0:
+                rxn.lb=-1000
+            if rxn.ub>0:
+                rxn.ub=1000
+
+        # Bounds of every scan: empty environment
+        self.environment = dict(reframed.Environment.empty(self.model))
+        self.solver = reframed.solver_instance(self.model)
+
+    def scan_reaction(self, reaction_id, open_rxns=(), closed_rxns=()):
+        """
+        pFBA maximizing the flux through one test reaction.
+
+        open_rxns are test reactions kept at (0, 1000), closed_rxns are fixed to 0.
+        Returns the non-zero fluxes, or None if there is no cycle.
+        """
+        constraints = dict(self.environment)
+        constraints.update({rxn: (0, 0) for rxn in closed_rxns})
+        constraints.update({rxn: (0, 1000) for rxn in open_rxns})
+        # Set boundary to avoid infeasible problem
+        constraints[reaction_id] = (0, 1000)
 
         # Solve pFBA (not FBA to avoid finding energy-balanced cycles)
-        sol_pfba = reframed.pFBA(model_copy,objective=objective,constraints=env_empty)
+        sol_pfba = reframed.pFBA(self.model, objective={reaction_id: 1}, constraints=constraints,
+                                 solver=self.solver)
 
         # If flux through objective function is 0 -> no infeasible cycle for this compound
-        # -> continue to next cycle
-        
-        if abs(sol_pfba.fobj)<1e-7 :
-            if print_results:print('There are NO energy producing cycles in the model for '+str(row["rxn_ID "]))
-            continue
-        
-        if print_results: print('There are energy producing cycles in the model for '+str(row["rxn_ID "]))
-        
-        EGCs[row["rxn_ID "]]=[]
-
-        # For each reaction in the model I'm finding the associated rxn with flux.
-        for rxn,value in sol_pfba.values.items():
-            if abs(value)<1e-7:
-                continue
-            if print_results: print("\t" + str(rxn)+": " + str(value))
-            
-            EGCs[row["rxn_ID "]].append((rxn,value))
-        
-        # Set upper bound to 0 to avoid flux in the nex cycle. 
-        model_copy.reactions[row["rxn_ID "]].ub=0
+        if sol_pfba.fobj is None or abs(sol_pfba.fobj)<self.tol:
+            return None
+        return [(rxn, value) for rxn, value in sol_pfba.values.items() if abs(value)>=self.tol]
+
+    def scan(self, reactions=None, print_results=False):
+        """Cumulative scan in sheet order (the semantics of EGC_identifier)."""
+        reactions = self.test_rxns if reactions is None else reactions
+        EGCs = {}
+        tested = []
+        for i, reaction_id in enumerate(reactions):
+            closed = [rxn for rxn in EGCs] + [rxn for rxn in reactions[i+1:] if rxn in self.added]
+            fluxes = self.scan_reaction(reaction_id,
+                                        open_rxns=[rxn for rxn in tested if rxn not in EGCs],
+                                        closed_rxns=closed)
+            tested.append(reaction_id)
+            self._report(reaction_id, fluxes, print_results)
+            if fluxes is not None:
+                EGCs[reaction_id] = fluxes
+        return EGCs
+
+    def scan_independent(self, reactions=None, print_results=False):
+        """Check every test reaction on its own, with all other added test reactions closed."""
+        reactions = self.test_rxns if reactions is None else reactions
+        EGCs = {}
+        for reaction_id in reactions:
+            fluxes = self.scan_reaction(reaction_id,
+                                        closed_rxns=[rxn for rxn in self.added if rxn != reaction_id])
+            self._report(reaction_id, fluxes, print_results)
+            if fluxes is not None:
+                EGCs[reaction_id] = fluxes
+        return EGCs
+
+    def scan_parallel(self, processes=4, print_results=False):
+        """scan_independent with the test reactions split across worker processes."""
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = [self.test_rxns[i::processes] for i in range(processes)]
+        EGCs = {}
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(self.model, self.added, self.tol)) as executor:
+            for result in executor.map(_scan_chunk, chunks):
+                EGCs.update(result)
+
+        # Sheet order, independent of the split
+        EGCs = {rxn: EGCs[rxn] for rxn in self.test_rxns if rxn in EGCs}
+        for reaction_id in self.test_rxns:
+            self._report(reaction_id, EGCs.get(reaction_id), print_results)
+        return EGCs
+
+    @staticmethod
+    def _report(reaction_id, fluxes, print_results):
+        if not print_results:
+            return
+        if fluxes is None:
+            print('There are NO energy producing cycles in the model for '+str(reaction_id))
+            return
+        print('There are energy producing cycles in the model for '+str(reaction_id))
+        for rxn, value in fluxes:
+            print("\t" + str(rxn)+": " + str(value))
+
+    @classmethod
+    def _from_prepared(cls, model, added, tol):
+        # Scanner around a model that already holds the test reactions (worker processes)
+        scanner = cls.__new__(cls)
+        scanner.model, scanner.added, scanner.tol = model, set(added), tol
+        scanner.test_rxns = []
+        scanner.environment = dict(reframed.Environment.empty(model))
+        scanner.solver = reframed.solver_instance(model)
+        return scanner
+
+
+# Scanner of a worker process, built once by _init_worker
+_worker = {}
+
+
+def _init_worker(model, added, tol):
+    _worker["scanner"] = EGCScanner._from_prepared(model, added, tol)
+
+
+def _scan_chunk(reactions):
+    return _worker["scanner"].scan_independent(reactions)
+
+
+def EGC_identifier(model,print_results=False,EGC_data=None,processes=None):
+    """
+    Energy-generating cycles of model, as {test reaction: [(reaction, flux), ...]}.
+
+    With processes, the test reactions are checked independently in that many
+    worker processes (see EGCScanner.scan_parallel); otherwise they are checked
+    cumulatively in sheet order.
+    """
+    scanner = EGCScanner(model, EGC_data=EGC_data)
+    if processes:
+        EGCs = scanner.scan_parallel(processes, print_results=print_results)
+    else:
+        EGCs = scanner.scan(print_results=print_results)
     
     print("\033[92mThere are NO energy producing cycles in the model\033[0m" if len(EGCs) == 0 else "\033[91mThere ARE energy producing cycles in the model\033[0m")
-    return EGCs
\ No newline at end of file
+    return EGCs
@@ -0,0 +1,279 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+from dfba_cobra_cellulose import DynamicFBAProblem
+
+
+# GLPK bound types and basis statuses (see glpk.h)
+GLP_FR, GLP_LO, GLP_UP, GLP_DB, GLP_FX = 1, 2, 3, 4, 5
+GLP_BS, GLP_NL, GLP_NU, GLP_NF, GLP_NS = 1, 2, 3, 4, 5
+
+
+class _Basis:
+    """Optimal basis of one lexicographic stage."""
+
+    def __init__(self, basic, at_lower, at_upper, fixed, fixed_reduced_costs, nonbasic, lu):
+        self.basic = basic
+        self.at_lower = at_lower
+        self.at_upper = at_upper
+        self.fixed = fixed
+        # Reduced costs of the fixed columns, signed so that > 0 means "better at the upper bound"
+        self.fixed_reduced_costs = fixed_reduced_costs
+        self.nonbasic = nonbasic
+        self.lu = lu
+
+
+class BasisReuseProblem(DynamicFBAProblem):
+    """
+    Lexicographic dFBA problem that re-uses the optimal basis of every stage.
+
+    Between two RHS calls only the uptake bounds (and, through them, the bounds of
+    the lexicographic constraints) move. Costs and the constraint matrix stay the
+    same, so the optimal basis of a stage stays dual feasible and remains optimal
+    as long as the basic solution computed from the new bounds is primal feasible.
+    The basic solution is obtained with one sparse triangular solve against the
+    stored LU factors; only when the primal check fails (or the basis could not be
+    stored) is the LP re-solved with GLPK and the bases recorded again.
+
+    Columns that were fixed when a basis was recorded (e.g. the reverse uptake
+    variables at 0/0 while glucose and cellobiose are depleted) are placed at
+    the bound their reduced cost makes dual feasible once their bounds open up,
+    so the re-used basis stays optimal and not only feasible.
+
+    Results agree with the full re-solve up to the primal feasibility tolerance
+    ``tol`` (1e-7 by default, the same as GLPK's ``tol_bnd``). ``compare`` reports
+    the deviation at a given state and ``compare_trajectory`` the deviation of a
+    whole integration.
+
+    Requires the GLPK solver interface of optlang (cobra's default); with any
+    other solver every call falls back to the full re-solve.
+    """
+
+    def __init__(self, model, rxns, objective_dir, bounded_rxns=("EX_glc__D_e", "EX_cellb_e"), tol=1e-7):
+        super().__init__(model, rxns, objective_dir, bounded_rxns=bounded_rxns)
+        self.tol = tol
+        self.reused = 0
+        self.resolved = 0
+        self._bases = [None]*len(self.constraints)
+        self._recording = False
+
+        self.enabled = model.solver.interface.__name__.endswith("glpk_interface")
+        if self.enabled:
+            self._compile()
+
+    def _compile(self):
+        """Read the constraint matrix, bounds and stage objectives from GLPK."""
+        import swiglpk as glp
+        self._glp = glp
+
+        self.model.solver.update()
+        lp = self.model.solver.problem
+        glp.glp_create_index(lp)
+        m = glp.glp_get_num_rows(lp)
+        n = glp.glp_get_num_cols(lp)
+        self._lp, self._m, self._n = lp, m, n
+
+        rows, cols, vals = [], [], []
+        for i in range(1, m + 1):
+            length = glp.glp_get_mat_row(lp, i, None, None)
+            ind = glp.intArray(length + 1)
+            val = glp.doubleArray(length + 1)
+            glp.glp_get_mat_row(lp, i, ind, val)
+            for k in range(1, length + 1):
+                rows.append(i - 1)
+                cols.append(ind[k] - 1)
+                vals.append(val[k])
+        A = sp.csc_matrix((vals, (rows, cols)), shape=(m, n))
+
+        # Columns first, then one auxiliary variable per row: [A -I][x; r] = 0
+        self._M = sp.hstack([A, -sp.identity(m, format="csc")], format="csc")
+
+        lb = np.empty(n + m)
+        ub = np.empty(n + m)
+        for j in range(1, n + 1):
+            lb[j-1], ub[j-1] = self._read_bounds(glp.glp_get_col_type(lp, j),
+                                                 glp.glp_get_col_lb(lp, j),
+                                                 glp.glp_get_col_ub(lp, j))
+        for i in range(1, m + 1):
+            lb[n+i-1], ub[n+i-1] = self._read_bounds(glp.glp_get_row_type(lp, i),
+                                                     glp.glp_get_row_lb(lp, i),
+                                                     glp.glp_get_row_ub(lp, i))
+        self._lb, self._ub = lb, ub
+
+        self._col = lambda variable: glp.glp_find_col(lp, variable.name) - 1
+        self._bounded_cols = [(self._col(rxn.forward_variable), self._col(rxn.reverse_variable), rxn.upper_bound)
+                              for rxn in self.bounded]
+        self._stage_rows = [n + glp.glp_find_row(lp, constraint.name) - 1 for constraint in self.constraints]
+
+        self._costs = []
+        for coefficients in self._coefficients:
+            c = np.zeros(n + m)
+            for variable, coefficient in coefficients.items():
+                c[self._col(variable)] = coefficient
+            self._costs.append(c)
+
+    @staticmethod
+    def _read_bounds(bound_type, lb, ub):
+        if bound_type == GLP_FR:
+            return -np.inf, np.inf
+        if bound_type == GLP_LO:
+            return lb, np.inf
+        if bound_type == GLP_UP:
+            return -np.inf, ub
+        return lb, ub
+
+    def _optimize_stage(self, stage):
+        value = super()._optimize_stage(stage)
+        if self.enabled and self._recording:
+            self._bases[stage] = self._record_basis(stage)
+        return value
+
+    def _record_basis(self, stage):
+        """Store the current GLPK basis if it is non-singular and dual feasible."""
+        glp, lp, n, m = self._glp, self._lp, self._n, self._m
+
+        status = np.empty(n + m, dtype=int)
+        for j in range(1, n + 1):
+            status[j-1] = glp.glp_get_col_stat(lp, j)
+        for i in range(1, m + 1):
+            status[n+i-1] = glp.glp_get_row_stat(lp, i)
+
+        basic = np.flatnonzero(status == GLP_BS)
+        nonbasic = np.flatnonzero(status != GLP_BS)
+        if len(basic) != m:
+            return None
+        try:
+            lu = splu(self._M[:, basic].tocsc())
+        except RuntimeError:
+            return None
+
+        # Dual feasibility of the basis: reduced costs must have the right sign
+        # for every nonbasic variable. Costs and matrix never change, so this
+        # only needs to be checked once per recorded basis.
+        c = self._costs[stage]
+        duals = lu.solve(c[basic], trans="T")
+        reduced_costs = c - self._M.T @ duals
+        sign = 1 if self._directions[stage] == "max" else -1
+        if np.any(sign*reduced_costs[status == GLP_NL] > self.tol):
+            return None
+        if np.any(sign*reduced_costs[status == GLP_NU] < -self.tol):
+            return None
+        if np.any(np.abs(reduced_costs[status == GLP_NF]) > self.tol):
+            return None
+
+        fixed = np.flatnonzero(status == GLP_NS)
+        return _Basis(basic, np.flatnonzero(status == GLP_NL), np.flatnonzero(status == GLP_NU),
+                      fixed, sign*reduced_costs[fixed], nonbasic, lu)
+
+    def _basic_solution(self, basis, lb, ub):
+        """Basic solution for the given bounds, or None if it is not primal feasible."""
+        x = np.zeros(len(lb))
+        x[basis.at_lower] = lb[basis.at_lower]
+        x[basis.at_upper] = ub[basis.at_upper]
+        # Fixed columns whose bounds opened up go to the bound that keeps the basis dual feasible
+        fixed = basis.fixed
+        to_upper = (lb[fixed] < ub[fixed]) & (basis.fixed_reduced_costs > self.tol)
+        x[fixed] = np.where(to_upper, ub[fixed], lb[fixed])
+        if not np.all(np.isfinite(x[basis.nonbasic])):
+            return None
+
+        x[basis.basic] = basis.lu.solve(-(self._M[:, basis.nonbasic] @ x[basis.nonbasic]))
+        x_basic = x[basis.basic]
+        if np.any(x_basic < lb[basis.basic] - self.tol) or np.any(x_basic > ub[basis.basic] + self.tol):
+            return None
+        return x
+
+    def _reuse(self, lower_bounds, lexicographic):
+        """Compute the stage optima from the stored bases; None if a check fails."""
+        n_stages = len(self.constraints) if lexicographic else 1
+        if any(basis is None for basis in self._bases[:n_stages]):
+            return None
+
+        lb, ub = self._lb.copy(), self._ub.copy()
+        for (forward, reverse, upper_bound), lower_bound in zip(self._bounded_cols, lower_bounds):
+            # Same split into forward and reverse variables as cobra
+            lb[forward], ub[forward] = max(lower_bound, 0), max(upper_bound, 0)
+            lb[reverse], ub[reverse] = max(-upper_bound, 0), max(-lower_bound, 0)
+
+        values = np.empty(n_stages)
+        for stage in range(n_stages):
+            x = self._basic_solution(self._bases[stage], lb, ub)
+            if x is None:
+                return None
+            values[stage] = self._costs[stage] @ x
+            if self._directions[stage] == "max":
+                lb[self._stage_rows[stage]] = values[stage]
+            else:
+                ub[self._stage_rows[stage]] = values[stage]
+
+        return values
+
+    def solve_bounds(self, lower_bounds, lexicographic=True):
+        if self.enabled:
+            values = self._reuse(lower_bounds, lexicographic)
+            if values is not None:
+                self.reused += 1
+                return values[0], (values[1:] if lexicographic else None)
+
+        self.resolved += 1
+        self._recording = True
+        try:
+            return super().solve_bounds(lower_bounds, lexicographic=lexicographic)
+        finally:
+            self._recording = False
+
+    def compare(self, y, combination):
+        """Maximum absolute deviation between basis re-use and a full re-solve at state y."""
+        _, reused, _ = self.solve(y, combination)
+
+        enabled = self.enabled
+        self.enabled = False
+        try:
+            _, resolved, _ = self.solve(y, combination)
+        finally:
+            self.enabled = enabled
+
+        return np.max(np.abs(reused - resolved))
+
+    def compare_trajectory(self, y0, combination, ts, rtol=1e-3, atol=1e-6, rtol_compare=1e-2, atol_compare=1e-5):
+        """
+        Integrate the batch with and without basis re-use and compare the trajectories.
+
+        Both runs use dfba_cobra_cellulose.simulate_batch on the grid ts with the
+        integration tolerances rtol and atol. The runs are equivalent if every
+        state on the common grid differs by at most atol_compare +
+        rtol_compare*|reference| (by default ten times the integration
+        tolerances, as the step sizes of LSODA follow the RHS values).
+        Returns the maximum absolute deviation, the largest deviation relative
+        to that tolerance and whether the trajectories are equivalent.
+        """
+        from dfba_cobra_cellulose import dynamic_system, simulate_batch
+
+        enabled = self.enabled
+        solutions = []
+        try:
+            for reuse in (True, False):
+                self.enabled = enabled and reuse
+                if dynamic_system.cache is not None:
+                    dynamic_system.cache.clear()
+                solutions.append(simulate_batch(self, self.rxns, y0, self.objective_dir, combination, ts,
+                                                rtol=rtol, atol=atol))
+        finally:
+            self.enabled = enabled
+
+        reused, reference = solutions
+        n = min(len(reused.t), len(reference.t))
+        deviation = np.abs(reused.y[:, :n] - reference.y[:, :n])
+        tolerance = atol_compare + rtol_compare*np.abs(reference.y[:, :n])
+        ratio = float(np.max(deviation/tolerance)) if n else 0.0
+        return {"max_deviation": float(np.max(deviation)) if n else 0.0,
+                "max_ratio": ratio,
+                "same_length": len(reused.t) == len(reference.t),
+                "equivalent": ratio <= 1 and len(reused.t) == len(reference.t)}
+
+    def stats(self):
+        total = self.reused + self.resolved
+        return {"reused": self.reused,
+                "resolved": self.resolved,
+                "reuse_rate": self.reused/total if total else 0.0}
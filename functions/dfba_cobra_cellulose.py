@@ -1,66 +1,389 @@
 import copy
+import time
+from collections import namedtuple
+from functools import lru_cache
+
 import cobra
 
 import numpy as np
 import pandas as pd
 
-from scipy.integrate import solve_ivp
+from scipy.integrate import solve_ivp, LSODA
 from scipy.interpolate import interp1d
-from sklearn.metrics import mean_squared_error 
+from scipy.optimize import OptimizeResult, brentq
 
+import dfba_instrumentation
+from lp_cache import LPSolutionCache
+from observation_store import load_observations
 
-cellulose_exp = pd.read_csv("../input/Desvaux2001_batch_data/cellulose_g.csv")
-biomass_exp = pd.read_csv("../input/Desvaux2001_batch_data/biomass_mg.csv")
 
-cellulose_exp = pd.read_csv("../input/Desvaux2001_batch_data/cellulose_g.csv")
-molar_mass = 173.85  # Based on glucose equivalent (based on 0.35 cellobiose and 0.3 glucose)
-cellulose_exp["y mmol"]= cellulose_exp[" y"].map(lambda x: (x/molar_mass)*1000)
-cellulose_exp = cellulose_exp[cellulose_exp.x<70].copy()
+# Fidelity of an optimize_parameters evaluation: LSODA tolerances, number of
+# t_eval points, number of lexicographic stages solved (None for all; the
+# remaining fluxes are read from the last stage's solution) and whether the
+# flux surrogate replaces the LP
+Fidelity = namedtuple("Fidelity", ["rtol", "atol", "n_eval", "stages", "surrogate"])
 
-biomass_exp = pd.read_csv("../input/Desvaux2001_batch_data/biomass_mg.csv")
-biomass_exp["y g"] = biomass_exp[" y"].map(lambda x: x/1000)
-biomass_exp = biomass_exp[biomass_exp.x<70].copy()
+# Growth, glucose and cellobiose (the stages dynamic_system depends on) are always solved
+FIDELITY = {"low": Fidelity(rtol=1e-2, atol=1e-4, n_eval=100, stages=3, surrogate=False),
+            "medium": Fidelity(rtol=1e-2, atol=1e-5, n_eval=300, stages=None, surrogate=False),
+            "full": Fidelity(rtol=1e-3, atol=1e-6, n_eval=1000, stages=None, surrogate=False)}
 
-def add_dynamic_bounds(model, conc_dict,combination=[6.01,0.2,5.01,0.2,2.9]):
-    """Use external concentrations to bound the uptake flux of glucose."""
+
+@lru_cache(maxsize=None)
+def load_desvaux2001(input_dir="../input"):
+    """Desvaux2001 cellulose (mmol glucose eq.) and biomass (g) observations before 70 h, read once per process."""
+    observations = load_observations(input_dir)
+    
+    x, y = observations.series("Desvaux2001", "EX_cellulose_e", x_max=70)
+    cellulose_exp = pd.DataFrame({"x": x, "y mmol": y})
+    
+    x, y = observations.series("Desvaux2001", "Growth", x_max=70)
+    biomass_exp = pd.DataFrame({"x": x, "y g": y})
+    
+    return cellulose_exp, biomass_exp
+
+
+def __getattr__(name):
+    # cellulose_exp and biomass_exp used to be read at import; they are now loaded on first access
+    if name == "cellulose_exp":
+        return load_desvaux2001()[0]
+    if name == "biomass_exp":
+        return load_desvaux2001()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def uptake_bounds(glucose, cellobiose, cellulose, combination=[6.01,0.2,5.01,0.2,2.9]):
+    """Michaelis-Menten uptake bounds and cellulase rate at the given concentrations."""
     
     vmax_inner_glc, Km_inner_glc,vmax_inner_cellb, Km_inner_cellb,vmax_outer= combination
                                                      
     Km_outer,Ki = [4.4,11]
     
-    glucose_max_import = -vmax_inner_glc* conc_dict["EX_glc__D_e"] / (Km_inner_glc + conc_dict["EX_glc__D_e"])
-    cellobiose_max_import = -vmax_inner_cellb * conc_dict["EX_cellb_e"]/ (Km_inner_cellb + conc_dict["EX_cellb_e"]) 
+    glucose_max_import = -vmax_inner_glc* glucose / (Km_inner_glc + glucose)
+    cellobiose_max_import = -vmax_inner_cellb * cellobiose/ (Km_inner_cellb + cellobiose) 
+    
+    cellulase = -vmax_outer*(cellulose/((1 + (cellobiose/Ki))*Km_outer + cellulose))    
+
+    return glucose_max_import, cellobiose_max_import, cellulase
+
+
+def uptake_bounds_derivatives(glucose, cellobiose, cellulose, combination=[6.01,0.2,5.01,0.2,2.9]):
+    """
+    Partial derivatives of uptake_bounds.
+
+    Returns d(glucose bound)/d glucose, d(cellobiose bound)/d cellobiose,
+    d cellulase/d cellobiose (through the inhibition term) and d cellulase/d cellulose.
+    """
+    vmax_inner_glc, Km_inner_glc,vmax_inner_cellb, Km_inner_cellb,vmax_outer= combination
+    
+    Km_outer,Ki = [4.4,11]
+    
+    d_glucose = -vmax_inner_glc*Km_inner_glc/(Km_inner_glc + glucose)**2
+    d_cellobiose = -vmax_inner_cellb*Km_inner_cellb/(Km_inner_cellb + cellobiose)**2
     
-    cellulase = -vmax_outer*(conc_dict["EX_cellulose_e"]/((1 + (conc_dict["EX_cellb_e"]/Ki))*Km_outer + conc_dict["EX_cellulose_e"]))    
+    denominator = (1 + (cellobiose/Ki))*Km_outer + cellulose
+    d_cellulase_cellobiose = vmax_outer*cellulose*(Km_outer/Ki)/denominator**2
+    d_cellulase_cellulose = -vmax_outer*(1 + (cellobiose/Ki))*Km_outer/denominator**2
+    
+    return d_glucose, d_cellobiose, d_cellulase_cellobiose, d_cellulase_cellulose
+
+
+def add_dynamic_bounds(model, conc_dict,combination=[6.01,0.2,5.01,0.2,2.9]):
+    """Use external concentrations to bound the uptake flux of glucose."""
+    
+    glucose_max_import, cellobiose_max_import, cellulase = uptake_bounds(conc_dict["EX_glc__D_e"],
+                                                                         conc_dict["EX_cellb_e"],
+                                                                         conc_dict["EX_cellulose_e"],
+                                                                         combination)
 
     model.reactions.EX_glc__D_e.lower_bound = glucose_max_import
     model.reactions.EX_cellb_e.lower_bound = cellobiose_max_import
     
     return cellulase
+
+
+class DynamicFBAProblem:
+    """
+    Compiled lexicographic dFBA problem.
+
+    The model is compiled once: the layout of the state vector is resolved to
+    integer indices and the constraints that ``fix_objective_as_constraint`` and
+    ``add_lexicographic_constraints`` would create are added to the solver up
+    front. Each call only moves the uptake bounds, relaxes the lexicographic
+    constraints and re-solves the stages, so the solver keeps its basis between
+    calls (warm start). Pass an instance instead of the cobra model to
+    ``dynamic_system``, ``infeasible_event`` or ``optimize_parameters``.
+
+    The model is modified while the problem is alive; call ``close`` (or use the
+    problem as a context manager) to restore it.
+
+    With n_stages, only the first n_stages reactions of rxns are optimized; the
+    values of the others are taken from the solution of the last solved stage.
+    """
+
+    def __init__(self, model, rxns, objective_dir, bounded_rxns=("EX_glc__D_e", "EX_cellb_e"), n_stages=None):
+        self.model = model
+        self.n_stages = n_stages
+        self.rxns = list(rxns)
+        self.objective_dir = list(objective_dir)
+        
+        # Layout of the state vector: rxns followed by the cellulose pool
+        self.rxns_map = self.rxns + ["EX_cellulose_e"]
+        self.index = {rxn: i for i, rxn in enumerate(self.rxns_map)}
+        self.i_growth = self.index.get("Growth")
+        self.i_glc = self.index.get("EX_glc__D_e")
+        self.i_cellb = self.index.get("EX_cellb_e")
+        self.i_cellulose = self.index["EX_cellulose_e"]
+        
+        self.bounded = [model.reactions.get_by_id(rxn_id) for rxn_id in bounded_rxns]
+        self._original_bounds = [rxn.lower_bound for rxn in self.bounded]
+        
+        # Stage 0 is the current objective (the feasibility objective after
+        # cobra.util.add_lp_feasibility), followed by one stage per reaction in rxns.
+        objective = model.solver.objective
+        self._objective = objective
+        self._original_direction = objective.direction
+        self._coefficients = [objective.get_linear_coefficients(objective.variables)]
+        self._directions = [objective.direction]
+        expressions = [objective.expression]
+        
+        for rxn_id, direction in zip(self.rxns, self.objective_dir):
+            rxn = model.reactions.get_by_id(rxn_id)
+            self._coefficients.append({rxn.forward_variable: 1, rxn.reverse_variable: -1})
+            self._directions.append(direction)
+            expressions.append(rxn.flux_expression)
+        
+        self.constraints = [model.problem.Constraint(expression, name=f"dfba_fixed_objective_{i}")
+                            for i, expression in enumerate(expressions)]
+        model.add_cons_vars(self.constraints, sloppy=True)
+        self._stage = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Remove the compiled constraints and restore bounds and objective."""
+        if self.constraints is None:
+            return
+        self._set_stage(0)
+        self._objective.direction = self._original_direction
+        self.model.remove_cons_vars(self.constraints)
+        for rxn, lower_bound in zip(self.bounded, self._original_bounds):
+            rxn.lower_bound = lower_bound
+        self.constraints = None
+
+    def _set_stage(self, stage):
+        """Switch the objective coefficients to the given lexicographic stage."""
+        if stage == self._stage:
+            return
+        coefficients = {variable: 0 for variable in self._coefficients[self._stage]}
+        coefficients.update(self._coefficients[stage])
+        self._objective.set_linear_coefficients(coefficients)
+        self._objective.direction = self._directions[stage]
+        self._stage = stage
+
+    def _optimize_stage(self, stage):
+        self._set_stage(stage)
+        instrumentation = dfba_instrumentation.current()
+        if instrumentation is not None:
+            start = time.perf_counter()
+            self.model.solver.optimize()
+            instrumentation.lp(stage, time.perf_counter() - start)
+        else:
+            self.model.solver.optimize()
+        cobra.util.assert_optimal(self.model)
+        return self._objective.value
+
+    def _fix_stage(self, stage, value):
+        if self._directions[stage] == "max":
+            self.constraints[stage].lb = value
+        else:
+            self.constraints[stage].ub = value
+
+    def _relax(self):
+        for constraint in self.constraints:
+            constraint.lb = None
+            constraint.ub = None
+
+    def solve_bounds(self, lower_bounds, lexicographic=True):
+        """
+        Solve the stages for the given lower bounds of the bounded reactions.
+
+        Returns the feasibility value and, if lexicographic, the optimum of every
+        stage in the order of rxns (the values of add_lexicographic_constraints).
+        """
+        for rxn, lower_bound in zip(self.bounded, lower_bounds):
+            rxn.lower_bound = lower_bound
+        self._relax()
+        
+        feasibility = self._optimize_stage(0)
+        if not lexicographic:
+            return feasibility, None
+        
+        self._fix_stage(0, feasibility)
+        values = np.empty(len(self.rxns))
+        n_stages = len(self.rxns) if self.n_stages is None else min(self.n_stages, len(self.rxns))
+        for stage in range(1, n_stages + 1):
+            values[stage-1] = self._optimize_stage(stage)
+            self._fix_stage(stage, values[stage-1])
+        for stage in range(n_stages + 1, len(self.constraints)):
+            values[stage-1] = self.constraints[stage].primal
+        
+        return feasibility, values
+
+    def _bound_sensitivity(self, lower_bounds):
+        """Derivatives of the optimum of the stage just solved w.r.t. the lower bounds of the bounded reactions."""
+        # A negative lower bound is the upper bound of the reverse variable
+        return np.array([rxn.forward_variable.reduced_cost if lower_bound >= 0 else -rxn.reverse_variable.reduced_cost
+                         for rxn, lower_bound in zip(self.bounded, lower_bounds)])
+
+    def sensitivity(self, lower_bounds):
+        """
+        Solve the stages and differentiate their optima w.r.t. the lower bounds.
+
+        The optimum of a stage depends on the bounds directly (reduced cost of the
+        variable at the bound) and through the values the earlier stages are
+        fixed to (duals of their constraints), so the derivatives are chained
+        over the stages. Returns the feasibility value, the stage values and
+        their derivatives, shape (len(rxns), len(bounded)).
+        """
+        for rxn, lower_bound in zip(self.bounded, lower_bounds):
+            rxn.lower_bound = lower_bound
+        self._relax()
+        
+        values = np.empty(len(self.constraints))
+        derivatives = np.zeros((len(self.constraints), len(self.bounded)))
+        for stage in range(len(self.constraints)):
+            values[stage] = self._optimize_stage(stage)
+            derivatives[stage] = self._bound_sensitivity(lower_bounds)
+            for previous in range(stage):
+                derivatives[stage] += self.constraints[previous].dual*derivatives[previous]
+            self._fix_stage(stage, values[stage])
+        
+        return values[0], values[1:], derivatives[1:]
+
+    def jacobian(self, y, combination):
+        """
+        Jacobian of dynamic_system at state y.
+
+        Combines the LP sensitivities of the stage values with the derivatives
+        of the Michaelis-Menten and cellulase terms; only the columns of
+        jacobian_sparsity are non-zero.
+        """
+        glucose, cellobiose, cellulose = y[self.i_glc], y[self.i_cellb], y[self.i_cellulose]
+        glucose_max_import, cellobiose_max_import, cellulase = uptake_bounds(glucose, cellobiose, cellulose, combination)
+        d_glucose, d_cellobiose, d_cellulase_cellobiose, d_cellulase_cellulose = uptake_bounds_derivatives(
+            glucose, cellobiose, cellulose, combination)
+        
+        _, values, derivatives = self.sensitivity((glucose_max_import, cellobiose_max_import))
+        biomass = y[self.i_growth]
+        n = len(self.rxns_map)
+        
+        # Rates per unit biomass, as in dynamic_system
+        rates = np.append(values, cellulase)
+        rates[1] -= cellulase*0.35
+        rates[2] -= cellulase*0.3
+        # Cellulase enters the glucose, cellobiose and cellulose rates
+        cellulase_rows = np.zeros(n)
+        cellulase_rows[[1, 2, n-1]] = [-0.35, -0.3, 1]
+        
+        J = np.zeros((n, n))
+        J[:, self.i_growth] = rates
+        J[:n-1, self.i_glc] += biomass*derivatives[:, 0]*d_glucose
+        J[:n-1, self.i_cellb] += biomass*derivatives[:, 1]*d_cellobiose
+        J[:, self.i_cellb] += biomass*cellulase_rows*d_cellulase_cellobiose
+        J[:, self.i_cellulose] += biomass*cellulase_rows*d_cellulase_cellulose
+        return J
+
+    def jacobian_sparsity(self):
+        """Non-zero pattern of jacobian: the biomass, glucose, cellobiose and cellulose columns."""
+        n = len(self.rxns_map)
+        sparsity = np.zeros((n, n), dtype=bool)
+        sparsity[:, [self.i_growth, self.i_glc, self.i_cellb, self.i_cellulose]] = True
+        return sparsity
+
+    def solve(self, y, combination, lexicographic=True):
+        """Solve the problem at state y. Returns feasibility, stage values and the cellulase rate."""
+        glucose_max_import, cellobiose_max_import, cellulase = uptake_bounds(y[self.i_glc],
+                                                                             y[self.i_cellb],
+                                                                             y[self.i_cellulose],
+                                                                             combination)
+        feasibility, values = self.solve_bounds((glucose_max_import, cellobiose_max_import),
+                                                lexicographic=lexicographic)
+        return feasibility, values, cellulase
     
     
     
     
-def dynamic_system(t, y,model,rxns,objective_dir,combination):
-    """Calculate the time derivative of external species."""
-    rxns_map = copy.copy(rxns)
-    rxns_map.append("EX_cellulose_e")
+def solve_lp(model, y, rxns, objective_dir, combination, lexicographic=True):
+    """
+    Solve the LP at state y and return feasibility, lexicographic values and cellulase.
+
+    Solutions are shared between dynamic_system and infeasible_event through
+    dynamic_system.cache, so each distinct state is optimized once.
+    """
+    cache = dynamic_system.cache
+    instrumentation = dfba_instrumentation.current()
+    field = "fluxes" if lexicographic else "feasibility"
     
-    conc_dict = dict(zip(rxns_map,y))
+    if cache is not None:
+        key = cache.key(y, id(model), rxns, objective_dir, combination)
+        entry = cache.lookup(key, field)
+        if entry is not None:
+            if instrumentation is not None:
+                instrumentation.cache_hit()
+            fluxes = entry["fluxes"].copy() if lexicographic else None
+            return entry["feasibility"], fluxes, entry["cellulase"]
     
-    # Calculate the specific exchanges fluxes at the given external concentrations.
-    with model:
-        cellulase = add_dynamic_bounds(model, conc_dict,combination)
+    if not isinstance(model, cobra.Model):
+        # Compiled problem (DynamicFBAProblem) or flux surrogate (dfba_surrogate.FluxSurrogate)
+        feasibility, fluxes, cellulase = model.solve(y, combination, lexicographic=lexicographic)
+    else:
+        rxns_map = copy.copy(rxns)
+        rxns_map.append("EX_cellulose_e")
         
-        feasibility = cobra.util.fix_objective_as_constraint(model)
+        conc_dict = dict(zip(rxns_map,y))
+        fluxes = None
+        
+        # Calculate the specific exchanges fluxes at the given external concentrations.
+        with model:
+            cellulase = add_dynamic_bounds(model, conc_dict,combination)
+            
+            # One solve per stage: 0 (feasibility), then one per lexicographic reaction
+            with dfba_instrumentation.timed_solves(model.solver, instrumentation):
+                feasibility = cobra.util.fix_objective_as_constraint(model)
+                
+                if lexicographic:
+                    lex_constraints = cobra.util.add_lexicographic_constraints(model, rxns, objective_dir)
+                    fluxes = lex_constraints.values
+    
+    if cache is not None:
+        if lexicographic:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase, fluxes=fluxes.copy())
+        else:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase)
+    
+    return feasibility, fluxes, cellulase
 
-        lex_constraints = cobra.util.add_lexicographic_constraints(model, rxns, objective_dir)
 
+def dynamic_system(t, y,model,rxns,objective_dir,combination):
+    """Calculate the time derivative of external species."""
+    instrumentation = dfba_instrumentation.current()
+    if instrumentation is not None:
+        start = instrumentation.start_call()
+    
+    feasibility, fluxes, cellulase = solve_lp(model, y, rxns, objective_dir, combination)
+    
+    if not isinstance(model, cobra.Model):
+        biomass = y[model.i_growth]
+    else:
+        biomass = y[rxns.index("Growth")]
         
     # Since the calculated fluxes are specific rates, we multiply them by the
     # biomass concentration to get the bulk exchange rates.
-    fluxes = lex_constraints.values
-
     glucose_uptake = fluxes[1]
     cellobiose_uptake = fluxes[2]
     
@@ -68,70 +391,267 @@ def dynamic_system(t, y,model,rxns,objective_dir,combination):
     fluxes[2] = cellobiose_uptake - cellulase*0.3
     fluxes =np.append(fluxes, cellulase)
     
-    fluxes *= conc_dict["Growth"]
+    fluxes *= biomass
 
-    # This implementation is **not** efficient, so I display the current
-    # simulation time using a progress bar.
-    if dynamic_system.pbar is not None:
-        dynamic_system.pbar.update(1)
-        dynamic_system.pbar.set_description('t = {:.3f}'.format(t))
+    # Progress bar, counters and timings (see dfba_instrumentation.instrument)
+    if instrumentation is not None:
+        instrumentation.rhs(t, start)
     
     return fluxes
 
-dynamic_system.pbar = None
+dynamic_system.cache = LPSolutionCache()
+
+
+def dynamic_system_jacobian(t, y,model,rxns,objective_dir,combination):
+    """
+    Jacobian of dynamic_system for a compiled problem (see DynamicFBAProblem.jacobian).
+
+    One lexicographic solve with sensitivities replaces the finite differences
+    (one solve per state variable) LSODA uses without a Jacobian.
+    """
+    cache = dynamic_system.cache
+    if cache is not None:
+        key = cache.key(y, id(model), rxns, objective_dir, combination)
+        entry = cache.lookup(key, "jacobian")
+        if entry is not None:
+            return entry["jacobian"].copy()
+    
+    J = model.jacobian(np.asarray(y, dtype=float), combination)
+    
+    if cache is not None:
+        cache.store(key, jacobian=J.copy())
+    return J
+
+
+
+
+def simulate_batch(model, rxns, y0, objective_dir, combination, ts, rtol=1e-3, atol=1e-6, jac=None):
+    """Integrate the batch on the t_eval grid ts, stopping at infeasibility."""
+    return solve_ivp(
+        fun=dynamic_system,
+        t_span=(ts.min(), ts.max()),
+        y0=y0,
+        t_eval=ts,
+        method='LSODA',
+        events = [infeasible_event],
+        args = (model,rxns,objective_dir,combination),
+        rtol=rtol,
+        atol=atol,
+        jac=jac
+    )
+
+
+class ObservationScorer:
+    """
+    Penalty of a simulated batch against the Desvaux2001 observations.
+
+    The penalty of each species is the mean squared residual at the observation
+    times (linear interpolation of the trajectory) over the mean observation,
+    weighted 1000 for biomass and 10 for cellulose. Every observation adds a
+    non-negative term, so the penalty of the observations up to some time is a
+    lower bound of the final penalty.
+    """
+
+    def __init__(self, data=None):
+        cellulose_exp, biomass_exp = data if data is not None else load_desvaux2001()
+        self.observations = [("Growth", biomass_exp.x.values, biomass_exp["y g"].values, 1000),
+                             ("EX_cellulose_e", cellulose_exp.x.values, cellulose_exp["y mmol"].values, 10)]
+
+    def penalties(self, t, C_dict, t_max=None):
+        """penalty_growth and penalty_cellulose of a trajectory; with t_max only the observations up to t_max."""
+        penalties = []
+        for species, x, y, weight in self.observations:
+            covered = slice(None) if t_max is None else x <= t_max
+            if len(t) < 2 or x[covered].size == 0:
+                penalties.append(0.0)
+                continue
+            interp_func = interp1d(t, C_dict[species], kind='linear', fill_value="extrapolate")
+            residual = y[covered] - interp_func(x[covered])
+            penalties.append(weight*np.sum(np.square(residual))/len(y)/np.mean(y))
+        return penalties
+
 
+def integrate_scored(model, rxns, y0, objective_dir, combination, ts, scorer, penalty_bound,
+                     rtol=1e-3, atol=1e-6, jac=None):
+    """
+    Integrate like solve_ivp(t_eval=ts, events=[infeasible_event]) and stop early once
+    the penalty of the observations passed so far exceeds penalty_bound.
 
+    The LSODA steps are taken one at a time; the trajectory is sampled on ts from
+    the dense output of each step and the partial penalty is updated whenever an
+    observation time is passed. Returns a solve_ivp-like result with an extra
+    ``aborted`` flag.
+    """
+    args = (model, rxns, objective_dir, combination)
+    solver = LSODA(lambda t, y: dynamic_system(t, y, *args), ts[0], y0, ts[-1], rtol=rtol, atol=atol,
+                   jac=None if jac is None else (lambda t, y: jac(t, y, *args)))
+    rxns_extra = list(rxns) + ["EX_cellulose_e"]
+    observation_times = np.unique(np.concatenate([x for _, x, _, _ in scorer.observations]))
+    
+    t_out, y_out, t_events, y_events = [], [], [], []
+    i_eval = 0
+    n_passed = 0
+    g = infeasible_event(solver.t, solver.y, *args)
+    status, aborted = None, False
+    while status is None:
+        message = solver.step()
+        if solver.status == "failed":
+            status = -1
+            break
+        t_old, t = solver.t_old, solver.t
+        dense = solver.dense_output()
+        
+        # Terminal infeasibility event (direction 1), located like solve_ivp does
+        g_new = infeasible_event(t, solver.y, *args)
+        if g <= 0 <= g_new and g != g_new:
+            t = brentq(lambda t_: infeasible_event(t_, dense(t_), *args), t_old, t, xtol=4*np.finfo(float).eps)
+            t_events.append(t)
+            y_events.append(dense(t))
+            status, message = 1, "A termination event occurred."
+        elif solver.status == "finished":
+            status, message = 0, "The solver successfully reached the end of the integration interval."
+        g = g_new
+        
+        i_new = np.searchsorted(ts, t, side='right')
+        for t_eval in ts[i_eval:i_new]:
+            t_out.append(t_eval)
+            y_out.append(dense(t_eval))
+        i_eval = i_new
+        
+        # Partial penalty once new observations are covered by the sampled trajectory
+        if status is None and len(t_out) and np.searchsorted(observation_times, t_out[-1], side='right') > n_passed:
+            n_passed = np.searchsorted(observation_times, t_out[-1], side='right')
+            C_dict = dict(zip(rxns_extra, np.array(y_out).T))
+            if sum(scorer.penalties(np.array(t_out), C_dict, t_max=t_out[-1])) > penalty_bound:
+                status, message, aborted = 1, "Aborted: partial penalty above the bound.", True
+    
+    return OptimizeResult(t=np.array(t_out), y=np.array(y_out).T.reshape(len(y0), -1),
+                          t_events=[np.array(t_events)], y_events=[np.array(y_events).reshape(-1, len(y0))],
+                          nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu,
+                          status=status, message=message, success=status >= 0, aborted=aborted)
 
 
-def optimize_parameters(combination,model,rxns,y0,objective_dir,alternative_solution=False,t_end=False):
+def optimize_parameters(combination,model,rxns,y0,objective_dir,alternative_solution=False,t_end=False,surrogate=False,
+                        rtol=1e-3,atol=1e-6,store=None,data=None,analytic_jacobian=True,penalty_bound=None,
+                        fidelity=None):
+    """
+    Simulate the batch for a parameter combination and score it against Desvaux2001.
+
+    With surrogate=True the LP is replaced by the interpolated flux table stored at
+    optimize_parameters.surrogate_path (see dfba_surrogate.build_surrogate); a
+    FluxSurrogate object can also be passed directly.
 
+    rtol and atol are passed to LSODA (the defaults are LSODA's). If an
+    evaluation_store.EvaluationStore is given, stored penalties are returned
+    without simulating and new evaluations are appended to the store.
+
+    data is an optional (cellulose_exp, biomass_exp) pair to score against instead
+    of load_desvaux2001(); the store is not used then (its keys do not cover data).
+
+    With analytic_jacobian, a compiled problem also provides LSODA with
+    dynamic_system_jacobian (cobra models and surrogates are integrated without).
+
+    With penalty_bound (e.g. the current best penalty of the population), the
+    trajectory is scored against the observations while integrating and the
+    simulation stops as soon as the partial penalty exceeds the bound; the
+    partial penalty, a lower bound of the full one, is returned.
+
+    fidelity is a FIDELITY name or a Fidelity; it replaces rtol, atol and
+    surrogate, sets the number of t_eval points and limits the lexicographic
+    stages (a cobra model is compiled into a DynamicFBAProblem for that).
+    Evaluations below full fidelity are not stored.
+    """
+    if data is not None:
+        store = None
+    n_eval = 1000
+    if fidelity is not None:
+        level = FIDELITY[fidelity] if isinstance(fidelity, str) else fidelity
+        if level != FIDELITY["full"]:
+            store = None
+        rtol, atol, n_eval, surrogate = level.rtol, level.atol, level.n_eval, level.surrogate
+        if level.stages is not None and not surrogate:
+            if isinstance(model, cobra.Model):
+                with DynamicFBAProblem(model, rxns, objective_dir, n_stages=level.stages) as problem:
+                    return optimize_parameters(combination, problem, rxns, y0, objective_dir,
+                                               alternative_solution=alternative_solution, t_end=t_end,
+                                               rtol=rtol, atol=atol, data=data, analytic_jacobian=analytic_jacobian,
+                                               penalty_bound=penalty_bound, fidelity=level._replace(stages=None))
+            if isinstance(model, DynamicFBAProblem):
+                n_stages, model.n_stages = model.n_stages, level.stages
+                try:
+                    return optimize_parameters(combination, model, rxns, y0, objective_dir,
+                                               alternative_solution=alternative_solution, t_end=t_end,
+                                               rtol=rtol, atol=atol, data=data, analytic_jacobian=analytic_jacobian,
+                                               penalty_bound=penalty_bound, fidelity=level._replace(stages=None))
+                finally:
+                    model.n_stages = n_stages
+    
+    cellulose_exp, biomass_exp = data if data is not None else load_desvaux2001()
+    scorer = ObservationScorer((cellulose_exp, biomass_exp))
+    
+    if surrogate is True:
+        from dfba_surrogate import load_surrogate
+        model = load_surrogate(optimize_parameters.surrogate_path)
+    elif surrogate:
+        model = surrogate
+    
+    if store is not None:
+        key = store.key(combination, model, y0, rxns, objective_dir, rtol, atol, t_end)
+        record = store.get(key)
+        # Aborted evaluations only stored a lower bound of the penalty
+        if (record is not None and not alternative_solution and
+                (not record.get("aborted") or (penalty_bound is not None and record["penalty"] > penalty_bound))):
+            return record["penalty"]
+    
+    if dynamic_system.cache is not None:
+        dynamic_system.cache.clear()
     
     try:
         if t_end:
-            ts = np.linspace(biomass_exp.iloc[0,0], t_end, 1000)   
+            ts = np.linspace(biomass_exp.iloc[0,0], t_end, n_eval)   
+        else:
+            ts = np.linspace(biomass_exp.iloc[0,0], biomass_exp.iloc[biomass_exp["x"].size-1,0], n_eval)   
+
+        jac = dynamic_system_jacobian if (analytic_jacobian and hasattr(model, "jacobian")) else None
+        if penalty_bound is not None:
+            sol = integrate_scored(model, rxns, y0, objective_dir, combination, ts, scorer, penalty_bound,
+                                   rtol=rtol, atol=atol, jac=jac)
         else:
-            ts = np.linspace(biomass_exp.iloc[0,0], biomass_exp.iloc[biomass_exp["x"].size-1,0], 1000)   
-
-        sol = solve_ivp(
-            fun=dynamic_system,
-            t_span=(ts.min(), ts.max()),
-            y0=y0,
-            t_eval=ts,
-            method='LSODA',
-            events = [infeasible_event],
-            args = (model,rxns,objective_dir,combination)
-        )
+            sol = simulate_batch(model, rxns, y0, objective_dir, combination, ts, rtol=rtol, atol=atol, jac=jac)
+        if dfba_instrumentation.current() is not None:
+            dfba_instrumentation.current().integration(sol, ["infeasible_event"])
     except Exception as e:
         print(f"\t had issues with this combination: {combination}\nException: {e}")
+        if store is not None:
+            store.add(key, combination, 1e6)
         return 1e6 # Returns high penalty score if combination is infeasible...
     rxns_extra = rxns.copy()
     rxns_extra.append("EX_cellulose_e")
     C_dict_results = dict(zip(rxns_extra,sol.y))
     
-    # Growth
-    
-    interp_func = interp1d(sol.t,C_dict_results["Growth"], kind='linear', fill_value="extrapolate")
-    y_interp = interp_func(biomass_exp.x.values)
-    
-    score_spec = mean_squared_error(biomass_exp["y g"].values,y_interp)/(biomass_exp["y g"].mean()) 
-    penalty_growth =1000*(score_spec)
-    
-    
-    #  Cellulose
-    interp_func = interp1d(sol.t, C_dict_results["EX_cellulose_e"], kind='linear', fill_value="extrapolate")
-    y_interp = interp_func(cellulose_exp.x)
-    
-    score_spec = mean_squared_error(cellulose_exp["y mmol"],y_interp)/(cellulose_exp["y mmol"].mean()) 
-    penalty_cellulose =10*(score_spec)
+    aborted = getattr(sol, "aborted", False)
+    penalty_growth, penalty_cellulose = scorer.penalties(sol.t, C_dict_results,
+                                                         t_max=sol.t[-1] if aborted else None)
 
     penalty = penalty_growth + penalty_cellulose
     
-    print(f"\t penalty: {penalty} for combination: {combination}")
+    if aborted:
+        print(f"\t aborted at t = {sol.t[-1]:.1f} with penalty: {penalty} for combination: {combination}")
+    else:
+        print(f"\t penalty: {penalty} for combination: {combination}")
+    
+    if store is not None:
+        if aborted:
+            store.add(key, combination, penalty, aborted=True)
+        else:
+            store.add(key, combination, penalty, penalty_growth, penalty_cellulose)
     
     if alternative_solution:
         return sol,penalty,{"penalty_growth":penalty_growth,"penalty_cellulose":penalty_cellulose}
     else:
         return penalty
+
+optimize_parameters.surrogate_path = "../results/dfba_flux_surrogate.npz"
     
 
 
@@ -144,17 +664,15 @@ def infeasible_event(t, y,model,rxns,objective_dir,combination):
     (and if not, how far it is from feasibility). When the sign of this function changes
     from -epsilon to positive, we know the solution is no longer feasible.
     """
-    rxns_map = copy.copy(rxns)
-    rxns_map.append("EX_cellulose_e")
+    instrumentation = dfba_instrumentation.current()
+    if instrumentation is not None:
+        start = instrumentation.start_call()
     
-    conc_dict = dict(zip(rxns_map,y))    
-    with model:
-
-
-        add_dynamic_bounds(model, conc_dict,combination)
-
-        feasibility = cobra.util.fix_objective_as_constraint(model)
-
+    feasibility, _, _ = solve_lp(model, y, rxns, objective_dir, combination, lexicographic=False)
+    
+    if instrumentation is not None:
+        instrumentation.event(t, start, feasibility - infeasible_event.epsilon,
+                              infeasible=feasibility > infeasible_event.epsilon)
     return feasibility - infeasible_event.epsilon
 
 infeasible_event.epsilon = 1E-6
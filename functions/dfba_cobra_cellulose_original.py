@@ -19,26 +19,57 @@ def add_dynamic_bounds(model, conc_dict):
     
     
     
-def dynamic_system(t, y,model,rxns,objective_dir):
-    """Calculate the time derivative of external species."""
+def solve_lp(model, y, rxns, objective_dir, lexicographic=True):
+    """
+    Solve the LP at state y and return feasibility, lexicographic values and cellulase.
+
+    This is the reference implementation, so dynamic_system.cache is None and
+    every call solves the LP. Setting it to an LPSolutionCache shares solutions
+    between dynamic_system and infeasible_event; the cache is keyed on id(model),
+    so it must then be cleared before every integration.
+    """
+    cache = dynamic_system.cache
+    field = "fluxes" if lexicographic else "feasibility"
+    
+    if cache is not None:
+        key = cache.key(y, id(model), rxns, objective_dir)
+        entry = cache.lookup(key, field)
+        if entry is not None:
+            fluxes = entry["fluxes"].copy() if lexicographic else None
+            return entry["feasibility"], fluxes, entry["cellulase"]
+    
     rxns_map = copy.copy(rxns)
     rxns_map.append("EX_cellulose_e")
     
     conc_dict = dict(zip(rxns_map,y))
+    fluxes = None
     
     # Calculate the specific exchanges fluxes at the given external concentrations.
     with model:
         cellulase = add_dynamic_bounds(model, conc_dict)
         
         feasibility = cobra.util.fix_objective_as_constraint(model)
+        
+        if lexicographic:
+            lex_constraints = cobra.util.add_lexicographic_constraints(model, rxns, objective_dir)
+            fluxes = lex_constraints.values
+    
+    if cache is not None:
+        if lexicographic:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase, fluxes=fluxes.copy())
+        else:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase)
+    
+    return feasibility, fluxes, cellulase
 
-        lex_constraints = cobra.util.add_lexicographic_constraints(model, rxns, objective_dir)
 
+def dynamic_system(t, y,model,rxns,objective_dir):
+    """Calculate the time derivative of external species."""
+    feasibility, fluxes, cellulase = solve_lp(model, y, rxns, objective_dir)
+    biomass = y[rxns.index("Growth")]
         
     # Since the calculated fluxes are specific rates, we multiply them by the
     # biomass concentration to get the bulk exchange rates.
-    fluxes = lex_constraints.values
-
     glucose_uptake = fluxes[1]
     cellobiose_uptake = fluxes[2]
     
@@ -46,7 +77,7 @@ def dynamic_system(t, y,model,rxns,objective_dir):
     fluxes[2] = cellobiose_uptake - cellulase*0.3
     fluxes =np.append(fluxes, cellulase)
     
-    fluxes *= conc_dict["Growth"]
+    fluxes *= biomass
 
     # This implementation is **not** efficient, so I display the current
     # simulation time using a progress bar.
@@ -57,6 +88,7 @@ def dynamic_system(t, y,model,rxns,objective_dir):
     return fluxes
 
 dynamic_system.pbar = None
+dynamic_system.cache = None  # lp_cache.LPSolutionCache() to share solutions within one integration
 
 
 def infeasible_event(t, y,model,rxns,objective_dir):
@@ -68,17 +100,7 @@ def infeasible_event(t, y,model,rxns,objective_dir):
     (and if not, how far it is from feasibility). When the sign of this function changes
     from -epsilon to positive, we know the solution is no longer feasible.
     """
-    rxns_map = copy.copy(rxns)
-    rxns_map.append("EX_cellulose_e")
-    
-    conc_dict = dict(zip(rxns_map,y))    
-    with model:
-
-
-        add_dynamic_bounds(model, conc_dict)
-
-        feasibility = cobra.util.fix_objective_as_constraint(model)
-
+    feasibility, _, _ = solve_lp(model, y, rxns, objective_dir, lexicographic=False)
     return feasibility - infeasible_event.epsilon
 
 infeasible_event.epsilon = 1E-6
@@ -1,14 +1,18 @@
 import cobra
-import reframed # Remove later
 import numpy as np
 import pandas as pd
-from scipy.interpolate import interp1d
-from scipy.optimize import minimize
 from scipy.integrate import solve_ivp
 from collections import OrderedDict
 
 import copy
-from sklearn.metrics import mean_squared_error 
+import hashlib
+import os
+import pickle
+
+import dfba_instrumentation
+from dfba_cobra_cellulose import DynamicFBAProblem
+from lp_cache import LPSolutionCache
+from trajectory_store import TrajectoryStore
 
 name2id = {"Glucose":"glc__D_e",
                                "Xylose":"xyl__D_e",
@@ -41,8 +45,187 @@ def add_dynamic_bounds(model, conc_dict,glc_eq_poly_dict,vmax_inner_glc,Km_inner
     return cellulase_dict
 
 
-def read_model(media,lp_feasibility=True):
-    model_ref = reframed.load_cbmodel('../models/RcH10_final.xml')
+class PolysaccharideRegistry:
+    """
+    Index layout of the polysaccharides and their oligosaccharides in the state vector.
+
+    Built once per simulation phase from glc_eq_poly_dict. The Michaelis-Menten
+    uptake bounds, the cellulase rates and the depletion events are computed with
+    integer index arrays into y, so the cost of a right-hand side call does not
+    grow with the number of substrates in Python code.
+    """
+
+    def __init__(self, rxns, glc_eq_poly_dict, epsilon=1E-2):
+        self.rxns = list(rxns)
+        self.glc_eq_poly_dict = glc_eq_poly_dict
+        self.polysaccharides = list(glc_eq_poly_dict.keys())
+        index = {rxn: i for i, rxn in enumerate(self.rxns)}
+        
+        # Reactions optimized lexicographically (all but the polysaccharides)
+        self.rxns_map = [rxn for rxn in self.rxns if rxn not in glc_eq_poly_dict]
+        self.i_growth = index["Growth"]
+        self.i_lex = np.array([index[rxn] for rxn in self.rxns_map], dtype=int)
+        self.i_poly = np.array([index[polysac_id] for polysac_id in self.polysaccharides], dtype=int)
+        
+        self.oligo_ids = []
+        oligo_poly = []
+        oligo_share = []
+        self.i_pools = []
+        for k, (polysac_id, glc_eq_dict) in enumerate(glc_eq_poly_dict.items()):
+            for met_id, glc_eq in glc_eq_dict.items():
+                self.oligo_ids.append(met_id)
+                oligo_poly.append(k)
+                # 1 mol of cellulase produces one mol of glucose equivalents
+                oligo_share.append(1/(glc_eq*len(glc_eq_dict)))
+            self.i_pools.append(np.array([index[polysac_id]] + [index[met_id] for met_id in glc_eq_dict], dtype=int))
+        
+        self.i_oligo = np.array([index[met_id] for met_id in self.oligo_ids], dtype=int)
+        self.oligo_poly = np.array(oligo_poly, dtype=int)
+        self.oligo_share = np.array(oligo_share)
+        
+        self.events = [self._depletion_event(k, epsilon) for k in range(len(self.polysaccharides))]
+        self._problems = {}
+
+    def _depletion_event(self, k, epsilon):
+        """Terminal event when a polysaccharide and its oligosaccharides are used up."""
+        pool = self.i_pools[k]
+        name = self.polysaccharides[k][3:-2]
+        
+        def depletion_event(t, y, *args):
+            instrumentation = dfba_instrumentation.current()
+            if instrumentation is not None:
+                start = instrumentation.start_call()
+            diff = y[pool].sum() - depletion_event.epsilon
+            if diff<0:
+                print(f"Lack of {name}: {diff}")
+            if instrumentation is not None:
+                instrumentation.event(t, start, diff, name=f"depletion_{name}")
+            return diff
+        
+        depletion_event.epsilon = epsilon
+        depletion_event.direction = 0
+        depletion_event.terminal = True
+        return depletion_event
+
+    def uptake_bounds(self, y, vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer):
+        """Uptake bounds of the oligosaccharides and cellulase rate of every polysaccharide."""
+        conc = y[self.i_oligo]
+        max_import = -vmax_inner_glc*conc/(Km_inner_glc + conc)
+        
+        polysac = y[self.i_poly]
+        cellulase = -vmax_outer*polysac/(Km_outer + polysac)
+        return max_import, cellulase
+
+    def add_dynamic_bounds(self, model, y, vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer):
+        """Array version of add_dynamic_bounds. Returns the cellulase rates in the order of polysaccharides."""
+        max_import, cellulase = self.uptake_bounds(y, vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer)
+        for met_id, lower_bound in zip(self.oligo_ids, max_import):
+            model.reactions.get_by_id(met_id).lower_bound = lower_bound
+        return cellulase
+
+    def rates(self, fluxes, cellulase):
+        """Rates per unit biomass in the order of rxns from the lexicographic fluxes and the cellulase rates."""
+        rates = np.empty(len(self.rxns))
+        rates[self.i_lex] = fluxes
+        rates[self.i_oligo] -= cellulase[self.oligo_poly]*self.oligo_share
+        rates[self.i_poly] = cellulase
+        return rates
+
+    def derivatives(self, y, fluxes, cellulase):
+        """Bulk rates in the order of rxns from the lexicographic fluxes and the cellulase rates."""
+        return self.rates(fluxes, cellulase)*y[self.i_growth]
+
+    def problem(self, model, objective_dir):
+        """
+        Compiled problem of this phase with the oligosaccharide uptakes as bounded reactions.
+
+        Only used for LP sensitivities. It is built on a copy of the model:
+        solve_lp changes the model inside ``with model:``, which replaces the
+        solver objective the problem works on.
+        """
+        key = (id(model), tuple(objective_dir))
+        if key not in self._problems:
+            self._problems[key] = DynamicFBAProblem(model.copy(), self.rxns_map, objective_dir,
+                                                    bounded_rxns=self.oligo_ids)
+        return self._problems[key]
+
+    def close(self):
+        """Drop the compiled problems of this phase."""
+        for problem in self._problems.values():
+            problem.close()
+        self._problems = {}
+
+    def jacobian(self, model, y, objective_dir, vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer):
+        """
+        Jacobian of dynamic_system_general at state y.
+
+        The LP sensitivities of the lexicographic fluxes w.r.t. the oligosaccharide
+        bounds are chained with the derivatives of the Michaelis-Menten uptake and
+        cellulase terms; only the entries of jacobian_sparsity are non-zero.
+        """
+        max_import, cellulase = self.uptake_bounds(y, vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer)
+        conc = y[self.i_oligo]
+        d_import = -vmax_inner_glc*Km_inner_glc/(Km_inner_glc + conc)**2
+        polysac = y[self.i_poly]
+        d_cellulase = -vmax_outer*Km_outer/(Km_outer + polysac)**2
+        
+        _, fluxes, derivatives = self.problem(model, objective_dir).sensitivity(max_import)
+        biomass = y[self.i_growth]
+        
+        J = np.zeros((len(self.rxns), len(self.rxns)))
+        J[:, self.i_growth] = self.rates(fluxes, cellulase)
+        J[np.ix_(self.i_lex, self.i_oligo)] += biomass*derivatives*d_import
+        J[self.i_poly, self.i_poly] += biomass*d_cellulase
+        J[self.i_oligo, self.i_poly[self.oligo_poly]] -= biomass*d_cellulase[self.oligo_poly]*self.oligo_share
+        return J
+
+    def jacobian_sparsity(self):
+        """Non-zero pattern of jacobian."""
+        sparsity = np.zeros((len(self.rxns), len(self.rxns)), dtype=bool)
+        sparsity[:, self.i_growth] = True
+        sparsity[np.ix_(self.i_lex, self.i_oligo)] = True
+        sparsity[self.i_poly, self.i_poly] = True
+        sparsity[self.i_oligo, self.i_poly[self.oligo_poly]] = True
+        return sparsity
+
+
+def as_registry(rxns, glc_eq_poly_dict):
+    """Return glc_eq_poly_dict as a PolysaccharideRegistry (building one if a dict is given)."""
+    if isinstance(glc_eq_poly_dict, PolysaccharideRegistry):
+        return glc_eq_poly_dict
+    return PolysaccharideRegistry(rxns, glc_eq_poly_dict)
+
+
+def model_cache_key(model_path, media, lp_feasibility=True):
+    """Hash of everything read_model depends on: the SBML file, the medium and the cobra version."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        digest.update(f.read())
+    digest.update(repr(sorted(media["DM_cellobiose"])).encode())
+    digest.update(f"{lp_feasibility};{cobra.__version__}".encode())
+    return digest.hexdigest()
+
+
+def read_model(media,lp_feasibility=True,model_path='../models/RcH10_final.xml',cache_dir="../models/cache"):
+    """
+    Load the model with the cellobiose medium applied (and LP feasibility slacks).
+
+    The prepared cobra model is pickled to cache_dir under a hash of the source
+    SBML, the medium and the cobra version, so later calls (other notebook kernels,
+    worker processes) skip the reframed -> SBML -> cobra round trip. A change of
+    the SBML file or the medium gives a new key. Use cache_dir=None to bypass the
+    cache.
+    """
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(model_path))[0]}_"
+                                             f"{model_cache_key(model_path, media, lp_feasibility)}.pkl")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+    
+    import reframed # Only needed to prepare the SBML; not imported with the module
+    
+    model_ref = reframed.load_cbmodel(model_path)
     model_ref.reactions.R_GALabc.lb=0
     model_ref.reactions.R_GALabc.reversible=False
     reframed.save_cbmodel(model_ref, 'test.xml')
@@ -65,46 +248,109 @@ def read_model(media,lp_feasibility=True):
     model.medium = medium
     if lp_feasibility:
         cobra.util.add_lp_feasibility(model)
+    
+    if cache_dir is not None:
+        # Write to a temporary file first so a concurrent reader never sees a partial pickle
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    
     return model
 
 
-def dynamic_system_general(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    """Calculate the time derivative of external species."""    
+def solve_lp(model, y, rxns, objective_dir, glc_eq_poly_dict, combination, lexicographic=True):
+    """
+    Solve the LP at state y and return feasibility, lexicographic values and cellulase rates.
 
-    vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer = combination
-
-    rxns_map = copy.copy(rxns)
+    Solutions are shared between dynamic_system_general and infeasible_event through
+    dynamic_system_general.cache, so each distinct state is optimized once.
+    """
+    registry = as_registry(rxns, glc_eq_poly_dict)
+    cache = dynamic_system_general.cache
+    instrumentation = dfba_instrumentation.current()
+    field = "fluxes" if lexicographic else "feasibility"
     
-    for key in glc_eq_poly_dict.keys():
-        rxns_map.remove(key)
-        
-    conc_dict = dict(zip(rxns,y))
-    # Calculate the specific exchanges fluxes at the given external concentrations.
+    if cache is not None:
+        key = cache.key(y, id(model), rxns, objective_dir, registry.polysaccharides, combination)
+        entry = cache.lookup(key, field)
+        if entry is not None:
+            if instrumentation is not None:
+                instrumentation.cache_hit()
+            fluxes = entry["fluxes"].copy() if lexicographic else None
+            return entry["feasibility"], fluxes, entry["cellulase"]
+    
+    fluxes = None
 
     with model:
         # Calculate the specific exchanges fluxes at the given external concentrations.
-        cellulase_dict = add_dynamic_bounds(model, conc_dict,glc_eq_poly_dict,vmax_inner_glc, Km_inner_glc,vmax_outer, Km_outer)
-        feasibility = cobra.util.fix_objective_as_constraint(model)
-        lex_constraints = cobra.util.add_lexicographic_constraints(model, rxns_map, objective_dir)
+        cellulase = registry.add_dynamic_bounds(model, y, *combination)
+        
+        # One solve per stage: 0 (feasibility), then one per lexicographic reaction
+        with dfba_instrumentation.timed_solves(model.solver, instrumentation):
+            feasibility = cobra.util.fix_objective_as_constraint(model)
+            
+            if lexicographic:
+                lex_constraints = cobra.util.add_lexicographic_constraints(model, registry.rxns_map, objective_dir)
+                fluxes = lex_constraints.values
+    
+    if cache is not None:
+        if lexicographic:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase, fluxes=fluxes.copy())
+        else:
+            cache.store(key, feasibility=feasibility, cellulase=cellulase)
+    
+    return feasibility, fluxes, cellulase
+
+
+def dynamic_system_general(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
+    """Calculate the time derivative of external species."""    
+    instrumentation = dfba_instrumentation.current()
+    if instrumentation is not None:
+        start = instrumentation.start_call()
+    
+    registry = as_registry(rxns, glc_eq_poly_dict)
+    
+    feasibility, fluxes, cellulase = solve_lp(model, y, rxns, objective_dir, registry, combination)
 
     # Since the calculated fluxes are specific rates, we multiply them by the
     # biomass concentration to get the bulk exchange rates.
+    dydt = registry.derivatives(y, fluxes, cellulase)
+    
+    if instrumentation is not None:
+        instrumentation.rhs(t, start)
+    return dydt
 
-    fluxes =lex_constraints.values
-    i = 1 
+dynamic_system_general.cache = LPSolutionCache()
 
-    for polysac_id,glc_eq_dict in  glc_eq_poly_dict.items():  
-        for key, glc_eq in glc_eq_dict.items():
-            uptake = fluxes[i]
-            fluxes[i] = uptake - cellulase_dict[polysac_id]/(glc_eq*len(glc_eq_dict)) # 1 mol of cellulase produces one mol of glucose equivalents
-            i +=1
-        fluxes =np.append(fluxes, cellulase_dict[polysac_id])
 
-    fluxes *= conc_dict["Growth"]
-    return fluxes
+def dynamic_system_general_jacobian(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
+    """Jacobian of dynamic_system_general (see PolysaccharideRegistry.jacobian)."""
+    registry = as_registry(rxns, glc_eq_poly_dict)
+    cache = dynamic_system_general.cache
+    
+    if cache is not None:
+        key = cache.key(y, id(model), rxns, objective_dir, registry.polysaccharides, combination)
+        entry = cache.lookup(key, "jacobian")
+        if entry is not None:
+            return entry["jacobian"].copy()
+    
+    J = registry.jacobian(model, np.asarray(y, dtype=float), objective_dir, *combination)
+    
+    if cache is not None:
+        cache.store(key, jacobian=J.copy())
+    return J
 
 
-def multiple_polysaccharide_inner_problem(combination,model,media,rxns,y0,objective_dir,glc_eq_poly_dict,t_end=False):
+def multiple_polysaccharide_inner_problem(combination,model,media,rxns,y0,objective_dir,glc_eq_poly_dict,t_end=False,
+                                          analytic_jacobian=False):
+    """
+    Integrate one phase of the batch.
+
+    With analytic_jacobian, LSODA gets dynamic_system_general_jacobian (one
+    lexicographic solve with sensitivities) instead of finite differences.
+    """
     vmax_inner_glc, Km_inner_glc,vmax_outer, Km_outer= combination
     
     y = []
@@ -114,26 +360,43 @@ def multiple_polysaccharide_inner_problem(combination,model,media,rxns,y0,object
     else:
         ts = np.linspace(0, 50, 1000)   
     
+    registry = as_registry(rxns, glc_eq_poly_dict)
+    
+    if dynamic_system_general.cache is not None:
+        dynamic_system_general.cache.clear()
+    
     sol = solve_ivp(
         fun=dynamic_system_general,
         t_span=(ts.min(), ts.max()),
         y0=y0,
         t_eval=ts,
         method='LSODA',
-        events = [infeasible_event,infeasible_event2,infeasible_event3,infeasible_event4,infeasible_event5],
-        args = (model,rxns,objective_dir,glc_eq_poly_dict,combination),
+        events = [infeasible_event] + registry.events,
+        args = (model,rxns,objective_dir,registry,combination),
+        jac=dynamic_system_general_jacobian if analytic_jacobian else None,
     )
+    
+    if dfba_instrumentation.current() is not None:
+        dfba_instrumentation.current().integration(sol, ["infeasible_event"] +
+                                                   [f"depletion_{polysac_id[3:-2]}" for polysac_id in registry.polysaccharides])
 
     return sol
 
 
 
 
-def multiple_polysaccharide_simulation(combination,model,media,rxns,y0,objective_dir,glc_eq_poly_dict,t_end=False):
+def multiple_polysaccharide_simulation(combination,model,media,rxns,y0,objective_dir,glc_eq_poly_dict,t_end=False,
+                                       analytic_jacobian=False):
+    """
+    Simulate the batch phase by phase, dropping each polysaccharide when it is depleted.
 
+    Returns a TrajectoryStore; C_results_tot[rxn]["t"] and C_results_tot[rxn]["C"]
+    are views of the trajectory of rxn.
+    """
     
     C_dict = OrderedDict(zip(rxns,y0))
-    C_results_tot = {rxn:{"C":[value],"t":[0]} for rxn,value in C_dict.items()}
+    C_results_tot = TrajectoryStore(rxns)
+    C_results_tot.append([0], y0)
     
     glc_eq_poly_dict_copy = glc_eq_poly_dict.copy()
     C_dict_copy = C_dict.copy()
@@ -144,40 +407,35 @@ def multiple_polysaccharide_simulation(combination,model,media,rxns,y0,objective
 
     while sum([C_results_tot[polysac_id]["C"][-1] for polysac_id in glc_eq_poly_dict_copy.keys()]) >1e-1:
         
+        registry = PolysaccharideRegistry(rxns, glc_eq_poly_dict_copy)
+        
         sol = multiple_polysaccharide_inner_problem(combination,
                                                         model,
                                                         media,
                                                         rxns,
                                                         y0,
                                                         objective_dir_copy,
-                                                        glc_eq_poly_dict_copy,
-                                                        t_end=t_end)
+                                                        registry,
+                                                        t_end=t_end,
+                                                        analytic_jacobian=analytic_jacobian)
+        registry.close()
         
             
         ## Update concentrations
         C_results = dict(zip(rxns,sol.y))
 
-        for rxn,conc in C_results.items():
-            C_results_tot[rxn]["C"] = C_results_tot[rxn]["C"][:-1] + list(conc)
-            C_results_tot[rxn]["t"] = C_results_tot[rxn]["t"][:-1] + list(C_results_tot[rxn]["t"][-1] +sol.t)
+        # The first point of the phase replaces the last point of the previous one
+        C_results_tot.append(C_results_tot.t[-1] + sol.t, sol.y, species=rxns, overlap=True)
 
 
         last_events = [(t_event[-1] if len(t_event) else 0) for t_event in sol.t_events]
         event_nr = np.argmax(last_events)
 
         ## Prepare for next iteration 
-        if event_nr == 1:
-            polysac_id = "EX_arabinoxylan_e"
-
-        elif event_nr== 2:
-            polysac_id = "EX_xyloglucan_e"   
-        elif event_nr== 3:
-            polysac_id = "EX_xylan_e"   
-
-        elif event_nr== 4:
-            polysac_id = "EX_cellulose_e"   
-        else:
+        # Event 0 is infeasibility, the others are the depletion events of the registry
+        if event_nr == 0:
             break
+        polysac_id = registry.polysaccharides[event_nr-1]
 
         # remove items that have reached the final concentration
         rm_rxns_dict = glc_eq_poly_dict_copy.pop(polysac_id)
@@ -194,92 +452,17 @@ def multiple_polysaccharide_simulation(combination,model,media,rxns,y0,objective
 
 
 def infeasible_event(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer = combination
-    rxns_map = copy.copy(rxns)
+    instrumentation = dfba_instrumentation.current()
+    if instrumentation is not None:
+        start = instrumentation.start_call()
     
-    for key in glc_eq_poly_dict.keys():
-        rxns_map.remove(key)
-    conc_dict = dict(zip(rxns,y))
-     
-    with model:
-
-        cellulase_dict = add_dynamic_bounds(model, conc_dict,glc_eq_poly_dict,vmax_inner_glc, Km_inner_glc, vmax_outer, Km_outer)
-        feasibility = cobra.util.fix_objective_as_constraint(model)
+    feasibility, _, _ = solve_lp(model, y, rxns, objective_dir, glc_eq_poly_dict, combination, lexicographic=False)
+    
+    if instrumentation is not None:
+        instrumentation.event(t, start, feasibility - infeasible_event.epsilon,
+                              infeasible=feasibility > infeasible_event.epsilon)
     return feasibility - infeasible_event.epsilon
 
 infeasible_event.epsilon = 1E-6
 infeasible_event.direction = 1
 infeasible_event.terminal = True
-
-def infeasible_event2(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    
-    conc_dict = dict(zip(rxns,y))
-    
-    if "EX_arabinoxylan_e" in rxns:
-        arabinoxylan = conc_dict["EX_arabinoxylan_e"]+conc_dict["EX_AX_e"]+conc_dict["EX_AXX_e"]+conc_dict["EX_XAXX_e"]+conc_dict["EX_A23XX_e"] + +conc_dict["EX_XA23XX_e"]
-        
-        diff = arabinoxylan - infeasible_event2.epsilon
-        if diff<0:
-            print(f"Lack of arabinoxylan: {diff}")
-        return diff
-    else:
-        return 10
-
-infeasible_event2.epsilon=1E-2
-infeasible_event2.direction = 0
-infeasible_event2.terminal = True
-
-def infeasible_event3(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    
-    conc_dict = dict(zip(rxns,y))
-    
-    if "EX_xyloglucan_e" in rxns: 
-        xyloglucan = conc_dict["EX_xyloglucan_e"]+conc_dict["EX_QLLG_e"]+conc_dict["EX_QLQG_e"]+conc_dict["EX_QQLG_e"]+conc_dict["EX_QQQG_e"]+conc_dict["EX_GQQG_e"]
-        diff = xyloglucan - infeasible_event3.epsilon
-        if diff<0:
-            print(f"Lack of xyloglucan: {diff}")
-        return diff
-    else:
-        return 10
-
-infeasible_event3.epsilon=1E-2
-infeasible_event3.direction = 0
-infeasible_event3.terminal = True
-
-def infeasible_event4(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    
-    conc_dict = dict(zip(rxns,y))
-    
-    if "EX_xylan_e" in rxns: 
-        xylan = conc_dict["EX_xylan_e"]+conc_dict["EX_xylb_e"]+conc_dict["EX_xyl3_e"]+conc_dict["EX_xylan4_e"]+conc_dict["EX_xylan8_e"]
-        diff = xylan - infeasible_event4.epsilon
-        if diff<0:
-            print(f"Lack of xylan: {diff}")
-        return diff
-    else:
-        return 10
-
-infeasible_event4.epsilon=1E-2
-infeasible_event4.direction = 0
-infeasible_event4.terminal = True
-
-def infeasible_event5(t, y,model,rxns,objective_dir,glc_eq_poly_dict,combination):
-    
-    conc_dict = dict(zip(rxns,y))
-    
-    if "EX_cellulose_e" in rxns: 
-        cellulose = conc_dict["EX_cellulose_e"]+conc_dict["EX_cell5_e"]+conc_dict["EX_cell4_e"]+conc_dict["EX_cell3_e"]+conc_dict["EX_cellb_e"]
-        diff = cellulose - infeasible_event5.epsilon
-        if diff<0:
-            print(f"Lack of cellulose: {diff}")
-        return diff
-    else:
-        return 10
-
-infeasible_event5.epsilon=1E-2
-infeasible_event5.direction = 0
-infeasible_event5.terminal = True
-
-
-
-
@@ -0,0 +1,193 @@
+import time
+from contextlib import contextmanager
+
+
+# Instrumentation of the running simulation; None when instrumentation is off
+_active = None
+
+
+def current():
+    """The active Instrumentation, or None (the dFBA modules check this on every call)."""
+    return _active
+
+
+@contextmanager
+def instrument(pbar=None, trace=None):
+    """
+    Instrument the dFBA simulations run inside the block.
+
+        with dfba_instrumentation.instrument(trace="../results/trace.csv") as instrumentation:
+            dfba_cobra_cellulose.optimize_parameters(...)
+        print(instrumentation.summary())
+
+    pbar is an optional tqdm progress bar updated with the simulation time on
+    every RHS call; trace is an optional path of a per-call CSV trace.
+    """
+    global _active
+    previous = _active
+    instrumentation = Instrumentation(pbar=pbar, trace=trace)
+    _active = instrumentation
+    try:
+        yield instrumentation
+    finally:
+        _active = previous
+        instrumentation.close()
+
+
+@contextmanager
+def timed_solves(solver, instrumentation, first_stage=0):
+    """
+    Time every solver.optimize() call inside the block as the next lexicographic stage.
+
+    For the cobra path, where fix_objective_as_constraint and
+    add_lexicographic_constraints solve one stage per call: only the solves
+    are timed, not the building of the constraints. Does nothing if
+    instrumentation is None.
+    """
+    if instrumentation is None:
+        yield
+        return
+    optimize = solver.optimize
+    stage = first_stage
+
+    def timed_optimize():
+        nonlocal stage
+        start = time.perf_counter()
+        try:
+            return optimize()
+        finally:
+            instrumentation.lp(stage, time.perf_counter() - start)
+            stage += 1
+
+    solver.optimize = timed_optimize
+    try:
+        yield
+    finally:
+        del solver.optimize
+
+
+class Instrumentation:
+    """
+    Counters and timers of the dFBA hot path.
+
+    RHS and event calls are timed as a whole, LP solves per lexicographic stage
+    (stage 0 is the feasibility problem). Time spent outside of the solver in
+    RHS and event calls is reported as Python time; solves outside of them
+    (e.g. for a Jacobian) only count as solver time. Integrations report their
+    solve_ivp statistics and event hits through ``integration``.
+    """
+
+    def __init__(self, pbar=None, trace=None):
+        self.pbar = pbar
+        self.rhs_calls = 0
+        self.event_calls = 0
+        self.cache_hits = 0
+        self.infeasible = 0
+        self.rhs_time = 0.0
+        self.event_time = 0.0
+        self.call_lp_time = 0.0
+        self.lp_solves = {}
+        self.lp_time = {}
+        self.event_hits = {}
+        self.integrations = []
+
+        self._call_lp_time = 0.0
+        self._call_lp_solves = 0
+        self._start = time.perf_counter()
+        self._trace = None
+        if trace is not None:
+            self._trace = open(trace, "w")
+            self._trace.write("kind,t,wall,elapsed,lp_time,lp_solves,value\n")
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def start_call(self):
+        """Start timing an RHS or event call."""
+        self._call_lp_time = 0.0
+        self._call_lp_solves = 0
+        return time.perf_counter()
+
+    def _end_call(self, kind, t, start, value):
+        elapsed = time.perf_counter() - start
+        self.call_lp_time += self._call_lp_time
+        if self._trace is not None:
+            self._trace.write(f"{kind},{t},{start - self._start},{elapsed},{self._call_lp_time},"
+                              f"{self._call_lp_solves},{'' if value is None else value}\n")
+        return elapsed
+
+    def rhs(self, t, start):
+        self.rhs_calls += 1
+        self.rhs_time += self._end_call("rhs", t, start, None)
+        if self.pbar is not None:
+            self.pbar.update(1)
+            self.pbar.set_description('t = {:.3f}'.format(t))
+
+    def event(self, t, start, value, name="infeasible_event", infeasible=False):
+        self.event_calls += 1
+        if infeasible:
+            self.infeasible += 1
+        self.event_time += self._end_call(name, t, start, value)
+
+    def lp(self, stage, elapsed):
+        """One LP solve of a lexicographic stage."""
+        self.lp_solves[stage] = self.lp_solves.get(stage, 0) + 1
+        self.lp_time[stage] = self.lp_time.get(stage, 0.0) + elapsed
+        self._call_lp_time += elapsed
+        self._call_lp_solves += 1
+
+    def cache_hit(self):
+        self.cache_hits += 1
+
+    def integration(self, sol, event_names=None):
+        """Record the statistics and event hits of a solve_ivp result."""
+        hits = {}
+        for k, t_events in enumerate(sol.t_events or []):
+            name = event_names[k] if event_names is not None else f"event_{k}"
+            hits[name] = len(t_events)
+            self.event_hits[name] = self.event_hits.get(name, 0) + len(t_events)
+        self.integrations.append({"nfev": sol.nfev, "njev": sol.njev, "nlu": sol.nlu,
+                                  "status": sol.status, "message": sol.message, "event_hits": hits})
+
+    def summary(self):
+        return InstrumentationSummary(self)
+
+
+class InstrumentationSummary:
+    """Snapshot of an Instrumentation; ``as_dict()`` for logging, ``repr`` for reading."""
+
+    def __init__(self, instrumentation):
+        lp_time = sum(instrumentation.lp_time.values())
+        self.rhs_calls = instrumentation.rhs_calls
+        self.event_calls = instrumentation.event_calls
+        self.cache_hits = instrumentation.cache_hits
+        self.infeasible = instrumentation.infeasible
+        self.lp_solves = dict(sorted(instrumentation.lp_solves.items(), key=lambda item: str(item[0])))
+        self.lp_time = dict(sorted(instrumentation.lp_time.items(), key=lambda item: str(item[0])))
+        self.solver_time = lp_time
+        self.python_time = instrumentation.rhs_time + instrumentation.event_time - instrumentation.call_lp_time
+        self.rhs_time = instrumentation.rhs_time
+        self.event_time = instrumentation.event_time
+        self.event_hits = dict(instrumentation.event_hits)
+        self.integrations = list(instrumentation.integrations)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        lines = [f"RHS calls:      {self.rhs_calls} ({self.rhs_time:.3f} s)",
+                 f"event calls:    {self.event_calls} ({self.event_time:.3f} s, {self.infeasible} infeasible)",
+                 f"cache hits:     {self.cache_hits}",
+                 f"solver time:    {self.solver_time:.3f} s",
+                 f"python time:    {self.python_time:.3f} s",
+                 "LP solves per stage:"]
+        for stage, count in self.lp_solves.items():
+            lines.append(f"\t stage {stage}: {count} ({self.lp_time[stage]:.3f} s)")
+        if self.event_hits:
+            lines.append(f"event hits:     {self.event_hits}")
+        for integration in self.integrations:
+            lines.append(f"integration:    nfev={integration['nfev']} njev={integration['njev']} "
+                         f"nlu={integration['nlu']} status={integration['status']}")
+        return "\n".join(lines)
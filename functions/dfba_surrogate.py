@@ -0,0 +1,204 @@
+import warnings
+from functools import lru_cache
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from dfba_cobra_cellulose import DynamicFBAProblem, uptake_bounds
+
+
+class FluxSurrogate:
+    """
+    Interpolated lexicographic flux response of the cellulose dFBA model.
+
+    The only inputs of the LP that change during a batch simulation are the lower
+    bounds of glucose and cellobiose uptake, so the feasibility value and the
+    lexicographic stage optima are tabulated over a rectilinear grid of these two
+    bounds and linearly interpolated. It has the same ``solve`` interface as
+    DynamicFBAProblem and can be passed to dynamic_system, infeasible_event and
+    optimize_parameters in place of the model.
+
+    Grid points where the exact LP failed are NaN cells; they would spread to
+    every interpolated value around them, so a table with NaN cells cannot be
+    saved.
+    """
+
+    def __init__(self, glc_grid, cellb_grid, feasibility, values, rxns, objective_dir, validation=None):
+        self.glc_grid = np.asarray(glc_grid, dtype=float)
+        self.cellb_grid = np.asarray(cellb_grid, dtype=float)
+        self.feasibility = np.asarray(feasibility, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.rxns = list(rxns)
+        self.objective_dir = list(objective_dir)
+        self.validation = validation or {}
+
+        self.rxns_map = self.rxns + ["EX_cellulose_e"]
+        self.index = {rxn: i for i, rxn in enumerate(self.rxns_map)}
+        self.i_growth = self.index["Growth"]
+        self.i_glc = self.index["EX_glc__D_e"]
+        self.i_cellb = self.index["EX_cellb_e"]
+        self.i_cellulose = self.index["EX_cellulose_e"]
+
+        table = np.concatenate([self.feasibility[..., None], self.values], axis=2)
+        # Bounds outside of the table are extrapolated linearly from the edge cells
+        self._interpolator = RegularGridInterpolator((self.glc_grid, self.cellb_grid), table,
+                                                     bounds_error=False, fill_value=None)
+
+    def solve_bounds(self, lower_bounds, lexicographic=True):
+        point = self._interpolator(np.asarray(lower_bounds, dtype=float)[None, :])[0]
+        return point[0], (point[1:] if lexicographic else None)
+
+    def solve(self, y, combination, lexicographic=True):
+        glucose_max_import, cellobiose_max_import, cellulase = uptake_bounds(y[self.i_glc],
+                                                                             y[self.i_cellb],
+                                                                             y[self.i_cellulose],
+                                                                             combination)
+        feasibility, values = self.solve_bounds((glucose_max_import, cellobiose_max_import),
+                                                lexicographic=lexicographic)
+        return feasibility, values, cellulase
+
+    def validate(self, problem, n_samples=200, seed=0):
+        """Compare the interpolated values against the exact LP at random points of the table domain."""
+        rng = np.random.default_rng(seed)
+        points = np.column_stack([rng.uniform(self.glc_grid[0], self.glc_grid[-1], n_samples),
+                                  rng.uniform(self.cellb_grid[0], self.cellb_grid[-1], n_samples)])
+
+        errors = []
+        for point in points:
+            feasibility, values = problem.solve_bounds(point)
+            exact = np.append(feasibility, values)
+            feasibility, values = self.solve_bounds(point)
+            errors.append(np.abs(np.append(feasibility, values) - exact))
+        errors = np.array(errors)
+
+        self.validation = {"n_samples": n_samples,
+                           "max_abs_error": float(errors.max()),
+                           "mean_abs_error": float(errors.mean()),
+                           "max_abs_error_per_stage": dict(zip(["feasibility"] + self.rxns,
+                                                               errors.max(axis=0).tolist()))}
+        return self.validation
+
+    def failed_points(self):
+        """Number of grid points without a solution (NaN cells)."""
+        return int(np.isnan(self.feasibility).sum())
+
+    def save(self, path):
+        if self.failed_points() or np.isnan(self.values).any():
+            raise ValueError(f"{self.failed_points()} grid points of the table failed to solve; refusing to save "
+                             f"a table with NaN cells")
+        np.savez_compressed(path,
+                            glc_grid=self.glc_grid,
+                            cellb_grid=self.cellb_grid,
+                            feasibility=self.feasibility,
+                            values=self.values,
+                            rxns=np.array(self.rxns),
+                            objective_dir=np.array(self.objective_dir),
+                            validation=np.array([self.validation], dtype=object))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=True)
+        return cls(data["glc_grid"], data["cellb_grid"], data["feasibility"], data["values"],
+                   data["rxns"].tolist(), data["objective_dir"].tolist(),
+                   validation=data["validation"][0])
+
+
+def _evaluate(problem, glc_bounds, cellb_bounds):
+    """Exact LP over the outer product of the given bounds: feasibility and stage values (NaN where the LP fails)."""
+    table = np.full((len(glc_bounds), len(cellb_bounds), len(problem.rxns) + 1), np.nan)
+    for i, glc_bound in enumerate(glc_bounds):
+        for j, cellb_bound in enumerate(cellb_bounds):
+            try:
+                feasibility, values = problem.solve_bounds((glc_bound, cellb_bound))
+            except Exception:
+                continue
+            table[i, j, 0] = feasibility
+            table[i, j, 1:] = values
+    return table
+
+
+def _refine_axis(problem, grid, other_grid, table, axis, tol, scale, max_points):
+    """Insert midpoints along one axis wherever linear interpolation misses a kink."""
+    new_grid = [grid[0]]
+    new_rows = [np.take(table, 0, axis=axis)]
+    inserted = 0
+
+    for k in range(len(grid) - 1):
+        left = np.take(table, k, axis=axis)
+        right = np.take(table, k + 1, axis=axis)
+
+        if len(grid) + inserted < max_points:
+            midpoint = 0.5*(grid[k] + grid[k+1])
+            if axis == 0:
+                mid = _evaluate(problem, [midpoint], other_grid)[0]
+            else:
+                mid = _evaluate(problem, other_grid, [midpoint])[:, 0]
+
+            error = np.nanmax(np.abs(mid - 0.5*(left + right))/scale, initial=0)
+            if error > tol:
+                new_grid.append(midpoint)
+                new_rows.append(mid)
+                inserted += 1
+
+        new_grid.append(grid[k+1])
+        new_rows.append(right)
+
+    return np.array(new_grid), np.stack(new_rows, axis=axis), inserted
+
+
+def build_surrogate(model, rxns, objective_dir, glc_range=(-10, 0), cellb_range=(-10, 0),
+                    n_initial=9, tol=1e-3, max_points=257, max_iter=8, n_validation=200, path=None):
+    """
+    Tabulate the lexicographic flux response over the glucose/cellobiose uptake bounds.
+
+    The table starts from an n_initial x n_initial grid over glc_range x cellb_range
+    and is refined adaptively: an interval is split when the exact LP at its
+    midpoint differs from the linear interpolation by more than tol (relative to
+    the range of each stage value), which places grid lines at the kinks of the
+    piecewise-linear LP response. The ranges must cover -vmax of the parameter
+    combinations that will be simulated. The finished table is validated against
+    the exact LP at n_validation random points and optionally written to path.
+    A warning reports grid points where the LP failed; such a table is not
+    validated and cannot be written.
+    """
+    problem = DynamicFBAProblem(model, rxns, objective_dir)
+    try:
+        glc_grid = np.linspace(*glc_range, n_initial)
+        cellb_grid = np.linspace(*cellb_range, n_initial)
+        table = _evaluate(problem, glc_grid, cellb_grid)
+
+        for iteration in range(max_iter):
+            scale = np.nanmax(table, axis=(0, 1)) - np.nanmin(table, axis=(0, 1))
+            scale[~(scale > 0)] = 1
+
+            glc_grid, table, inserted_glc = _refine_axis(problem, glc_grid, cellb_grid, table, 0, tol, scale, max_points)
+            cellb_grid, table, inserted_cellb = _refine_axis(problem, cellb_grid, glc_grid, table, 1, tol, scale, max_points)
+            print(f"\t iteration {iteration}: grid {len(glc_grid)} x {len(cellb_grid)}")
+
+            if inserted_glc + inserted_cellb == 0:
+                break
+
+        surrogate = FluxSurrogate(glc_grid, cellb_grid, table[..., 0], table[..., 1:], rxns, objective_dir)
+        failed = surrogate.failed_points()
+        if failed:
+            warnings.warn(f"The LP failed at {failed} of {table[..., 0].size} grid points; "
+                          f"the table has NaN cells and is not validated")
+        elif n_validation:
+            validation = surrogate.validate(problem, n_samples=n_validation)
+            print(f"\t max abs error at {n_validation} sampled points: {validation['max_abs_error']:.3g}")
+    finally:
+        problem.close()
+
+    if path is not None:
+        surrogate.save(path)
+    return surrogate
+
+
+@lru_cache(maxsize=None)
+def load_surrogate(path):
+    """Load a stored table once per process and report its validation error."""
+    surrogate = FluxSurrogate.load(path)
+    if surrogate.validation:
+        print(f"\t surrogate {path}: max abs error {surrogate.validation['max_abs_error']:.3g} "
+              f"at {surrogate.validation['n_samples']} sampled points")
+    return surrogate
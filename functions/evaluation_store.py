@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import time
+
+import cobra
+import numpy as np
+
+
+def model_hash(model):
+    """
+    Content hash of a cobra model, a compiled problem or a flux surrogate.
+
+    Covers reaction bounds and stoichiometry, the objective direction and the size
+    of the solver problem (so added slacks or ratio constraints change the hash).
+    A compiled problem is hashed as the model it was built from: the bounds it
+    sets on the uptake reactions and the stage constraints and objective
+    direction it adds are replaced by their original values, so the hash does
+    not depend on the state the problem was last solved at.
+    """
+    digest = hashlib.sha1()
+    bounds = {}
+    added_constraints = 0
+    direction = None
+
+    if hasattr(model, "model"):
+        # Compiled problem wrapping a cobra model
+        digest.update(type(model).__name__.encode())
+        bounds = {rxn.id: lower_bound for rxn, lower_bound in zip(model.bounded, model._original_bounds)}
+        added_constraints = len(model.constraints) if model.constraints is not None else 0
+        direction = model._original_direction
+        model = model.model
+
+    if isinstance(model, cobra.Model):
+        for rxn in sorted(model.reactions, key=lambda rxn: rxn.id):
+            stoichiometry = sorted((met.id, coefficient) for met, coefficient in rxn.metabolites.items())
+            lower_bound = bounds.get(rxn.id, rxn.lower_bound)
+            digest.update(f"{rxn.id};{lower_bound};{rxn.upper_bound};{stoichiometry}\n".encode())
+        direction = direction or model.objective.direction
+        digest.update(f"{direction};{len(model.variables)};{len(model.constraints) - added_constraints}".encode())
+    else:
+        digest.update(type(model).__name__.encode())
+        for table in (model.glc_grid, model.cellb_grid, model.feasibility, model.values):
+            digest.update(np.ascontiguousarray(table).tobytes())
+
+    return digest.hexdigest()
+
+
+class EvaluationStore:
+    """
+    Append-only on-disk store of optimize_parameters evaluations.
+
+    Each line of the JSON-lines file is either an evaluation, keyed on the
+    quantized parameter combination, the integration tolerances and a hash of the
+    model and simulation setup, or a differential-evolution generation
+    (population and penalties) so an interrupted run can be resumed from its last
+    generation. Lines are short and written with a single append, so several
+    worker processes can share one file; ``refresh`` picks up lines written by
+    other processes.
+    """
+
+    def __init__(self, path="../results/evaluation_store.jsonl", decimals=6):
+        self.path = path
+        self.decimals = decimals
+        self.evaluations = {}
+        self.generations = []
+        self._offset = 0
+        self._hashes = {}
+        self.refresh()
+
+    def __len__(self):
+        return len(self.evaluations)
+
+    def refresh(self):
+        """Read lines appended since the last read."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    # Line still being written by another process
+                    break
+                self._offset += len(line.encode())
+                record = json.loads(line)
+                if "generation" in record:
+                    self.generations.append(record)
+                else:
+                    self.evaluations[record["key"]] = record
+
+    def _append(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def quantize(self, combination):
+        return [round(float(value), self.decimals) for value in combination]
+
+    def setup_hash(self, model, y0, rxns, objective_dir, t_end=False):
+        """Hash of the model and the simulation setup (computed once per model object)."""
+        if id(model) not in self._hashes:
+            self._hashes[id(model)] = model_hash(model)
+        setup = json.dumps([self._hashes[id(model)], [float(value) for value in y0],
+                            list(rxns), list(objective_dir), t_end])
+        return hashlib.sha1(setup.encode()).hexdigest()
+
+    def key(self, combination, model, y0, rxns, objective_dir, rtol, atol, t_end=False):
+        key = json.dumps([self.quantize(combination), rtol, atol,
+                          self.setup_hash(model, y0, rxns, objective_dir, t_end)])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+        return self.evaluations.get(key)
+
+    def add(self, key, combination, penalty, penalty_growth=None, penalty_cellulose=None, **extra):
+        record = {"key": key,
+                  "combination": self.quantize(combination),
+                  "penalty": float(penalty),
+                  "penalty_growth": penalty_growth if penalty_growth is None else float(penalty_growth),
+                  "penalty_cellulose": penalty_cellulose if penalty_cellulose is None else float(penalty_cellulose),
+                  "time": time.time()}
+        record.update(extra)
+        self.evaluations[key] = record
+        self._append(record)
+        return record
+
+    def record_generation(self, population, energies):
+        record = {"generation": len(self.generations) + 1,
+                  "population": np.asarray(population, dtype=float).tolist(),
+                  "energies": [float(energy) for energy in energies],
+                  "time": time.time()}
+        self.generations.append(record)
+        self._append(record)
+        return record
+
+    def last_generation(self):
+        """Population and penalties of the last stored generation (None if there is none)."""
+        if not self.generations:
+            return None
+        record = self.generations[-1]
+        return np.array(record["population"]), np.array(record["energies"])
+
+    def to_frame(self):
+        """Evaluations as a DataFrame, one row per stored combination."""
+        import pandas as pd
+        return pd.DataFrame(list(self.evaluations.values()))
@@ -0,0 +1,127 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import reframed
+from reframed.solvers.solution import Status
+
+
+# One envelope: growth (x) against product flux (y) with the uptake bounds applied
+# and, if growth_cap is not None, growth limited to growth_cap
+Scenario = namedtuple("Scenario", ["uptake", "growth_cap", "product"])
+Envelope = namedtuple("Envelope", ["scenario", "x", "ymin", "ymax"])
+
+
+# Identifiers of the models compared in Step 6
+MODEL_IDS = {"iIB727": {"growth": "R_Growth", "exchange": "R_EX_{}_e"},
+             "CarveMe draft": {"growth": "Growth", "exchange": "R_EX_{}_e"},
+             "iFS431": {"growth": "EX_BIOMASS_e_", "exchange": "EX_{}_e_"}}
+
+
+def exchange_id(model_id, met):
+    """Exchange reaction of a BiGG metabolite id (e.g. "lac__L") in one of the MODEL_IDS models."""
+    if model_id == "iFS431":
+        met = met.replace("__D","_D").replace("__L", "_L")
+    return MODEL_IDS[model_id]["exchange"].format(met)
+
+
+def chemostat_scenarios(model_id, q_cellb, mu, products=("ac", "etoh", "lac__L"), capped=True):
+    """
+    Scenarios of the Step 6 validation plots for one model.
+
+    For every product and chemostat point, cellobiose uptake is limited to the
+    measured rate; with capped, a second envelope limits growth to the measured
+    growth rate.
+    """
+    scenarios = []
+    for product in products:
+        for q_cellb_i, mu_i in zip(q_cellb, mu):
+            uptake = {exchange_id(model_id, "cellb"): (-q_cellb_i, 0)}
+            scenarios.append(Scenario(uptake, None, exchange_id(model_id, product)))
+            if capped:
+                scenarios.append(Scenario(uptake, mu_i, exchange_id(model_id, product)))
+    return scenarios
+
+
+class EnvelopeSolver:
+    """
+    Flux envelopes on a single LP.
+
+    The reframed solver is built once for the model; an envelope only changes
+    the temporary bounds and the objective between solves, so the solver
+    re-optimizes from the previous basis along the envelope (neighbouring steps
+    differ in one bound only) and between scenarios.
+    """
+
+    def __init__(self, model, growth, constraints=None):
+        self.model = model
+        self.growth = growth
+        self.constraints = dict(constraints or {})
+        self.solver = reframed.solver_instance(model)
+
+    def _range(self, rxn, constraints):
+        values = []
+        for minimize in (True, False):
+            sol = self.solver.solve(linear={rxn: 1}, minimize=minimize, constraints=constraints, get_values=False)
+            values.append(sol.fobj if sol.status == Status.OPTIMAL else np.nan)
+        return values
+
+    def envelope(self, scenario, steps=50):
+        constraints = dict(self.constraints)
+        constraints.update(scenario.uptake)
+        if scenario.growth_cap is not None:
+            lb = constraints.get(self.growth, (self.model.reactions[self.growth].lb,))[0]
+            constraints[self.growth] = (lb, scenario.growth_cap)
+
+        xmin, xmax = self._range(self.growth, constraints)
+        if np.isnan(xmin) or np.isnan(xmax):
+            return Envelope(scenario, np.array([]), np.array([]), np.array([]))
+
+        x = np.linspace(xmin, xmax, steps)
+        ymin, ymax = np.empty(steps), np.empty(steps)
+        for k, x_k in enumerate(x):
+            constraints[self.growth] = (x_k, x_k)
+            ymin[k], ymax[k] = self._range(scenario.product, constraints)
+        return Envelope(scenario, x, ymin, ymax)
+
+
+# Envelope solver of a worker process, built once by _init_worker
+_worker = {}
+
+
+def _init_worker(model, growth, constraints, steps):
+    _worker["solver"] = EnvelopeSolver(model, growth, constraints)
+    _worker["steps"] = steps
+
+
+def _envelope(scenario):
+    return _worker["solver"].envelope(scenario, steps=_worker["steps"])
+
+
+def compute_flux_envelopes(model, scenarios, growth="R_Growth", constraints=None, steps=50, processes=None):
+    """
+    Growth/product flux envelopes of a reframed model for a list of Scenario.
+
+    constraints are applied to every scenario (e.g. the medium). Returns one
+    Envelope (x, ymin, ymax arrays) per scenario, in order. With processes, the
+    scenarios are distributed over that many worker processes, each holding
+    its own solver.
+    """
+    if not processes:
+        solver = EnvelopeSolver(model, growth, constraints)
+        return [solver.envelope(scenario, steps=steps) for scenario in scenarios]
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(model, growth, constraints, steps)) as executor:
+        return list(executor.map(_envelope, scenarios))
+
+
+def plot_flux_envelopes(envelopes, ax, color=None, **plot_kwargs):
+    """Plot computed envelopes on ax (the line style of reframed.plot_flux_envelope)."""
+    for envelope in envelopes:
+        ax.plot(envelope.x, envelope.ymin, color=color, **plot_kwargs)
+        ax.plot(envelope.x, envelope.ymax, color=color, **plot_kwargs)
+        if len(envelope.x):
+            ax.plot([envelope.x[-1], envelope.x[-1]], [envelope.ymin[-1], envelope.ymax[-1]],
+                    color=color, **plot_kwargs)
+    return ax
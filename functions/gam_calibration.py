@@ -0,0 +1,194 @@
+"""
+GAM/NGAM calibration of the Step 4 notebook against the Guedon1999 chemostats.
+
+The ATP hydrolysis of GAM includes water (GAM_COEFFICIENTS). This differs from
+the Step 4 grid search, which only changed atp_c, adp_c, h_c and pi_c and added
+M_h2o_c = -GAM to the final model after GAM was chosen. Calibrating with water
+therefore solves slightly different LPs than the notebook did. notebook_check
+repeats the calibration with both stoichiometries and compares them with the
+notebook value NOTEBOOK_GAM.
+"""
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize_scalar
+
+from observation_store import load_observations
+
+
+# Coefficients of the growth-associated ATP hydrolysis in the biomass reaction, per unit of GAM
+GAM_COEFFICIENTS = {"atp_c": -1, "h2o_c": -1, "adp_c": 1, "h_c": 1, "pi_c": 1}
+
+# Stoichiometry of the Step 4 grid search (without water)
+NOTEBOOK_GAM_COEFFICIENTS = {"atp_c": -1, "adp_c": 1, "h_c": 1, "pi_c": 1}
+
+# Result of the Step 4 grid search (np.linspace(10, 50, 1000), rounded to 2 decimals) at NGAM = 2.2
+NOTEBOOK_GAM = 30.22
+NOTEBOOK_NGAM = 2.2
+NOTEBOOK_GAM_STEP = 40/999
+
+# Observation store species of the chemostat rates
+GUEDON1999_SPECIES = {"q_cellb": "EX_cellb_e", "q_ac": "EX_ac_e", "q_lac": "EX_lac__L_e", "q_etoh": "EX_etoh_e"}
+
+
+def load_Guedon1999(input_dir="../input"):
+    """Guedon1999 chemostat points from the observation store: growth rate, cellobiose uptake and secretion rates."""
+    observations = load_observations(input_dir)
+    mu, _ = observations.series("Guedon1999", "Growth", "chemostat")
+    data = {"mu": mu}
+    for column, species in GUEDON1999_SPECIES.items():
+        x, value = observations.series("Guedon1999", species, "chemostat")
+        if not np.array_equal(x, mu):
+            raise ValueError(f"Guedon1999 {species} is not given at the growth rates of the chemostats")
+        data[column] = value
+    return pd.DataFrame(data)
+
+
+def chemostat_constraints(point):
+    """Exchange bounds of one chemostat point (uptake and secretion fixed to the measured rates)."""
+    return {"EX_cellb_e": (-point.q_cellb, -point.q_cellb),
+            "EX_ac_e": (point.q_ac, point.q_ac),
+            "EX_lac__L_e": (point.q_lac, point.q_lac),
+            "EX_etoh_e": (point.q_etoh, point.q_etoh)}
+
+
+def apply_gam(model, GAM, NGAM=None, growth="Growth", atpm="ATPM", coefficients=GAM_COEFFICIENTS):
+    """Set GAM in the biomass reaction (and NGAM as lower bound of ATPM) of a cobra model."""
+    rxn = model.reactions.get_by_id(growth)
+    rxn.add_metabolites({model.metabolites.get_by_id(met_id): coefficient*GAM
+                         for met_id, coefficient in coefficients.items()}, combine=False)
+    if NGAM is not None:
+        model.reactions.get_by_id(atpm).lower_bound = NGAM
+
+
+def r2_score(y_true, y_pred):
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    return 1 - np.sum(np.square(y_true - y_pred))/np.sum(np.square(y_true - y_true.mean()))
+
+
+class GAMCalibration:
+    """
+    GAM/NGAM calibration against chemostat growth rates.
+
+    One copy of the model is kept per chemostat point, with the exchange bounds
+    of that point applied once. Changing GAM only rewrites the coefficients of
+    the growth reaction in the ATP, H2O, ADP, H and Pi mass balances of the solver
+    problem, and NGAM only the bounds of ATPM, so every evaluation re-optimizes
+    the existing LPs from their previous basis instead of building new ones.
+
+    The simulated growth rate of a point is 0 when its LP is infeasible, as in
+    the Step 4 grid search. The medium must be applied to the model before
+    calibrating; only the chemostat exchange bounds are set here.
+    """
+
+    def __init__(self, model, data=None, growth="Growth", atpm="ATPM", coefficients=GAM_COEFFICIENTS):
+        self.data = data if data is not None else load_Guedon1999()
+        self.mu = self.data["mu"].values
+        self.growth = growth
+        self.atpm = atpm
+        self.coefficients = dict(coefficients)
+        self.n_evaluations = 0
+
+        self.problems = []
+        for point in self.data.itertuples():
+            problem = model.copy()
+            for rxn_id, bounds in chemostat_constraints(point).items():
+                problem.reactions.get_by_id(rxn_id).bounds = bounds
+            self.problems.append(problem)
+
+        # Mass-balance constraints and growth variables touched by a GAM update
+        self._updates = []
+        for problem in self.problems:
+            rxn = problem.reactions.get_by_id(growth)
+            self._updates.append([(problem.constraints[met_id], rxn.forward_variable, rxn.reverse_variable, coefficient)
+                                  for met_id, coefficient in self.coefficients.items()])
+
+    def set_parameters(self, GAM, NGAM=None):
+        for problem, updates in zip(self.problems, self._updates):
+            for constraint, forward, reverse, coefficient in updates:
+                constraint.set_linear_coefficients({forward: coefficient*GAM, reverse: -coefficient*GAM})
+            if NGAM is not None:
+                problem.reactions.get_by_id(self.atpm).lower_bound = NGAM
+
+    def predict(self, GAM, NGAM=None):
+        """Maximal growth rate at every chemostat point."""
+        self.set_parameters(GAM, NGAM)
+        self.n_evaluations += 1
+        return np.array([problem.slim_optimize(error_value=0) for problem in self.problems])
+
+    def sse(self, GAM, NGAM=None):
+        return np.sum(np.square(self.mu - self.predict(GAM, NGAM)))
+
+    def sweep(self, GAMs, NGAM=None):
+        """Sum of squared errors over a grid of GAM values."""
+        return pd.Series({GAM: self.sse(GAM, NGAM) for GAM in GAMs})
+
+    def _minimize_gam(self, NGAM, bounds, n_bracket, xtol):
+        # The error is piecewise smooth (points turn infeasible), so the minimum is
+        # bracketed on a coarse grid before the bounded golden-section refinement
+        grid = np.linspace(*bounds, n_bracket)
+        errors = self.sweep(grid, NGAM).values
+        k = int(np.argmin(errors))
+        bracket = (grid[max(k-1, 0)], grid[min(k+1, n_bracket-1)])
+
+        result = minimize_scalar(lambda GAM: self.sse(GAM, NGAM), bounds=bracket,
+                                 method="bounded", options={"xatol": xtol})
+        if result.fun <= errors[k]:
+            return result.x, result.fun
+        return grid[k], errors[k]
+
+    def calibrate(self, GAM_bounds=(10, 50), NGAM=2.2, NGAM_bounds=None, n_bracket=41, xtol=1e-3):
+        """
+        GAM minimizing the squared error of the growth rates, at fixed NGAM.
+
+        With NGAM_bounds, NGAM is calibrated as well: the same bracketing and
+        bounded search runs over NGAM, with GAM re-calibrated for every NGAM.
+        """
+        self.n_evaluations = 0
+
+        if NGAM_bounds is None:
+            GAM, error = self._minimize_gam(NGAM, GAM_bounds, n_bracket, xtol)
+        else:
+            calibrated = {}
+
+            def error_ngam(NGAM):
+                calibrated[NGAM] = self._minimize_gam(NGAM, GAM_bounds, n_bracket, xtol)
+                return calibrated[NGAM][1]
+
+            grid = np.linspace(*NGAM_bounds, max(n_bracket//4, 3))
+            k = int(np.argmin([error_ngam(NGAM) for NGAM in grid]))
+            minimize_scalar(error_ngam, bounds=(grid[max(k-1, 0)], grid[min(k+1, len(grid)-1)]),
+                            method="bounded", options={"xatol": xtol})
+            NGAM = min(calibrated, key=lambda NGAM: calibrated[NGAM][1])
+            GAM, error = calibrated[NGAM]
+
+        mu_sim = self.predict(GAM, NGAM)
+        return {"GAM": float(GAM),
+                "NGAM": NGAM,
+                "sse": float(error),
+                "r2": float(r2_score(self.mu, mu_sim)),
+                "mu_sim": mu_sim,
+                "n_evaluations": self.n_evaluations}
+
+
+def calibrate_gam(model, data=None, **kwargs):
+    """Calibrate GAM (and optionally NGAM) of a cobra model, with its medium applied, on the Guedon1999 chemostat data."""
+    return GAMCalibration(model, data=data).calibrate(**kwargs)
+
+
+def notebook_check(model, data=None, tol=NOTEBOOK_GAM_STEP):
+    """
+    Compare the calibrated GAM with the Step 4 notebook value.
+
+    model is the model before calibration (RcH10_v2 with the DM_cellobiose
+    medium, as in the notebook). GAM is calibrated at NGAM = 2.2 with the
+    notebook stoichiometry and with GAM_COEFFICIENTS. Both results should be
+    within tol of NOTEBOOK_GAM (one step of the notebook grid). Returns the
+    calibrated values, their deviations from NOTEBOOK_GAM and whether they match.
+    """
+    check = {"notebook": NOTEBOOK_GAM}
+    for name, coefficients in (("without_h2o", NOTEBOOK_GAM_COEFFICIENTS), ("with_h2o", GAM_COEFFICIENTS)):
+        GAM = GAMCalibration(model, data=data, coefficients=coefficients).calibrate(NGAM=NOTEBOOK_NGAM)["GAM"]
+        check[name] = GAM
+        check[f"{name}_deviation"] = GAM - NOTEBOOK_GAM
+        check[f"{name}_matches"] = abs(GAM - NOTEBOOK_GAM) <= tol
+    return check
@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import pandas as pd
+import reframed
+
+
+class CompiledGPRs:
+    """
+    GPR associations of a reframed model as sets of gene sets.
+
+    Every reaction with a GPR is stored as a list of complexes (the genes of a
+    complex are AND-ed, complexes are OR-ed); a set of deleted genes blocks a
+    reaction when it hits every complex. Reactions without a GPR are never
+    blocked. ``gene_rxns`` indexes the reactions a gene takes part in, so only
+    those reactions are evaluated for a deletion.
+    """
+
+    def __init__(self, model):
+        self.complexes = {}
+        self.gene_rxns = {}
+        for r_id, rxn in model.reactions.items():
+            if rxn.gpr is None or len(rxn.gpr.proteins) == 0:
+                continue
+            self.complexes[r_id] = [frozenset(protein.genes) for protein in rxn.gpr.proteins]
+            for complex_ in self.complexes[r_id]:
+                for gene in complex_:
+                    self.gene_rxns.setdefault(gene, set()).add(r_id)
+        self.genes = sorted(self.gene_rxns)
+
+    def blocked(self, genes):
+        """Reactions blocked by deleting genes."""
+        genes = frozenset(genes)
+        candidates = set().union(*(self.gene_rxns.get(gene, ()) for gene in genes))
+        return sorted(r_id for r_id in candidates
+                      if all(complex_ & genes for complex_ in self.complexes[r_id]))
+
+
+class KnockoutEngine:
+    """
+    Growth of gene-deletion mutants under several conditions.
+
+    For every condition (a dict of flux constraints) one reframed solver and the
+    wild-type solution are kept. A deletion that only blocks reactions without
+    flux in the wild-type solution leaves the optimum unchanged and is answered
+    without solving; otherwise the blocked reactions are closed and the LP is
+    re-solved on the condition's solver, starting from its previous basis.
+    """
+
+    def __init__(self, model, conditions, objective=None, tol=1e-9):
+        self.model = model
+        self.conditions = dict(conditions)
+        self.objective = objective if objective is not None else model.get_objective()
+        self.tol = tol
+        self.gprs = CompiledGPRs(model)
+        self.solved = 0
+        self.skipped = 0
+        self._solvers = {}
+        self._wild_type = {}
+
+    def __getstate__(self):
+        # Solvers are rebuilt in every worker process
+        state = self.__dict__.copy()
+        state["_solvers"] = {}
+        return state
+
+    def _solver(self, condition):
+        if condition not in self._solvers:
+            self._solvers[condition] = reframed.solver_instance(self.model)
+        return self._solvers[condition]
+
+    def wild_type(self, condition):
+        if condition not in self._wild_type:
+            self._wild_type[condition] = reframed.FBA(self.model, objective=self.objective,
+                                                      constraints=self.conditions[condition],
+                                                      solver=self._solver(condition))
+        return self._wild_type[condition]
+
+    def growth(self, genes, condition):
+        """Maximal growth with genes deleted (0 if infeasible)."""
+        wild_type = self.wild_type(condition)
+        if wild_type.fobj is None:
+            return 0.0
+
+        blocked = self.gprs.blocked(genes)
+        if all(abs(wild_type.values[r_id]) <= self.tol for r_id in blocked):
+            self.skipped += 1
+            return wild_type.fobj
+
+        constraints = dict(self.conditions[condition])
+        constraints.update({r_id: (0, 0) for r_id in blocked})
+        self.solved += 1
+        sol = reframed.FBA(self.model, objective=self.objective, constraints=constraints,
+                           solver=self._solver(condition), get_values=False)
+        return sol.fobj if sol.fobj is not None else 0.0
+
+    def _batch(self, task):
+        gene_sets, condition = task
+        return [self.growth(genes, condition) for genes in gene_sets]
+
+    def matrix(self, gene_sets, conditions=None, processes=None, batch_size=50):
+        """
+        Growth matrix with one row per gene set and one column per condition.
+
+        gene_sets is a list of gene ids or tuples of gene ids (row labels are
+        joined with "+"). With processes, batches of batch_size gene sets are
+        distributed over worker processes.
+        """
+        conditions = list(conditions or self.conditions)
+        gene_sets = [(genes,) if isinstance(genes, str) else tuple(genes) for genes in gene_sets]
+        tasks = [(gene_sets[i:i+batch_size], condition)
+                 for condition in conditions
+                 for i in range(0, len(gene_sets), batch_size)]
+
+        if not processes:
+            results = [self._batch(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(self,)) as executor:
+                results = list(executor.map(_batch, tasks))
+
+        values = {condition: [] for condition in conditions}
+        for (batch, condition), result in zip(tasks, results):
+            values[condition].extend(result)
+        index = pd.Index(["+".join(genes) for genes in gene_sets], name="genes")
+        return pd.DataFrame(values, index=index)
+
+    def single_deletions(self, genes=None, **kwargs):
+        return self.matrix(genes or self.gprs.genes, **kwargs)
+
+    def double_deletions(self, genes=None, lethal_threshold=1e-3, **kwargs):
+        """
+        Growth of all double deletions.
+
+        Deleting more genes never increases growth, so pairs with a lethal single
+        deletion (in every requested condition) are set to 0 without solving.
+        """
+        genes = genes or self.gprs.genes
+        single = self.single_deletions(genes, **kwargs)
+        viable = [gene for gene in genes if (single.loc[gene] >= lethal_threshold).any()]
+
+        pairs = list(combinations(viable, 2))
+        double = self.matrix(pairs, **kwargs)
+        lethal = [pair for pair in combinations(genes, 2) if "+".join(pair) not in double.index]
+        if lethal:
+            index = pd.Index(["+".join(pair) for pair in lethal], name="genes")
+            double = pd.concat([double, pd.DataFrame(0.0, index=index, columns=double.columns)])
+        return double
+
+
+# Engine of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(engine):
+    _worker["engine"] = engine
+
+
+def _batch(task):
+    return _worker["engine"]._batch(task)
+
+
+def mutant_phenotypes(model, mutants, genes, sugars, threshold=0.001, processes=None):
+    """
+    Growth predictions for the Kampik2021 mutants (Step 6).
+
+    mutants has the columns Mutant and Sugar (the melted gene_deletion_boolean
+    sheet), genes maps mutant names to model genes and sugars maps sugar names
+    to BiGG ids; the model environment is expected to be set without carbon
+    source. Returns mutants with a "Predicted growth" column ("Yes"/"No").
+    """
+    conditions = {sugar: {f'R_EX_{sugars[sugar]}_e': (-10, 0)} for sugar in mutants["Sugar"].unique()}
+    engine = KnockoutEngine(model, conditions)
+    growth = engine.matrix([genes[mutant] for mutant in mutants["Mutant"].unique()], processes=processes)
+
+    mutants = mutants.copy()
+    mutants["Predicted growth"] = ["Yes" if growth.loc[genes[row.Mutant], row.Sugar] > threshold else "No"
+                                   for row in mutants.itertuples()]
+    return mutants
@@ -0,0 +1,191 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+import dfba_cobra_cellulose
+import dfba_cobra_multiple_polysaccharides
+from observation_store import load_observations
+
+
+# One observed species of an experiment. With fit_scale, the simulation is scaled
+# by the least-squares factor before scoring (for OD or genome counts against biomass).
+Observable = namedtuple("Observable", ["species", "dataset", "experiment", "weight", "fit_scale", "x_max"],
+                        defaults=[1.0, False, None])
+
+
+class Experiment:
+    """
+    One batch experiment to fit: model, initial conditions, medium and observables.
+
+    load_model is a (function, *args) tuple building the model, so it can be
+    rebuilt in worker processes. Without glc_eq_poly_dict the batch is
+    simulated with dfba_cobra_cellulose on a compiled problem (y0 in the order
+    of rxns followed by cellulose); with it, with
+    dfba_cobra_multiple_polysaccharides in media. parameters are the indices of
+    the experiment's combination in the joint parameter vector.
+
+    The penalty of an observable is weight times the mean squared residual
+    over the mean observation (the scoring of optimize_parameters); the penalty
+    of the experiment is weight times their sum.
+    """
+
+    def __init__(self, name, load_model, rxns, y0, objective_dir, observables, parameters=(0, 1, 2, 3, 4),
+                 weight=1.0, glc_eq_poly_dict=None, media=None, t_end=None, n_eval=1000, rtol=1e-3, atol=1e-6):
+        self.name = name
+        self.load_model = load_model
+        self.rxns = list(rxns)
+        self.y0 = np.asarray(y0, dtype=float)
+        self.objective_dir = list(objective_dir)
+        self.observables = list(observables)
+        self.parameters = list(parameters)
+        self.weight = weight
+        self.glc_eq_poly_dict = glc_eq_poly_dict
+        self.media = media
+        self.n_eval = n_eval
+        self.rtol = rtol
+        self.atol = atol
+        self.observations = None
+        self.t_end = t_end
+
+    def attach(self, observations):
+        """Read the observations of every observable from an ObservationStore."""
+        self.observations = [observations.series(obs.dataset, obs.species, obs.experiment, x_max=obs.x_max)
+                             for obs in self.observables]
+        if self.t_end is None:
+            self.t_end = max(x.max() for x, _ in self.observations)
+
+    def build(self):
+        function, *args = self.load_model
+        model = function(*args)
+        if self.glc_eq_poly_dict is None:
+            model = dfba_cobra_cellulose.DynamicFBAProblem(model, self.rxns, self.objective_dir)
+        return model
+
+    def simulate(self, model, combination):
+        """Time points and {species: trajectory} of the experiment for the joint parameter vector."""
+        combination = np.asarray(combination)[self.parameters]
+        if self.glc_eq_poly_dict is None:
+            if dfba_cobra_cellulose.dynamic_system.cache is not None:
+                dfba_cobra_cellulose.dynamic_system.cache.clear()
+            # Start at the first observation, like optimize_parameters (-0.196 h for Desvaux2001)
+            t_start = min(x.min() for x, _ in self.observations)
+            ts = np.linspace(t_start, self.t_end, self.n_eval)
+            sol = dfba_cobra_cellulose.simulate_batch(model, self.rxns, self.y0, self.objective_dir, combination,
+                                                      ts, rtol=self.rtol, atol=self.atol)
+            return sol.t, dict(zip(self.rxns + ["EX_cellulose_e"], sol.y))
+
+        trajectories = dfba_cobra_multiple_polysaccharides.multiple_polysaccharide_simulation(
+            combination, model, self.media, self.rxns, self.y0, self.objective_dir,
+            dict(self.glc_eq_poly_dict), t_end=self.t_end, analytic_jacobian=False)
+        return trajectories.t, {rxn: trajectories[rxn]["C"] for rxn in self.rxns}
+
+    def penalties(self, t, trajectories):
+        """Penalty of every observable (1e6 each if the simulation stopped at its first point)."""
+        if len(t) < 2:
+            return [1e6]*len(self.observables)
+        penalties = []
+        for obs, (x, y) in zip(self.observables, self.observations):
+            interp_func = interp1d(t, trajectories[obs.species], kind='linear', fill_value="extrapolate")
+            simulated = interp_func(x)
+            if obs.fit_scale:
+                simulated = simulated*np.dot(simulated, y)/max(np.dot(simulated, simulated), 1e-12)
+            penalties.append(obs.weight*np.mean(np.square(y - simulated))/np.mean(y))
+        return penalties
+
+    def penalty(self, model, combination):
+        try:
+            t, trajectories = self.simulate(model, combination)
+            return self.weight*sum(self.penalties(t, trajectories))
+        except Exception as e:
+            print(f"\t {self.name} had issues with this combination: {combination}\nException: {e}")
+            return 1e6
+
+
+def desvaux2001_experiment(load_model, rxns, y0, objective_dir, **kwargs):
+    """Desvaux2001 batch scored like optimize_parameters (biomass weight 1000, cellulose weight 10, before 70 h)."""
+    observables = [Observable("Growth", "Desvaux2001", "batch", weight=1000, x_max=70),
+                   Observable("EX_cellulose_e", "Desvaux2001", "batch", weight=10, x_max=70)]
+    return Experiment("Desvaux2001", load_model, rxns, y0, objective_dir, observables, **kwargs)
+
+
+def growth_curve_experiment(dataset, experiment, load_model, rxns, y0, objective_dir, weight=1000, **kwargs):
+    """Experiment scored on a growth curve in other units than g (OD, genome counts), with a fitted scale."""
+    observables = [Observable("Growth", dataset, experiment, weight=weight, fit_scale=True)]
+    return Experiment(f"{dataset} {experiment}", load_model, rxns, y0, objective_dir, observables, **kwargs)
+
+
+# Experiments and their models in a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(experiments):
+    _worker["experiments"] = experiments
+    _worker["models"] = {}
+
+
+def _penalty(i, combination):
+    models = _worker["models"]
+    if i not in models:
+        models[i] = _worker["experiments"][i].build()
+    return _worker["experiments"][i].penalty(models[i], combination)
+
+
+class JointFit:
+    """
+    Weighted penalty of a parameter vector over several experiments.
+
+    With processes, every experiment of a candidate is simulated in its own
+    task of a process pool whose workers build each model once, so the wall
+    time of a candidate is close to that of its slowest experiment. The
+    instance is the objective:
+
+        with JointFit([desvaux2001, cotton, tissue], processes=3) as objective:
+            result = differential_evolution(objective, bounds, polish=False)
+    """
+
+    def __init__(self, experiments, processes=None, observations=None):
+        self.experiments = list(experiments)
+        observations = observations if observations is not None else load_observations()
+        for experiment in self.experiments:
+            experiment.attach(observations)
+        self.executor = None
+        self._models = {}
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                                initargs=(self.experiments,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for model in self._models.values():
+            if isinstance(model, dfba_cobra_cellulose.DynamicFBAProblem):
+                model.close()
+        self._models = {}
+
+    def penalties(self, combination):
+        """{experiment name: weighted penalty} of combination."""
+        if self.executor is not None:
+            futures = [self.executor.submit(_penalty, i, combination) for i in range(len(self.experiments))]
+            values = [future.result() for future in futures]
+        else:
+            values = []
+            for i, experiment in enumerate(self.experiments):
+                if i not in self._models:
+                    self._models[i] = experiment.build()
+                values.append(experiment.penalty(self._models[i], combination))
+        return dict(zip([experiment.name for experiment in self.experiments], values))
+
+    def __call__(self, combination):
+        penalties = self.penalties(combination)
+        penalty = sum(penalties.values())
+        print(f"\t penalty: {penalty} for combination: {combination}")
+        return penalty
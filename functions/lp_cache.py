@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _freeze(value):
+    """Turn lists, arrays and dicts into hashable tuples for use in a cache key."""
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class LPSolutionCache:
+    """
+    Small bounded cache of dFBA LP solutions.
+
+    solve_ivp evaluates the event functions at the same (t, y) as the right-hand
+    side, so the RHS and the events share this cache and every distinct state is
+    optimized once. Entries are keyed on the state vector and the parameter
+    combination and hold named fields (e.g. "feasibility", "fluxes"), since an
+    event only needs the feasibility while the RHS needs the full lexicographic
+    solution.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        stats = self.stats()
+        return (f"LPSolutionCache(size={stats['size']}, hits={stats['hits']}, "
+                f"misses={stats['misses']}, hit_rate={stats['hit_rate']:.2f})")
+
+    @staticmethod
+    def key(y, *params):
+        """Build a key from the state vector and any number of parameters."""
+        return (np.asarray(y, dtype=float).tobytes(),) + _freeze(params)
+
+    def lookup(self, key, field):
+        """Return the entry for key if it holds field, counting a hit or a miss."""
+        entry = self._entries.get(key)
+        if entry is None or field not in entry:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, key, **fields):
+        """Add fields to the entry for key, evicting the oldest entries if full."""
+        entry = self._entries.setdefault(key, {})
+        entry.update(fields)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop the cached solutions but keep the counters."""
+        self._entries.clear()
+
+    def reset(self):
+        """Drop the cached solutions and zero the counters."""
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits/total if total else 0.0}
@@ -1,11 +1,31 @@
 import reframed
 import copy
+from functools import lru_cache
 
 
-model_uni = reframed.load_cbmodel("../models/universe_grampos.xml")
-model = reframed.load_cbmodel("../models/RcH10_v2.xml")
+@lru_cache(maxsize=None)
+def load_model(path):
+    """Parse an SBML model once per process; callers copy what they take from it."""
+    return reframed.load_cbmodel(path)
 
-def build_mini_model(unique_cofactors=True,model_id="mini_model"):
+
+def __getattr__(name):
+    # model and model_uni used to be parsed at import; they are now loaded on first access
+    if name == "model":
+        return load_model("../models/RcH10_v2.xml")
+    if name == "model_uni":
+        return load_model("../models/universe_grampos.xml")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def build_mini_model(unique_cofactors=True,model_id="mini_model",model=None,model_uni=None):
+    
+    # Preloaded models can be passed in; otherwise they are read on first use.
+    # The universe model is only needed without unique cofactors.
+    if model is None:
+        model = load_model("../models/RcH10_v2.xml")
+    if model_uni is None and not unique_cofactors:
+        model_uni = load_model("../models/universe_grampos.xml")
     
     mini_model = reframed.CBModel(model_id)
     
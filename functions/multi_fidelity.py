@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr
+
+import dfba_cobra_cellulose
+
+
+def fidelity_agreement(low, high):
+    """
+    Agreement of low- and full-fidelity penalties of the same candidates.
+
+    Returns the Spearman rank correlation, the median relative difference of
+    the penalties and the number of pairs compared.
+    """
+    low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+    mask = np.isfinite(low) & np.isfinite(high)
+    low, high = low[mask], high[mask]
+    if len(low) < 2:
+        return {"spearman": np.nan, "median_relative_difference": np.nan, "n": len(low)}
+    return {"spearman": spearmanr(low, high).correlation,
+            "median_relative_difference": float(np.median(np.abs(low - high)/np.abs(high))),
+            "n": len(low)}
+
+
+def screen_candidates(candidates, model, rxns, y0, objective_dir, low="low", high="full",
+                      promote=0.2, threshold=None, audit=0.1, seed=0, **kwargs):
+    """
+    Evaluate candidates at low fidelity and promote the promising ones to full fidelity.
+
+    The fraction promote of the candidates with the lowest low-fidelity
+    penalties (or, with threshold, those below it) is re-evaluated at high
+    fidelity. To measure how well the levels agree, a random fraction audit of
+    the remaining candidates is evaluated at high fidelity as well; "missed"
+    counts audited candidates whose full penalty beats the worst promoted one.
+
+    Returns a table with one row per candidate (low and high penalties,
+    promoted and audited flags) and the agreement report. kwargs are passed to
+    optimize_parameters.
+    """
+    candidates = np.atleast_2d(np.asarray(candidates, dtype=float))
+    n = len(candidates)
+
+    penalty_low = np.array([dfba_cobra_cellulose.optimize_parameters(combination, model, rxns, y0, objective_dir,
+                                                                     fidelity=low, **kwargs)
+                            for combination in candidates])
+
+    if threshold is not None:
+        promoted = penalty_low < threshold
+    else:
+        promoted = np.zeros(n, dtype=bool)
+        promoted[np.argsort(penalty_low)[:max(int(np.ceil(promote*n)), 1)]] = True
+
+    rng = np.random.default_rng(seed)
+    rest = np.flatnonzero(~promoted)
+    audited = np.zeros(n, dtype=bool)
+    audited[rng.choice(rest, size=int(round(audit*len(rest))), replace=False)] = True
+
+    penalty_high = np.full(n, np.nan)
+    for i in np.flatnonzero(promoted | audited):
+        penalty_high[i] = dfba_cobra_cellulose.optimize_parameters(candidates[i], model, rxns, y0, objective_dir,
+                                                                   fidelity=high, **kwargs)
+
+    results = pd.DataFrame(candidates, columns=[f"x{k}" for k in range(candidates.shape[1])])
+    results["penalty_low"] = penalty_low
+    results["penalty_high"] = penalty_high
+    results["promoted"] = promoted
+    results["audited"] = audited
+
+    report = fidelity_agreement(penalty_low, penalty_high)
+    report["n_candidates"] = n
+    report["n_promoted"] = int(promoted.sum())
+    report["n_audited"] = int(audited.sum())
+    worst_promoted = np.nanmax(penalty_high[promoted]) if promoted.any() else np.inf
+    report["missed"] = int((penalty_high[audited] < worst_promoted).sum())
+    return results, report
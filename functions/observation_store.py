@@ -0,0 +1,218 @@
+import glob
+import hashlib
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+molar_mass = 173.85  # Based on glucose equivalent (based on 0.35 cellobiose and 0.3 glucose)
+
+# Digitized time series (x in h, column " y"): dataset, experiment, file, species, unit and the
+# factor converting the published unit to the canonical one
+TIME_SERIES = [
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/biomass_mg.csv", "Growth", "g", 1/1000),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/cellulose_g.csv", "EX_cellulose_e", "mmol", 1000/molar_mass),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/glucose_mmol.csv", "EX_glc__D_e", "mmol", 1),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/cellobiose_mmol.csv", "EX_cellb_e", "mmol", 1),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/acetate_mmol.csv", "EX_ac_e", "mmol", 1),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/ethanol_mmol.csv", "EX_etoh_e", "mmol", 1),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/lactate_mmol.csv", "EX_lac__L_e", "mmol", 1),
+    ("Desvaux2001", "batch", "Desvaux2001_batch_data/pyruvate_umol.csv", "EX_pyr_e", "mmol", 1/1000),
+    ("Badalato2017", "cotton", "Badalato2017_batch_data/cotton_genome_count_ml.csv", "Growth", "genome count/ml", 1),
+    ("Badalato2017", "cotton_2", "Badalato2017_batch_data/cotton_genome_count_ml_2.csv", "Growth", "genome count/ml", 1),
+    ("Badalato2017", "tissue", "Badalato2017_batch_data/tissue_genome_count_ml.csv", "Growth", "genome count/ml", 1),
+    ("Badalato2017", "whatman_paper", "Badalato2017_batch_data/whatman_paper_genome_count_ml.csv", "Growth",
+     "genome count/ml", 1),
+    ("Ravachol2016", "xyloglucan", "Ravachol2016_batch_data/OD_xyloglucan.csv", "Growth", "OD", 1),
+    ("Ravachol2016", "oligosaccharide", "Ravachol2016_batch_data/OD_oligosaccharide.csv", "Growth", "OD", 1),
+]
+
+# Rates of the Desvaux2004 carbon flow table with an exchange reaction in the models
+DESVAUX2004_SPECIES = {"q_cellobiose": "EX_cellb_e",
+                       "q_acetate": "EX_ac_e",
+                       "q_ethanol": "EX_etoh_e",
+                       "q_lactate": "EX_lac__L_e",
+                       "q_extracellular pyruvate": "EX_pyr_e",
+                       "q_carbon dioxide": "EX_co2_e"}
+
+COLUMNS = ["dataset", "experiment", "species", "axis", "x", "value", "unit"]
+
+
+def _time_series(input_dir):
+    frames = []
+    for dataset, experiment, path, species, unit, factor in TIME_SERIES:
+        data = pd.read_csv(os.path.join(input_dir, path), skipinitialspace=True)
+        frames.append(pd.DataFrame({"dataset": dataset, "experiment": experiment, "species": species,
+                                    "axis": "time", "x": data["x"].values, "value": data["y"].values*factor,
+                                    "unit": unit}))
+    return frames
+
+
+def _desvaux2004(input_dir):
+    """Carbon flows of the ammonia-limited chemostats against the dilution rate (the % columns are left out)."""
+    table = pd.read_csv(os.path.join(input_dir, "Desvaux2004_chemostat_data/ammonia_limited.csv"),
+                        header=None, index_col=0)
+    dilution = table.iloc[0, ::2].astype(float).values
+    rows = []
+    for name, values in table.iloc[1:, ::2].iterrows():
+        if not isinstance(name, str):
+            continue
+        species = DESVAUX2004_SPECIES.get(name, name[2:] if name.startswith("q_") else name)
+        for D, value in zip(dilution, values.astype(float).values):
+            if not np.isnan(value):
+                rows.append(("Desvaux2004", "ammonia_limited", species, "dilution_rate", D, value, "carbon flow"))
+    return [pd.DataFrame(rows, columns=COLUMNS)]
+
+
+def _guedon1999(input_dir):
+    """Growth rate and exchange rates (mmol/(g h)) of the Guedon1999 chemostats against the growth rate."""
+    chemostat = pd.read_excel(os.path.join(input_dir, "Guedon1999_chemostat_data.xlsx"), sheet_name='Sheet1',
+                              header=None, index_col=0, usecols="A:H")
+    mu = chemostat.iloc[0,:].values.astype(float)
+    rates = {"Growth": mu,
+             "EX_cellb_e": chemostat.iloc[1,:].values,
+             "EX_ac_e": chemostat.iloc[2,:].values * chemostat.iloc[3,:].values / 100,
+             "EX_lac__L_e": chemostat.iloc[2,:].values * chemostat.iloc[4,:].values / 100,
+             "EX_etoh_e": chemostat.iloc[2,:].values * chemostat.iloc[5,:].values / 100}
+    return [pd.DataFrame({"dataset": "Guedon1999", "experiment": "chemostat", "species": species,
+                          "axis": "dilution_rate", "x": mu, "value": values.astype(float),
+                          "unit": "1/h" if species == "Growth" else "mmol/(g h)"})
+            for species, values in rates.items()]
+
+
+def _kampik2021(input_dir):
+    """Growth (1) or no growth (0) of the Kampik2021 mutants; the mutant is the experiment, the sugar the species."""
+    mutants = pd.read_excel(os.path.join(input_dir, "Kampik_2021_mutants.xlsx"), sheet_name="gene_deletion_boolean",
+                            usecols="A:H")
+    sugars = [column for column in mutants.columns if column not in ("Mutant", "Gene inactivation")]
+    mutants = mutants.melt(id_vars=["Mutant"], value_vars=sugars, var_name="Sugar", value_name="Growth").dropna()
+    return [pd.DataFrame({"dataset": "Kampik2021", "experiment": mutants["Mutant"].values,
+                          "species": mutants["Sugar"].values, "axis": "none", "x": np.nan,
+                          "value": (mutants["Growth"] == "Yes").astype(float).values, "unit": "growth"})]
+
+
+READERS = [_time_series, _desvaux2004, _guedon1999, _kampik2021]
+
+
+def input_signature(input_dir="../input"):
+    """Hash of the names, sizes and modification times of the input files."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(input_dir, "**", "*"), recursive=True)):
+        if os.path.isfile(path) and ".ipynb_checkpoints" not in path:
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, input_dir)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+class ObservationStore:
+    """
+    Experimental observations of all input datasets in one long table.
+
+    Every row is one observation: dataset, experiment, canonical species id
+    (the exchange reaction of the models, "Growth" for biomass), axis ("time"
+    in h, "dilution_rate" in 1/h or "none"), x, value and canonical unit. The
+    table is sorted by (dataset, experiment, species, x) and indexed by the row
+    range of every (dataset, experiment, species), so a lookup is a dictionary
+    access plus a binary search on x.
+    """
+
+    def __init__(self, table):
+        self.table = table[COLUMNS].sort_values(["dataset", "experiment", "species", "x"]).reset_index(drop=True)
+        self._x = self.table["x"].values
+        self._value = self.table["value"].values
+        self._index = {}
+        keys = list(zip(self.table["dataset"], self.table["experiment"], self.table["species"]))
+        start = 0
+        for i in range(1, len(keys) + 1):
+            if i == len(keys) or keys[i] != keys[start]:
+                self._index[keys[start]] = (start, i)
+                start = i
+
+    @classmethod
+    def from_input(cls, input_dir="../input"):
+        """Read every dataset of input_dir."""
+        frames = [frame for reader in READERS for frame in reader(input_dir)]
+        return cls(pd.concat(frames, ignore_index=True))
+
+    def datasets(self):
+        return sorted({key[0] for key in self._index})
+
+    def experiments(self, dataset):
+        return sorted({key[1] for key in self._index if key[0] == dataset})
+
+    def species(self, dataset, experiment=None):
+        return sorted({key[2] for key in self._index
+                       if key[0] == dataset and (experiment is None or key[1] == experiment)})
+
+    def _rows(self, dataset, experiment, species, x_min, x_max):
+        start, stop = self._index.get((dataset, experiment, species), (0, 0))
+        x = self._x[start:stop]
+        if x_min is not None:
+            start += np.searchsorted(x, x_min, side="left")
+        if x_max is not None:
+            stop = self._index[(dataset, experiment, species)][0] + np.searchsorted(x, x_max, side="right")
+        return start, max(start, stop)
+
+    def series(self, dataset, species, experiment=None, x_min=None, x_max=None):
+        """x and value arrays of one species (of the only experiment if experiment is None), between x_min and x_max."""
+        if experiment is None:
+            experiments = [e for e in self.experiments(dataset) if (dataset, e, species) in self._index]
+            if len(experiments) != 1:
+                raise KeyError(f"{dataset} has {len(experiments)} experiments with {species}; pass experiment")
+            experiment = experiments[0]
+        if (dataset, experiment, species) not in self._index:
+            raise KeyError((dataset, experiment, species))
+        start, stop = self._rows(dataset, experiment, species, x_min, x_max)
+        return self._x[start:stop], self._value[start:stop]
+
+    def lookup(self, dataset=None, experiment=None, species=None, x_min=None, x_max=None):
+        """Rows of the table matching the given dataset, experiment and species (None matches all) and x range."""
+        if isinstance(species, str):
+            species = [species]
+        ranges = [self._rows(*key, x_min, x_max) for key in self._index
+                  if (dataset is None or key[0] == dataset) and
+                     (experiment is None or key[1] == experiment) and
+                     (species is None or key[2] in species)]
+        rows = np.concatenate([np.arange(start, stop) for start, stop in ranges]) if ranges else []
+        return self.table.iloc[rows]
+
+    def save(self, path, signature=None):
+        with open(path, "wb") as f:
+            pickle.dump({"signature": signature, "table": self.table}, f)
+
+    @classmethod
+    def load(cls, path, signature=None):
+        """Store saved at path, or None if it is missing or was built from other input files."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+        if signature is not None and cached["signature"] != signature:
+            return None
+        return cls(cached["table"])
+
+
+@lru_cache(maxsize=None)
+def load_observations(input_dir="../input", cache_path="../results/observations.pkl"):
+    """
+    Observation store of input_dir, read once per process.
+
+    The parsed table is cached at cache_path and rebuilt when any input file
+    changes (see input_signature); pass cache_path=None to always parse.
+    """
+    signature = input_signature(input_dir)
+    if cache_path is not None:
+        store = ObservationStore.load(cache_path, signature)
+        if store is not None:
+            return store
+
+    store = ObservationStore.from_input(input_dir)
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        store.save(tmp_path, signature)
+        os.replace(tmp_path, cache_path)
+    return store
@@ -0,0 +1,168 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cobra
+import numpy as np
+
+import dfba_cobra_cellulose
+from evaluation_store import EvaluationStore
+
+
+# State of a worker process, filled once by _init_worker
+_worker = {}
+
+
+def load_flux_ratio_model(path="../models/RcH10_final_flux_ratio.xml", glucose=10.0):
+    """Load the Step 7 model: flux-ratio constrained SBML, glucose in the medium and LP feasibility slacks."""
+    model = cobra.io.read_sbml_model(path)
+
+    medium = model.medium
+    medium["EX_glc__D_e"] = glucose
+    model.medium = medium
+
+    cobra.util.add_lp_feasibility(model)
+    return model
+
+
+def _init_worker(model_path, rxns, y0, objective_dir, compiled, store_path, kwargs):
+    model = load_flux_ratio_model(model_path)
+    if compiled:
+        model = dfba_cobra_cellulose.DynamicFBAProblem(model, rxns, objective_dir)
+    if store_path is not None:
+        kwargs = dict(kwargs, store=EvaluationStore(store_path))
+
+    _worker.update(model=model, rxns=rxns, y0=y0, objective_dir=objective_dir, kwargs=kwargs)
+
+
+def _evaluate(combination, penalty_bound=None):
+    return dfba_cobra_cellulose.optimize_parameters(combination,
+                                                    _worker["model"],
+                                                    _worker["rxns"],
+                                                    _worker["y0"],
+                                                    _worker["objective_dir"],
+                                                    penalty_bound=penalty_bound,
+                                                    **_worker["kwargs"])
+
+
+def _evaluate_components(combination):
+    result = dfba_cobra_cellulose.optimize_parameters(combination,
+                                                      _worker["model"],
+                                                      _worker["rxns"],
+                                                      _worker["y0"],
+                                                      _worker["objective_dir"],
+                                                      alternative_solution=True,
+                                                      **_worker["kwargs"])
+    if not isinstance(result, tuple):
+        # Failed simulation: no components
+        return result, np.nan, np.nan
+    _, penalty, components = result
+    return penalty, components["penalty_growth"], components["penalty_cellulose"]
+
+
+class EvaluationPool:
+    """
+    Reusable process pool for evaluating optimize_parameters.
+
+    Every worker loads the model once through the pool initializer, so only the
+    parameter vectors (and the penalties) travel between processes. The pool is
+    map-like and can be passed as ``workers`` to scipy's differential_evolution:
+
+        with EvaluationPool(rxns, y0, objective_dir) as pool:
+            result = differential_evolution(pool.objective, bounds, workers=pool,
+                                            updating="deferred", polish=False)
+
+    The ``func`` that differential_evolution hands to the pool is ignored; the
+    workers always evaluate optimize_parameters. Populations and penalties of
+    every generation are kept in ``populations`` and ``energies``; ``members``
+    and ``targets`` hold the population and penalties after selection.
+
+    With store_path, the workers serve repeated combinations from an
+    EvaluationStore and append new ones to it, and the population after
+    selection of every generation is recorded in the store. ``init_population`` returns the last stored population, to be
+    passed as ``init`` to differential_evolution when resuming a run.
+
+    With early_abort, every trial vector after the first generation is
+    simulated with its target's penalty as penalty_bound: a trial that is
+    already worse than the member it would replace is stopped early. This
+    relies on updating="deferred", where trial i competes with member i.
+    """
+
+    def __init__(self, rxns, y0, objective_dir, model_path="../models/RcH10_final_flux_ratio.xml",
+                 max_workers=4, chunksize=1, compiled=True, store_path=None, early_abort=False, **kwargs):
+        self.chunksize = chunksize
+        self.early_abort = early_abort
+        self.members = None
+        self.targets = None
+        self.store = EvaluationStore(store_path) if store_path is not None else None
+        self.executor = ProcessPoolExecutor(max_workers=max_workers,
+                                            initializer=_init_worker,
+                                            initargs=(model_path, list(rxns), y0, list(objective_dir),
+                                                      compiled, store_path, kwargs))
+        self.generation = 0
+        self.populations = []
+        self.energies = []
+        self.n_evaluations = 0
+        self.wall_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, func, iterable):
+        population = np.array(list(iterable))
+        self.generation += 1
+
+        bounds = [None]*len(population)
+        if self.early_abort and self.targets is not None and len(self.targets) == len(population):
+            bounds = list(self.targets)
+
+        start = time.perf_counter()
+        energies = list(self.executor.map(_evaluate, population, bounds, chunksize=self.chunksize))
+        elapsed = time.perf_counter() - start
+
+        # Population and penalties after selection (trial i competes with member i)
+        if self.targets is None or len(self.targets) != len(population):
+            self.members = population.copy()
+            self.targets = np.array(energies, dtype=float)
+        else:
+            better = np.asarray(energies, dtype=float) < self.targets
+            self.members[better] = population[better]
+            self.targets[better] = np.asarray(energies, dtype=float)[better]
+
+        self.n_evaluations += len(population)
+        self.wall_time += elapsed
+        self.populations.append(population)
+        self.energies.append(energies)
+        if self.store is not None:
+            self.store.record_generation(self.members, self.targets)
+
+        print(f"Generation {self.generation}: {len(population)} evaluations in {elapsed:.1f} s "
+              f"({len(population)/elapsed:.2f} evaluations/s)")
+        return energies
+
+    def components(self, population):
+        """(penalty, penalty_growth, penalty_cellulose) of every combination, evaluated in the pool."""
+        population = np.array(list(population))
+        start = time.perf_counter()
+        results = list(self.executor.map(_evaluate_components, population, chunksize=self.chunksize))
+        self.n_evaluations += len(population)
+        self.wall_time += time.perf_counter() - start
+        return results
+
+    def objective(self, combination):
+        """Evaluate a single combination in the pool."""
+        return self.executor.submit(_evaluate, combination).result()
+
+    def init_population(self):
+        """Last population recorded in the store, or "latinhypercube" if there is none."""
+        last = self.store.last_generation() if self.store is not None else None
+        return last[0] if last is not None else "latinhypercube"
+
+    def throughput(self):
+        """Evaluations per second over all generations so far."""
+        return self.n_evaluations/self.wall_time if self.wall_time else 0.0
+
+    def close(self):
+        self.executor.shutdown()
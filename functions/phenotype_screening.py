@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import reframed
+from molmass import Formula
+
+from flux_envelopes import MODEL_IDS, exchange_id
+
+
+def load_media(path="../input/media_db.tsv"):
+    """Media of media_db.tsv as {medium: set of BiGG metabolite ids}."""
+    media = pd.read_csv(path, sep='\t')
+    return media.groupby('medium').agg({'compound': set})['compound'].to_dict()
+
+
+def adjust_media(media, add=None, remove=None):
+    """Copy of media with compounds removed from and added to some of them (as in Step 6)."""
+    add, remove = add or {}, remove or {}
+    media_new = {}
+    for name, media_set in media.items():
+        media_new[name] = (set(media_set) - remove.get(name, set())) | add.get(name, set())
+    return media_new
+
+
+def metabolite_properties(model, mets):
+    """
+    Molar mass and carbon flag of the extracellular metabolites of a reframed model.
+
+    Computed once from the formulas of the reference model; metabolites that are
+    not in the model are left out.
+    """
+    properties = {}
+    for met in mets:
+        met_id = f"M_{met}_e"
+        if met_id not in model.metabolites:
+            continue
+        formula = Formula(model.metabolites[met_id].metadata["FORMULA"])
+        properties[met] = {"molmass": formula.mass,
+                           "carbon": "C" in formula.composition().keys()}
+    return pd.DataFrame.from_dict(properties, orient="index", columns=["molmass", "carbon"])
+
+
+class ExchangeLayout:
+    """
+    Exchange reactions and objective of one model, compiled once.
+
+    ``constraints(medium)`` opens the uptake of the medium compounds to
+    -uptake and allows secretion of everything up to 100, as in Step 6.
+    """
+
+    def __init__(self, model, model_id, uptake=10, secretion=100):
+        self.model_id = model_id
+        self.growth = MODEL_IDS[model_id]["growth"]
+        self.uptake = uptake
+        self.secretion = secretion
+        if model_id == "iFS431":
+            self.exchanges = [rxn for rxn in model.reactions if rxn.startswith("EX_")]
+        else:
+            self.exchanges = list(model.get_exchange_reactions())
+        self._exchanges = set(self.exchanges)
+        self._closed = {rxn: (0, secretion) for rxn in self.exchanges}
+
+    def exchange(self, met):
+        rxn = exchange_id(self.model_id, met)
+        return rxn if rxn in self._exchanges else None
+
+    def constraints(self, medium, limiting=()):
+        constraints = dict(self._closed)
+        for met in medium:
+            rxn = self.exchange(met)
+            if rxn is not None:
+                constraints[rxn] = (-self.uptake, self.secretion)
+        # Ensure that carbon is limiting the system
+        for met in limiting:
+            rxn = self.exchange(met)
+            if rxn is not None:
+                constraints[rxn] = (-1, 0)
+        return constraints
+
+
+class PhenotypeScreen:
+    """
+    Growth and biomass yield of several models on many media.
+
+    Molar masses and carbon flags come from a reference model and are computed
+    once for all compounds of all media; exchange layouts and solvers are built
+    once per model. The yield is the growth rate per g of carbon sources taken up.
+    """
+
+    def __init__(self, models, reference, media, limiting=None):
+        self.models = dict(models)
+        self.media = dict(media)
+        self.limiting = dict(limiting or {})
+        self.layouts = {model_id: ExchangeLayout(model, model_id) for model_id, model in self.models.items()}
+        self.properties = metabolite_properties(reference, sorted(set().union(*self.media.values())))
+        self._carbon_mass = (self.properties.molmass*self.properties.carbon).to_dict()
+        self._solvers = {}
+
+    def __getstate__(self):
+        # Solvers are rebuilt in every worker process
+        state = self.__dict__.copy()
+        state["_solvers"] = {}
+        return state
+
+    def _solver(self, model_id):
+        if model_id not in self._solvers:
+            self._solvers[model_id] = reframed.solver_instance(self.models[model_id])
+        return self._solvers[model_id]
+
+    def evaluate(self, model_id, medium_name):
+        layout = self.layouts[model_id]
+        medium = self.media[medium_name]
+        constraints = layout.constraints(medium, self.limiting.get(medium_name, ()))
+
+        sol = reframed.FBA(self.models[model_id], objective={layout.growth: 1}, constraints=constraints,
+                           solver=self._solver(model_id))
+        growth = sol.fobj if sol.fobj is not None else 0
+
+        # Total uptake of carbon sources [g/(gDW h)]
+        uptake = 0
+        if sol.values is not None:
+            for met in medium:
+                rxn = layout.exchange(met)
+                if rxn is not None and met in self._carbon_mass:
+                    uptake -= self._carbon_mass[met]*sol.values[rxn]/1000
+
+        return {"medium": medium_name,
+                "model": model_id,
+                "growth": growth,
+                "carbon_uptake": uptake,
+                "yield": growth/uptake if (growth > 1e-6 and uptake > 1e-6) else 0}
+
+    def run(self, processes=None, models=None, media=None):
+        """Tidy table with one row per (medium, model)."""
+        tasks = [(model_id, medium_name)
+                 for medium_name in (media or self.media)
+                 for model_id in (models or self.models)]
+
+        if not processes:
+            rows = [self.evaluate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(self,)) as executor:
+                rows = list(executor.map(_evaluate, tasks, chunksize=max(len(tasks)//(4*processes), 1)))
+        return pd.DataFrame(rows)
+
+
+# Screen of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(screen):
+    _worker["screen"] = screen
+
+
+def _evaluate(task):
+    return _worker["screen"].evaluate(*task)
+
+
+def screen_phenotypes(models, reference, media, limiting=None, processes=None):
+    """Biomass yields of models ({model id: reframed model}, ids of MODEL_IDS) on media."""
+    return PhenotypeScreen(models, reference, media, limiting=limiting).run(processes=processes)
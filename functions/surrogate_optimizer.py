@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+
+import dfba_cobra_cellulose
+
+
+# Bounds of combination = (vmax_inner_glc, Km_inner_glc, vmax_inner_cellb, Km_inner_cellb, vmax_outer)
+# used for differential evolution in Step 7
+BOUNDS = [(0.1, 10), (0.1, 2), (0.1, 10), (0.1, 2), (2.9, 5)]
+
+
+def model_evaluator(model, rxns, y0, objective_dir, **kwargs):
+    """
+    Sequential evaluator for SurrogateOptimizer.run.
+
+    Returns a function mapping a batch of combinations to (penalty,
+    penalty_growth, penalty_cellulose) tuples; parameter_pool.EvaluationPool.components
+    is the parallel equivalent.
+    """
+    def evaluate(population):
+        results = []
+        for combination in population:
+            result = dfba_cobra_cellulose.optimize_parameters(combination, model, rxns, y0, objective_dir,
+                                                              alternative_solution=True, **kwargs)
+            if not isinstance(result, tuple):
+                results.append((result, np.nan, np.nan))
+                continue
+            _, penalty, components = result
+            results.append((penalty, components["penalty_growth"], components["penalty_cellulose"]))
+        return results
+    return evaluate
+
+
+class SurrogateOptimizer:
+    """
+    Batch Bayesian optimization of the kinetic parameters.
+
+    penalty_growth and penalty_cellulose are modelled by two Gaussian processes
+    on the logarithm of the penalties, in parameters scaled to the unit cube.
+    A batch is proposed by maximizing the expected improvement of their sum
+    (Monte Carlo over the two predictive distributions) over random candidates;
+    after each pick the GPs are refitted with the predicted value of the
+    picked point ("kriging believer"), so the batch spreads out and can be
+    evaluated in parallel. Failed simulations are kept at the worst observed
+    penalties.
+
+        optimizer = SurrogateOptimizer(BOUNDS)
+        with EvaluationPool(rxns, y0, objective_dir) as pool:
+            optimizer.run(pool.components, n_init=20, n_batches=15, batch_size=8)
+        optimizer.best
+    """
+
+    def __init__(self, bounds=BOUNDS, n_candidates=2000, n_samples=64, seed=0):
+        self.bounds = np.array(bounds, dtype=float)
+        self.n_candidates = n_candidates
+        self.n_samples = n_samples
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.X = np.empty((0, len(bounds)))
+        self.penalties = np.empty((0, 3))
+
+    def _scale(self, X):
+        return (X - self.bounds[:, 0])/(self.bounds[:, 1] - self.bounds[:, 0])
+
+    def _unscale(self, U):
+        return self.bounds[:, 0] + U*(self.bounds[:, 1] - self.bounds[:, 0])
+
+    def initial_design(self, n):
+        """Latin hypercube sample of n combinations."""
+        return self._unscale(qmc.LatinHypercube(d=len(self.bounds), seed=self.seed).random(n))
+
+    def tell(self, X, results):
+        """Add evaluated combinations and their (penalty, penalty_growth, penalty_cellulose)."""
+        self.X = np.vstack([self.X, np.atleast_2d(X)])
+        self.penalties = np.vstack([self.penalties, np.array(results, dtype=float).reshape(-1, 3)])
+
+    def _targets(self):
+        """Log penalty components; failed simulations get the worst observed values."""
+        components = self.penalties[:, 1:].copy()
+        for k in range(components.shape[1]):
+            ok = np.isfinite(components[:, k])
+            worst = components[ok, k].max() if ok.any() else 1.0
+            components[~ok, k] = worst
+        return np.log(np.maximum(components, 1e-12))
+
+    def _fit(self, U, targets):
+        kernel = (ConstantKernel(1.0)*Matern(length_scale=np.full(U.shape[1], 0.3), nu=2.5) +
+                  WhiteKernel(1e-3, noise_level_bounds=(1e-8, 1)))
+        return [GaussianProcessRegressor(kernel, normalize_y=True, n_restarts_optimizer=2,
+                                         random_state=self.seed).fit(U, targets[:, k])
+                for k in range(targets.shape[1])]
+
+    def _expected_improvement(self, gps, U, best):
+        draws = 0
+        for gp in gps:
+            mean, std = gp.predict(U, return_std=True)
+            draws = draws + np.exp(mean[:, None] + std[:, None]*self.rng.standard_normal((len(U), self.n_samples)))
+        return np.maximum(best - draws, 0).mean(axis=1)
+
+    def ask(self, n):
+        """Propose a batch of n combinations."""
+        U = self._scale(self.X)
+        targets = self._targets()
+        best = np.exp(targets).sum(axis=1).min()
+        gps = self._fit(U, targets)
+
+        batch = []
+        for _ in range(n):
+            candidates = self.rng.random((self.n_candidates, len(self.bounds)))
+            pick = candidates[np.argmax(self._expected_improvement(gps, candidates, best))]
+            batch.append(pick)
+            # Kriging believer: pretend the prediction was observed
+            believed = np.array([gp.predict(pick[None, :])[0] for gp in gps])
+            U = np.vstack([U, pick])
+            targets = np.vstack([targets, believed])
+            # Keep the fitted hyperparameters, only condition on the new point
+            gps = [GaussianProcessRegressor(gp.kernel_, normalize_y=True, optimizer=None).fit(U, targets[:, k])
+                   for k, gp in enumerate(gps)]
+        return self._unscale(np.array(batch))
+
+    def run(self, evaluate, n_init=20, n_batches=15, batch_size=8, verbose=True):
+        """
+        Optimize with evaluate, a function of a batch of combinations returning
+        (penalty, penalty_growth, penalty_cellulose) per combination.
+        """
+        if len(self.X) == 0:
+            X = self.initial_design(n_init)
+            self.tell(X, evaluate(X))
+        for k in range(n_batches):
+            X = self.ask(batch_size)
+            self.tell(X, evaluate(X))
+            if verbose:
+                print(f"Batch {k+1}: best penalty {self.best[1]:.4g} after {len(self.X)} simulations")
+        return self.best
+
+    @property
+    def best(self):
+        """Best evaluated combination and its penalty."""
+        i = np.nanargmin(self.penalties[:, 0])
+        return self.X[i], self.penalties[i, 0]
+
+    def history(self):
+        """All evaluations as a table."""
+        history = pd.DataFrame(self.X, columns=["vmax_inner_glc", "Km_inner_glc", "vmax_inner_cellb",
+                                                "Km_inner_cellb", "vmax_outer"])
+        history[["penalty", "penalty_growth", "penalty_cellulose"]] = self.penalties
+        return history
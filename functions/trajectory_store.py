@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+
+class TrajectoryStore:
+    """
+    Preallocated, growable store of concentration trajectories.
+
+    All species share one time axis; concentrations are kept in a single
+    (time x species) array that doubles its capacity when full, so appending a
+    simulation phase copies only the new rows. Species that are dropped from a
+    later phase keep their trajectory up to the point where they were removed.
+
+    ``store[species]`` returns ``{"t": ..., "C": ...}`` as zero-copy views, which
+    is the layout multiple_polysaccharide_simulation used to return.
+    """
+
+    def __init__(self, species, capacity=1024):
+        self.species = list(species)
+        self.index = {species_id: i for i, species_id in enumerate(self.species)}
+        self.n = 0
+        self._t = np.empty(capacity)
+        # Fortran order keeps every species column contiguous
+        self._C = np.full((capacity, len(self.species)), np.nan, order="F")
+        self._end = np.zeros(len(self.species), dtype=int)
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, species_id):
+        return species_id in self.index
+
+    def __iter__(self):
+        return iter(self.species)
+
+    def __getitem__(self, species_id):
+        j = self.index[species_id]
+        end = self._end[j]
+        return {"t": self._t[:end], "C": self._C[:end, j]}
+
+    def keys(self):
+        return list(self.species)
+
+    def items(self):
+        return [(species_id, self[species_id]) for species_id in self.species]
+
+    @property
+    def t(self):
+        return self._t[:self.n]
+
+    @property
+    def C(self):
+        return self._C[:self.n]
+
+    def _reserve(self, n_rows):
+        capacity = len(self._t)
+        if n_rows <= capacity:
+            return
+        while capacity < n_rows:
+            capacity *= 2
+
+        t = np.empty(capacity)
+        t[:self.n] = self._t[:self.n]
+        C = np.full((capacity, len(self.species)), np.nan, order="F")
+        C[:self.n] = self._C[:self.n]
+        self._t, self._C = t, C
+
+    def append(self, t, C, species=None, overlap=False):
+        """
+        Append a trajectory.
+
+        t has shape (k,) and C has shape (len(species), k), the layout of sol.y.
+        species defaults to all species of the store. With overlap, the first new
+        row replaces the last stored row (the end point of the previous phase is
+        the initial point of the next one).
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        C = np.asarray(C, dtype=float).reshape(-1, len(t))
+        columns = (np.arange(len(self.species)) if species is None
+                   else np.array([self.index[species_id] for species_id in species], dtype=int))
+
+        start = self.n - 1 if (overlap and self.n) else self.n
+        stop = start + len(t)
+        self._reserve(stop)
+
+        self._t[start:stop] = t
+        self._C[start:stop, columns] = C.T
+        self._end[columns] = stop
+        self.n = max(self.n, stop)
+
+    def to_dataframe(self):
+        """Concentrations as a DataFrame indexed by time, one column per species."""
+        return pd.DataFrame(self.C, index=pd.Index(self.t, name="t"), columns=self.species)
+
+    def to_parquet(self, path):
+        self.to_dataframe().reset_index().to_parquet(path)
@@ -0,0 +1,249 @@
+import re
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlsplit
+
+
+URI_RE = re.compile(r'rdf:resource="([^"]+)"')
+PUBCHEM_RE = re.compile(r'(.*?pubchem\.compound:)([\d\s]+)"')
+EC_CODE_RE = re.compile(r'ec-code/(.+?)"/>')
+EC_NUMBER_RE = re.compile(r'[\d.]+')
+
+
+# Namespace prefixes used in the annotations and their identifiers.org replacements
+map_mets = {"seedm/":"seed.compound:",
+        "seed.compound/":"seed.compound:",
+       "biggm/":"bigg.metabolite:",
+        "bigg.metabolite/":"bigg.metabolite:",
+       "metacycm/":"metacyc.compound:",
+       "keggc/":"kegg.compound:",
+       "kegg.compound/":"kegg.compound:",
+       "keggd/":"kegg.drug:",
+       "kegg.drug/":"kegg.drug:",
+       "chebi/CHEBI:":"CHEBI:",
+       "sabiorkm/":"sabiork.compound:",
+       "sabiork.compound/":"sabiork.compound:",
+       "metacyc.compound/":"metacyc.compound:",
+       "lipidmapsm/":"lipidmaps:",
+       "lipidmaps/":"lipidmaps:",
+       "slm/":"SLM:",
+       "reactome/":"reactome:",
+       "reactomem/":"reactome:",
+       "metanetx.chemical/":"metanetx.chemical:",
+       "pubchem.compound/":"pubchem.compound:",
+       "hmdb/":"hmdb:",
+       "inchikey/":"inchikey:",
+       "inchi/":"inchi:"}
+
+map_rxns = {"seedr/":"seed.reaction:",
+        "seed.reaction/":"seed.reaction:",
+        "biggr/":"bigg.reaction:",
+        "bigg.reaction/":"bigg.reaction:",
+        "metacycr/":"metacyc.reaction:",
+        "keggr/":"kegg.reaction:",
+        "kegg.reaction/":"kegg.reaction:",
+        "sabiorkr/":"sabiork.reaction:",
+        "sabiork.reaction/":"sabiork.reaction:",
+        "metacyc.reaction/":"metacyc.reaction:",      
+        "reactome/":"reactome:",
+        "reactomer/":"reactome:",
+        "metanetx.reaction/":"metanetx.reaction:",
+       "rhear/":"rhea:",
+       "rhea/":"rhea:",
+       "brenda/":"brenda:",
+       "ec-code/":"ec-code:",
+       "biocyc/":"biocyc:"}
+
+M_prefix = ["seed","bigg","kegg"]
+
+
+# One line of an XMLAnnotation; namespace and identifier are None for lines without a URI
+Annotation = namedtuple("Annotation", ["line", "uri", "namespace", "identifier"])
+
+
+def parse_uri(uri):
+    """(namespace, identifier) of an identifiers.org-style URI: .../namespace:id or .../namespace/id."""
+    path = urlsplit(uri).path.lstrip("/")
+    colon, slash = path.find(":"), path.find("/")
+    if colon < 0 and slash < 0:
+        return None, path
+    if slash < 0 or 0 <= colon < slash:
+        return path[:colon], path[colon+1:]
+    return path[:slash], path[slash+1:]
+
+
+def parse_line(line):
+    match = URI_RE.search(line)
+    if match is None:
+        return Annotation(line, None, None, None)
+    uri = match.group(1)
+    return Annotation(line, uri, *parse_uri(uri))
+
+
+class AnnotationStore:
+    """
+    Annotations of the metabolites or reactions of a reframed model, parsed once.
+
+    ``records[element_id]`` is the list of Annotation records of one element's
+    XMLAnnotation, in line order; elements without an XMLAnnotation are not
+    included. ``apply`` writes (rewritten) lines back into the model metadata.
+    """
+
+    def __init__(self, records, ismet=True):
+        self.records = records
+        self.ismet = ismet
+
+    @classmethod
+    def from_model(cls, model, ismet=True):
+        elements = model.metabolites if ismet else model.reactions
+        records = OrderedDict()
+        for element_id in elements:
+            metadata = elements[element_id].metadata
+            if "XMLAnnotation" not in metadata:
+                continue
+            records[element_id] = [parse_line(line) for line in metadata["XMLAnnotation"].split("\n")]
+        return cls(records, ismet=ismet)
+
+    def __len__(self):
+        return len(self.records)
+
+    def items(self):
+        return self.records.items()
+
+    def uris(self):
+        """Distinct URIs in the store."""
+        return list(OrderedDict.fromkeys(record.uri for records in self.records.values()
+                                         for record in records if record.uri is not None))
+
+    def namespaces(self):
+        """Number of annotations per namespace."""
+        counts = {}
+        for records in self.records.values():
+            for record in records:
+                if record.namespace is not None:
+                    counts[record.namespace] = counts.get(record.namespace, 0) + 1
+        return counts
+
+    def apply(self, model, lines):
+        """Write {element_id: lines} into the XMLAnnotation of the model elements."""
+        elements = model.metabolites if self.ismet else model.reactions
+        for element_id, element_lines in lines.items():
+            elements[element_id].metadata["XMLAnnotation"] = "\n".join(element_lines)
+
+
+class RewriteEngine:
+    """
+    Annotation rewrite rules of the curation, compiled once.
+
+    * Namespace prefixes: of the keys of the prefix map (map_mets or map_rxns)
+      occurring in a line, the one that comes first in the map is chosen, and all
+      its occurrences are replaced by its identifiers.org prefix. Only one key
+      is replaced per line. A single lookahead alternation of all keys finds the
+      candidates in one pass over the line. If the rewritten line mentions one
+      of M_prefix (seed, bigg, kegg), the "M_" (or "R_") of the identifier is
+      dropped: ":M_" becomes ":", or else "/M_" becomes ":".
+    * Unresolvable URIs: a line is unresolvable if it contains one of the
+      BioModels URIs followed by '"/>' as a substring. All of them end in '"/>',
+      so only the substrings ending at each '"/>' of the line are looked up in a
+      hash set, once per distinct length.
+    """
+
+    def __init__(self, map_, unresolvable_re, M_prefix=M_prefix, ismet=True):
+        self.map_ = dict(map_)
+        self.keys = list(self.map_)
+        self.rank = {key: i for i, key in enumerate(self.keys)}
+        self.prefix = "M_" if ismet else "R_"
+        self.M_prefix = list(M_prefix)
+        self.ismet = ismet
+
+        self._prefix_re = re.compile("(?=(" + "|".join(re.escape(key) for key in self.keys) + "))")
+
+        self._unresolvable = set(unresolvable_re)
+        self._unresolvable_lengths = sorted({len(item) for item in self._unresolvable})
+        self._unresolvable_tail = '"/>'
+        if not all(item.endswith(self._unresolvable_tail) for item in self._unresolvable):
+            raise ValueError('unresolvable URIs must end with \'"/>\'')
+
+    def is_unresolvable(self, line):
+        start = line.find(self._unresolvable_tail)
+        while start >= 0:
+            end = start + len(self._unresolvable_tail)
+            for length in self._unresolvable_lengths:
+                if length > end:
+                    break
+                if line[end-length:end] in self._unresolvable:
+                    return True
+            start = line.find(self._unresolvable_tail, start + 1)
+        return False
+
+    def change_uri(self, element):
+        best = None
+        for match in self._prefix_re.finditer(element):
+            key = match.group(1)
+            if best is None or self.rank[key] < self.rank[best]:
+                best = key
+                if self.rank[best] == 0:
+                    break
+        element_new = element if best is None else element.replace(best, self.map_[best])
+
+        # Replace prefix of M_ where necessary for specified database cross-references
+        for value in self.M_prefix:
+            if value not in element_new:
+                continue
+            if f":{self.prefix}" in element_new:
+                element_new = element_new.replace(f":{self.prefix}",":")
+            elif f"/{self.prefix}" in element_new:
+                element_new = element_new.replace(f"/{self.prefix}",":")
+        return element_new
+
+    def _keep_metabolite_line(self, line):
+        # Envipath annotations seem to be incorrect
+        return not (("envipath" in line) or ("hmdb" in line) or ("biocyc" in line))
+
+    def _keep_reaction_line(self, line):
+        #Brenda references do not work
+        return not (("brenda" in line) or ("biocyc" in line))
+
+    def rewrite(self, element_id, records):
+        """Rewritten annotation lines of one element, without duplicates and in their original order."""
+        lines_new = []
+        for record in records:
+            element = record.line
+
+            if self.ismet:
+                if not self._keep_metabolite_line(element):
+                    continue
+            elif not self._keep_reaction_line(element):
+                continue
+
+            if self.is_unresolvable(element):
+                print(f"\t Removing unresolvable annotation (according to BioModels): {element}")
+                continue
+
+            if not self.ismet:
+                # exchange reactions should not have other associations with other bigg reactions
+                if ("bigg" in element) and (element_id[2:].startswith("EX_")) and (element_id[2:] not in element):
+                    continue
+
+                if 'ec-code' in element:
+                    extracted = EC_CODE_RE.search(element).group(1)
+                    if not bool(EC_NUMBER_RE.fullmatch(extracted)):
+                        continue
+
+            element_new = self.change_uri(element)
+
+            if self.ismet:
+                # split duplicated items in the database
+                match = PUBCHEM_RE.search(element_new)
+                if match:
+                    prefix = match.group(1)
+                    for number in match.group(2).strip().split():
+                        lines_new.append(prefix+number+'"/>')
+                    continue
+
+            lines_new.append(element_new)
+
+        return list(OrderedDict.fromkeys(lines_new))
+
+    def rewrite_store(self, store):
+        """{element_id: rewritten lines} for all elements of an AnnotationStore."""
+        return OrderedDict((element_id, self.rewrite(element_id, records)) for element_id, records in store.items())
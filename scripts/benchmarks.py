@@ -0,0 +1,249 @@
+"""
+Benchmarks of the dFBA, calibration and curation hot paths.
+
+Runs offline on the bundled models (run from scripts/):
+
+    python benchmarks.py                         # all benchmarks
+    python benchmarks.py --only rhs batch        # selected benchmarks
+    python benchmarks.py --compare ../results/benchmarks/<earlier>.json
+
+Results are written to ../results/benchmarks/<timestamp>.json. With --compare,
+every benchmark is listed with its ratio to the earlier run and those slower
+by more than --threshold are flagged.
+
+The dFBA benchmarks use e_coli_core with the biomass reaction renamed to
+"Growth" and an extracellular cellobiose hydrolysis added, so the cellulose and
+polysaccharide models can be integrated without the (unbundled) RcH10 models.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.append("../functions/")
+
+
+E_COLI_CORE = "../models/other_models/e_coli_core.xml"
+MINI_MODEL_ATP = "../models/other_models/mini_model_atp.xml"
+IFS431 = "../models/other_models/iFS431_genes.xml"
+
+# Parameters of the Step 7 cellulose model and the Step 8 polysaccharide model
+COMBINATION = [5.1, 20, 6.1, 20, 2.9]
+POLY_COMBINATION = [10, 1, 1, 5]
+
+RXNS = ["Growth", "EX_glc__D_e", "EX_cellb_e", "EX_ac_e", "EX_etoh_e"]
+OBJECTIVE_DIR = ["max", "max", "max", "min", "min"]
+Y0 = [0.02, 0, 0, 0, 0, 38.53897]
+
+
+def cellulose_fixture():
+    """e_coli_core prepared like the Step 7 model (Growth, cellobiose, LP feasibility)."""
+    import cobra
+
+    model = cobra.io.read_sbml_model(E_COLI_CORE)
+    biomass = model.reactions.get_by_id("BIOMASS_Ecoli_core_w_GAM")
+    biomass.id = "Growth"
+    model.repair()
+
+    cellb_e = cobra.Metabolite("cellb_e", formula="C12H22O11", name="Cellobiose", compartment="e")
+    exchange = cobra.Reaction("EX_cellb_e", lower_bound=0, upper_bound=1000)
+    exchange.add_metabolites({cellb_e: -1})
+    hydrolysis = cobra.Reaction("CELLBHe", lower_bound=0, upper_bound=1000)
+    hydrolysis.add_metabolites({cellb_e: -1,
+                                model.metabolites.get_by_id("h2o_e"): -1,
+                                model.metabolites.get_by_id("glc__D_e"): 2})
+    model.add_reactions([exchange, hydrolysis])
+    model.objective = "Growth"
+
+    cobra.util.add_lp_feasibility(model)
+    return model
+
+
+def time_call(func, repeat=5, number=1, setup=None):
+    """Wall time per call (min, median and all repeats) of func()."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start)/number)
+    return {"min": min(times), "median": statistics.median(times), "repeat": repeat, "number": number,
+            "times": times}
+
+
+def bench_rhs():
+    """One dynamic_system call (LP cache cleared) on the cobra model and on the compiled problem."""
+    import dfba_cobra_cellulose
+
+    y = np.array([0.05, 2.0, 1.0, 1.0, 1.0, 30.0])
+    cache = dfba_cobra_cellulose.dynamic_system.cache
+
+    def rhs(target):
+        return time_call(lambda: dfba_cobra_cellulose.dynamic_system(0, y.copy(), target, RXNS,
+                                                                     OBJECTIVE_DIR, COMBINATION),
+                         repeat=20, setup=cache.clear)
+
+    # Separate models: the cobra path's 'with model:' would replace the compiled problem's objective
+    results = {"cobra": rhs(cellulose_fixture())}
+    with dfba_cobra_cellulose.DynamicFBAProblem(cellulose_fixture(), RXNS, OBJECTIVE_DIR) as problem:
+        results["compiled"] = rhs(problem)
+    return results
+
+
+def bench_batch():
+    """Desvaux2001 cellulose batch integration with the compiled problem."""
+    from scipy.integrate import solve_ivp
+    import dfba_cobra_cellulose
+
+    model = cellulose_fixture()
+    _, biomass_exp = dfba_cobra_cellulose.load_desvaux2001()
+    t_span = (biomass_exp.x.iloc[0], biomass_exp.x.iloc[-1])
+
+    with dfba_cobra_cellulose.DynamicFBAProblem(model, RXNS, OBJECTIVE_DIR) as problem:
+        def run():
+            dfba_cobra_cellulose.dynamic_system.cache.clear()
+            sol = solve_ivp(fun=dfba_cobra_cellulose.dynamic_system, t_span=t_span, y0=Y0, method='LSODA',
+                            events=[dfba_cobra_cellulose.infeasible_event],
+                            args=(problem, RXNS, OBJECTIVE_DIR, COMBINATION), rtol=1e-3, atol=1e-6)
+            run.nfev = sol.nfev
+        result = time_call(run, repeat=3)
+    result["nfev"] = run.nfev
+    return result
+
+
+def bench_optimize_parameters():
+    """One optimize_parameters evaluation (integration and scoring)."""
+    import dfba_cobra_cellulose
+
+    model = cellulose_fixture()
+    with dfba_cobra_cellulose.DynamicFBAProblem(model, RXNS, OBJECTIVE_DIR) as problem:
+        return time_call(lambda: dfba_cobra_cellulose.optimize_parameters(COMBINATION, problem, RXNS, Y0,
+                                                                          OBJECTIVE_DIR),
+                         repeat=3)
+
+
+def bench_polysaccharides():
+    """multiple_polysaccharide_simulation with cellulose degraded to cellobiose."""
+    import dfba_cobra_multiple_polysaccharides
+
+    model = cellulose_fixture()
+    glc_eq_poly_dict = {"EX_cellulose_e": {"EX_cellb_e": 2}}
+    rxns = ["Growth", "EX_cellb_e", "EX_ac_e", "EX_cellulose_e"]
+    y0 = np.array([0.1, 0, 0, 10])
+
+    return time_call(lambda: dfba_cobra_multiple_polysaccharides.multiple_polysaccharide_simulation(
+        POLY_COMBINATION, model, None, rxns, y0, ["max", "max", "max"], glc_eq_poly_dict, t_end=50,
+        analytic_jacobian=False),
+        repeat=3)
+
+
+def bench_egc():
+    """EGC_identifier on the ATP mini model."""
+    import reframed
+    import EGC
+
+    model = reframed.load_cbmodel(MINI_MODEL_ATP)
+    EGC_data = EGC.load_EGC_reactions()
+    return time_call(lambda: EGC.EGC_identifier(model, EGC_data=EGC_data), repeat=3)
+
+
+def bench_annotation_rewrite():
+    """Annotation rewrite pass over the metabolites and reactions of iFS431."""
+    import reframed
+    from annotation_rewrite import AnnotationStore, RewriteEngine, map_mets, map_rxns
+
+    model = reframed.load_cbmodel(IFS431, flavor="cobra")
+    # The BioModels list of unresolvable URIs is not bundled
+    engines = {True: RewriteEngine(map_mets, [], ismet=True), False: RewriteEngine(map_rxns, [], ismet=False)}
+
+    def run():
+        for ismet, engine in engines.items():
+            engine.rewrite_store(AnnotationStore.from_model(model, ismet=ismet))
+
+    return time_call(run, repeat=5)
+
+
+BENCHMARKS = {"rhs": bench_rhs,
+              "batch": bench_batch,
+              "optimize_parameters": bench_optimize_parameters,
+              "polysaccharides": bench_polysaccharides,
+              "egc": bench_egc,
+              "annotation_rewrite": bench_annotation_rewrite}
+
+
+def flatten(results, prefix=""):
+    """{name: median seconds} of nested results."""
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and "median" in value:
+            flat[prefix + name] = value["median"]
+        elif isinstance(value, dict):
+            flat.update(flatten(value, prefix + name + "."))
+    return flat
+
+
+def compare(current, previous, threshold=0.2):
+    """Print the ratio of every benchmark to an earlier run; returns the names of regressions."""
+    current, previous = flatten(current), flatten(previous)
+    regressions = []
+    for name, seconds in current.items():
+        if name not in previous:
+            print(f"{name:40s} {seconds*1000:10.2f} ms   (new)")
+            continue
+        ratio = seconds/previous[name]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:40s} {seconds*1000:10.2f} ms   x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slow-down flagged as regression")
+    parser.add_argument("--output", default="../results/benchmarks", help="directory of the results file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...")
+        try:
+            results[name] = BENCHMARKS[name]()
+        except ImportError as e:
+            print(f"\t skipped: {e}")
+            results[name] = {"skipped": str(e)}
+
+    record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "results": results}
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"benchmarks_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(record, f, indent=2)
+    print(f"results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous["results"], args.threshold)
+        return 1 if regressions else 0
+
+    for name, seconds in flatten(results).items():
+        print(f"{name:40s} {seconds*1000:10.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,149 +2,58 @@ import reframed
 import re
 from collections import OrderedDict
 import copy
-import requests
-import time
 import json
+import sys
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from annotation_rewrite import AnnotationStore, RewriteEngine, map_mets, map_rxns, M_prefix
+from uri_resolver import URIResolver
 
 
 ## DATA FOR CURATION
 
-map_mets = {"seedm/":"seed.compound:",
-        "seed.compound/":"seed.compound:",
-       "biggm/":"bigg.metabolite:",
-        "bigg.metabolite/":"bigg.metabolite:",
-       "metacycm/":"metacyc.compound:",
-       "keggc/":"kegg.compound:",
-       "kegg.compound/":"kegg.compound:",
-       "keggd/":"kegg.drug:",
-       "kegg.drug/":"kegg.drug:",
-       "chebi/CHEBI:":"CHEBI:",
-       "sabiorkm/":"sabiork.compound:",
-       "sabiork.compound/":"sabiork.compound:",
-       "metacyc.compound/":"metacyc.compound:",
-       "lipidmapsm/":"lipidmaps:",
-       "lipidmaps/":"lipidmaps:",
-       "slm/":"SLM:",
-       "reactome/":"reactome:",
-       "reactomem/":"reactome:",
-       "metanetx.chemical/":"metanetx.chemical:",
-       "pubchem.compound/":"pubchem.compound:",
-       "hmdb/":"hmdb:",
-       "inchikey/":"inchikey:",
-       "inchi/":"inchi:"}
-
-map_rxns = {"seedr/":"seed.reaction:",
-        "seed.reaction/":"seed.reaction:",
-        "biggr/":"bigg.reaction:",
-        "bigg.reaction/":"bigg.reaction:",
-        "metacycr/":"metacyc.reaction:",
-        "keggr/":"kegg.reaction:",
-        "kegg.reaction/":"kegg.reaction:",
-        "sabiorkr/":"sabiork.reaction:",
-        "sabiork.reaction/":"sabiork.reaction:",
-        "metacyc.reaction/":"metacyc.reaction:",      
-        "reactome/":"reactome:",
-        "reactomer/":"reactome:",
-        "metanetx.reaction/":"metanetx.reaction:",
-       "rhear/":"rhea:",
-       "rhea/":"rhea:",
-       "brenda/":"brenda:",
-       "ec-code/":"ec-code:",
-       "biocyc/":"biocyc:"}
-
-
 # The unresolvable URIs according to the curators in BioModels
 with open('../input/biomodels_URIs_MODEL2503030001.json') as json_file:
     data = json.load(json_file)
 
 unresolvable = [d for d in data if d["status"]=="UNRESOLVABLE"]
 unresolvable_re = [d["originalURI"]+'"/>' for d in unresolvable]
-match_func = lambda s, lst: any(item in s for item in lst)
-M_prefix = ["seed","bigg","kegg"]
-
-
-def is_resolvable_http(uri, max_retries=5, base_delay=2):
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36"
-    }
-    
-    timeout = 3
-    
-    if "CHEBI" in uri: # The website needs more time to load...
-        timeout=10
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(uri, allow_redirects=True, timeout=timeout, headers=headers)
-            return uri, response.status_code < 400  # Return tuple (uri, result)
-        
-        except requests.Timeout:
-            if attempt==0:
-                print(f"\t Timeout for {uri}. Retrying...")
-        
-        except requests.ConnectionError:
-            if attempt==0:
-                print(f"\t Connection error {uri}. Retrying...")
-
-        except requests.RequestException as e:
-            print(f"\t Other request error for {uri}: {e}")
-            return uri, False  # Return (uri, False)
-
-        # Wait before retrying
-        wait_time = base_delay * (2 ** attempt)
-        time.sleep(wait_time)
-
-        # Increase timeout but limit it
-        timeout = min(timeout*2,10)
 
-    print(f"\t Failed to connect to {uri} after {max_retries} retries.")
-    return uri, False  # Return (uri, False)
 
+def extract_uri(element):
+    match = re.search(r'rdf:resource="([^"]+)"',element)
+    return match.group(1) if match else None
 
-# Function to run multiple URI checks in parallel
 
-def check_uris_parallel(uris, max_workers=5):
-    results = {}
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_uri = {executor.submit(is_resolvable_http, uri): uri for uri in uris}
-        
-        for future in as_completed(future_to_uri):
-            uri, result = future.result()
-            results[uri] = result
-
-    return results  # Dictionary {uri: True/False}
+def collect_uris(model, ismet=True):
+    """All distinct annotation URIs of the metabolites (or reactions) of a model."""
+    elements = model.metabolites if ismet else model.reactions
+    uris = []
+    for element_id in elements:
+        metadata = elements[element_id].metadata
+        if "XMLAnnotation" not in metadata:
+            continue
+        for element in metadata["XMLAnnotation"].split("\n"):
+            if "<rdf:li rdf:resource=" in element:
+                uri = extract_uri(element)
+                if uri is not None:
+                    uris.append(uri)
+    return list(dict.fromkeys(uris))
 
 
-def check_uri_validitiy(elements,ismet=True):
+def check_uri_validitiy(elements,results):
+    """Map annotation lines to the resolvability of their URI (results: {uri: True/False})."""
     if len(elements)==0:
         return {}
     
-    uris = []
-    kept_elements = []
-    
+    results_mapped = {}
     for element in elements:
-        match = re.search(r'rdf:resource="([^"]+)"',element)
-        if match:
-            uri = match.group(1)
-            uris.append(uri)
-            kept_elements.append(element)
-
-    map_uris = dict(zip(uris,kept_elements))
-    
-    max_workers = min(10,len(uris))
-    
-    results = check_uris_parallel(uris,max_workers=max_workers)
-    
-    results_mapped = {map_uris[key]:value for key, value in results.items()}
-
+        uri = extract_uri(element)
+        if uri is not None:
+            results_mapped[element] = results[uri]
     
     return results_mapped
 
-def process_metadata(model, met,ismet=True):
+def process_metadata(model, met,results,ismet=True):
     if ismet:
         metadata = model.metabolites[met].metadata
     else:
@@ -162,8 +71,8 @@ def process_metadata(model, met,ismet=True):
     # Automatically set elements to True
     is_included = OrderedDict((element, True) for element in metadata_list)
     
-    # Check all URIs in parallel
-    results_mapped = check_uri_validitiy(elements,ismet=ismet)
+    # Look up the URIs resolved for the whole model
+    results_mapped = check_uri_validitiy(elements,results)
     
     # Update to new results
     is_included.update(results_mapped)
@@ -177,94 +86,27 @@ def process_metadata(model, met,ismet=True):
     return metadata_new
 
 
-def change_uri(element,ismet=True):
-    if ismet:
-        map_=map_mets
-        prefix = "M_"
-    else:
-        map_=map_rxns
-        prefix = "R_"
-    changed = 0
-
-    # Check for and replace elements with the wrong namespace prefix
-    for key, value in map_.items():
-        if key in element:
-            element_new = element.replace(key,value)
-            changed+=1
-            break
-
-    if changed==0:
-        element_new = element        
-
-    # Replace prefix of M_ where necessary for specified database cross-references
-    for value in M_prefix:
-        if value not in element_new:
-            continue
-        if f":{prefix}" in element_new:
-            element_new = element_new.replace(f":{prefix}",":")
-        elif f"/{prefix}" in element_new:
-            element_new = element_new.replace(f"/{prefix}",":")
-    return element_new
-
-
-
 ### Fix metabolites
 
+# --offline checks the URIs against a local stub server instead of the internet
+resolver = URIResolver(offline="--offline" in sys.argv)
+
 print("loading models...")
 model = reframed.load_cbmodel("../models/RcH10_v5.xml")
 
 model_draft = reframed.load_cbmodel("../models/RcH10_draft.xml")
 
 print("fixing metabolites...")
-for met in model.metabolites:
-    
-    metadata = model.metabolites[met].metadata
-    if "XMLAnnotation" not in metadata.keys():
-        continue
-        
-    metadata_hasxml = metadata["XMLAnnotation"]
-    metadata_list = metadata_hasxml.split("\n")
-      
-    metadata_list_new = []
-
-    for element in metadata_list:
-
-        # Envipath annotations seem to be incorrect
-        if ("envipath" in element) or ("hmdb" in element):
-            continue
-            
-        if ("biocyc" in element):
-            continue
-            
-            
-
-        if match_func(element,unresolvable_re):
-            print(f"\t Removing unresolvable annotation (according to BioModels): {element}")
-            continue
-            
-        element_new = change_uri(element,ismet=True)
-        
-        # split duplicated items in the database
-        match = re.search(r'(.*?pubchem\.compound:)([\d\s]+)"', element_new)
-        if match:
-            prefix = match.group(1)  # Extract the prefix
-            numbers = match.group(2).strip().split()  # Extract the numbers, removing extra spaces
-            for number in numbers:
-                metadata_list_new.append(prefix+number+'"/>' )
-        else:
-            metadata_list_new.append(element_new)
-            
-
-    metadata_list_new = list(OrderedDict.fromkeys(metadata_list_new))
-    metadata_new = "\n".join(metadata_list_new)
-    model.metabolites[met].metadata["XMLAnnotation"] = metadata_new
+store = AnnotationStore.from_model(model, ismet=True)
+store.apply(model, RewriteEngine(map_mets, unresolvable_re, M_prefix, ismet=True).rewrite_store(store))
 
 model.update()
 
 #### For all relevant URIs: check if URI is valid
 print("checking URIs for metabolites...\n Having problems with following URIs:")
+results = resolver.resolve(collect_uris(model, ismet=True))
 for met in model.metabolites:
-    metadata_new = process_metadata(model,met)
+    metadata_new = process_metadata(model,met,results)
     model.metabolites[met].metadata["XMLAnnotation"] = metadata_new
 
 print("save temporary model...")
@@ -287,49 +129,19 @@ for rxn in model.reactions:
             # SET NEW METADATA
             if "XMLAnnoation" in draft_metadata.keys():
                 model.reactions[rxn].metadata["XMLAnnoation"] = copy.copy(model_draft.reactions[rxn].metadata["XMLAnnoation"])   
-        
-    metadata_hasxml = metadata["XMLAnnotation"]
-    metadata_list = metadata_hasxml.split("\n")
-    metadata_list_new = []
 
-    for element in metadata_list:
-        #Brenda references do not work
-        if ("brenda" in element):
-            continue
-            
-        if ("biocyc" in element):
-            continue
-
-        if match_func(element,unresolvable_re):
-            print(f"\t Removing unresolvable annotation (according to BioModels): {element}")
-            continue
-            
-        # exchange reactions should not have other associations with other bigg reactions    
-        if ("bigg" in element) and (rxn[2:].startswith("EX_")) and (rxn[2:] not in element):
-            continue
-            
-        if 'ec-code' in element:
-            match_ec = re.search(r'ec-code/(.+?)"/>', element)
-            extracted = match_ec.group(1)
-            
-            if not bool(re.fullmatch(r'[\d.]+', extracted)):
-                continue
-                
-        element_new = change_uri(element,ismet=False)
-        
-        metadata_list_new.append(element_new)
-        
-    metadata_list_new = list(OrderedDict.fromkeys(metadata_list_new))
-    metadata_new = "\n".join(metadata_list_new)
-    model.reactions[rxn].metadata["XMLAnnotation"] = metadata_new
+store = AnnotationStore.from_model(model, ismet=False)
+store.apply(model, RewriteEngine(map_rxns, unresolvable_re, M_prefix, ismet=False).rewrite_store(store))
 
 model.update()
 
 
 print("checking URIs for reactions...\n Having problems with following URIs:")
+results = resolver.resolve(collect_uris(model, ismet=False))
 for rxn in model.reactions:
-    metadata_new = process_metadata(model,rxn,ismet=False)
+    metadata_new = process_metadata(model,rxn,results,ismet=False)
     model.reactions[rxn].metadata["XMLAnnotation"] = metadata_new
     
 print("save model '../models/RcH10_final.xml'")
-reframed.save_cbmodel(model,"../models/RcH10_final.xml")
\ No newline at end of file
+reframed.save_cbmodel(model,"../models/RcH10_final.xml")
+resolver.close()
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+import aiohttp
+
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36"
+}
+
+
+class StubURIServer:
+    """
+    Local HTTP server standing in for the annotation websites (offline mode).
+
+    A request for ``/<quoted uri>`` is answered with responses[uri] (an HTTP
+    status code), or default_status for URIs that are not listed.
+
+        with StubURIServer({"https://identifiers.org/kegg.compound:C0": 404}) as server:
+            results = URIResolver(base_url=server.url).resolve(uris)
+    """
+
+    def __init__(self, responses=None, default_status=200):
+        self.responses = dict(responses or {})
+        self.default_status = default_status
+        self.requests = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                uri = unquote(self.path[1:])
+                stub.requests.append(uri)
+                self.send_response(stub.responses.get(uri, stub.default_status))
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class URIResolver:
+    """
+    Resolvability check of annotation URIs with a persistent cache.
+
+    URIs are deduplicated, looked up in a JSON cache (entries older than ttl
+    seconds are checked again) and the rest are requested concurrently with
+    aiohttp over one pooled session: at most `limit` connections in total and
+    `limit_per_host` per host. Timeouts and connection errors are retried with
+    exponential backoff, as in fix_annotation.is_resolvable_http; a URI is
+    resolvable if the final response has a status below 400. Only HTTP answers
+    are cached; URIs that still fail on timeouts or connection errors are
+    reported unresolvable for this run and checked again on the next.
+
+    With offline=True (or an explicit base_url) requests go to a StubURIServer
+    instead of the internet and nothing is written to the cache.
+
+    resolve is synchronous. Inside a running event loop (a Jupyter notebook) the
+    requests run on a loop in a separate thread, so it can be called from the
+    curation notebooks as well as from scripts.
+    """
+
+    def __init__(self, cache_path="../results/uri_cache.json", ttl=30*24*3600, limit=20, limit_per_host=5,
+                 max_retries=5, base_delay=2, offline=False, responses=None, base_url=None):
+        self.ttl = ttl
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+
+        self.stub = None
+        if offline and base_url is None:
+            self.stub = StubURIServer(responses).start()
+            base_url = self.stub.url
+        self.base_url = base_url
+        self.cache_path = None if base_url is not None else cache_path
+
+        self.cache = {}
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            with open(self.cache_path) as f:
+                self.cache = json.load(f)
+
+    def close(self):
+        if self.stub is not None:
+            self.stub.stop()
+            self.stub = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _url(self, uri):
+        if self.base_url is None:
+            return uri
+        return f"{self.base_url}/{quote(uri, safe='')}"
+
+    async def _check(self, session, semaphores, uri):
+        """(uri, resolvable, definitive); only HTTP answers are definitive, transport failures are not."""
+        url = self._url(uri)
+        host = urlsplit(url).netloc
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        semaphore = semaphores[host]
+        
+        timeout = 3
+        if "CHEBI" in uri: # The website needs more time to load...
+            timeout = 10
+
+        for attempt in range(self.max_retries):
+            try:
+                async with semaphore:
+                    # Connect and read timeouts only, so waiting for a pooled connection does not count
+                    async with session.get(url, allow_redirects=True,
+                                           timeout=aiohttp.ClientTimeout(sock_connect=timeout,
+                                                                         sock_read=timeout)) as response:
+                        return uri, response.status < 400, True
+
+            except asyncio.TimeoutError:
+                if attempt==0:
+                    print(f"\t Timeout for {uri}. Retrying...")
+
+            except aiohttp.ClientConnectionError:
+                if attempt==0:
+                    print(f"\t Connection error {uri}. Retrying...")
+
+            except aiohttp.ClientError as e:
+                print(f"\t Other request error for {uri}: {e}")
+                return uri, False, False
+
+            # Wait before retrying, without blocking the other requests
+            await asyncio.sleep(self.base_delay * (2 ** attempt))
+
+            # Increase timeout but limit it
+            timeout = min(timeout*2, 10)
+
+        print(f"\t Failed to connect to {uri} after {self.max_retries} retries.")
+        return uri, False, False
+
+    async def _check_all(self, uris):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+        # One semaphore per host bounds the requests waiting for that host's connections
+        semaphores = {}
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+            return await asyncio.gather(*(self._check(session, semaphores, uri) for uri in uris))
+
+    def _run(self, coroutine):
+        """Run coroutine to completion, on a separate thread if this thread already runs an event loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        result = {}
+
+        def run():
+            try:
+                result["value"] = asyncio.run(coroutine)
+            except BaseException as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def resolve(self, uris):
+        """{uri: resolvable} for all given URIs, checking only those without a valid cache entry."""
+        uris = list(dict.fromkeys(uris))
+        now = time.time()
+
+        pending = [uri for uri in uris
+                   if uri not in self.cache or now - self.cache[uri]["time"] > self.ttl]
+        results = {}
+        if pending:
+            by_host = {}
+            for uri in pending:
+                by_host.setdefault(urlsplit(uri).netloc, 0)
+                by_host[urlsplit(uri).netloc] += 1
+            print(f"\t checking {len(pending)} URIs on {len(by_host)} hosts "
+                  f"({len(uris) - len(pending)} cached)")
+
+            for uri, resolvable, definitive in self._run(self._check_all(pending)):
+                results[uri] = resolvable
+                # Transport failures are retried on the next run instead of being cached for ttl
+                if definitive:
+                    self.cache[uri] = {"resolvable": resolvable, "time": now}
+            self._save()
+
+        return {uri: results[uri] if uri in results else self.cache[uri]["resolvable"] for uri in uris}